@@ -1,25 +1,40 @@
-import csv
 import datetime
 import functools
+import json
 import math
 import os
 import shutil as sh
+import socket
+import sys
 import time
-import zipfile
-from io import BytesIO, StringIO
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from secrets import token_urlsafe
-from threading import Thread
+from secrets import token_hex, token_urlsafe
+from threading import Event, Thread
 from urllib.parse import quote, unquote
 
-from flask import (Flask, render_template, url_for, request, redirect, jsonify, session, flash, send_file, )
-from flask_migrate import Migrate
+import click
+from flask.cli import AppGroup
+from flask import (Flask, render_template, url_for, request, redirect, jsonify, session, flash, send_file,
+                   Response, stream_with_context, )
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from models import control, log_store, scheduler
 from models.explorer import (get_sorted_files, get_file_info, format_file_size, datetimeformat, query_string, )
-from models.mail_mod import send_email_with_attachment, progress_data
-from models.pdf_rel import splitter, base_dir, progress
+from models.mail_mod import (send_batch_with_attachments, simulate_batch, progress_data, send_batch_size,
+                             take_bounces, )
+from models.log_export import stream_zip, stream_gzip
+from models.log_store import LIVE_LOG_SIZE
+from models.metrics import metrics_data, start_task, finish_task, timed, incr, render_prometheus
+from models.pdf_rel import splitter, batch_splitter, colliding_outputs, output_folder, base_dir, progress, batch_progress
+from models.profiling import PROFILERS, PROFILE_FILES, run_profiled, list_profiles
+from models.split_index import load_index, files_in, record_moves, forget, path_of, move_file
+from models.send_window import make_schedule, next_opening, paced_rate
+from models.tasks import tasks_dir
+from models.trash import move_to_trash, claim_leftovers, purge
+from models.uploads import CHUNK_SIZE, UploadError, upload_id_for, start_upload, write_part, save_upload
 
 app = Flask(__name__)
 app.secret_key = token_urlsafe(32)
@@ -27,7 +42,21 @@ db_path = os.path.abspath("db.sqlite")
 app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{db_path}"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 db = SQLAlchemy(app)
-migrate = Migrate(app, db)
+
+# Entries per page of the retry page's log and error tables
+LOG_PAGE_SIZE = {"logs": 20, "errors": 15}
+
+# Seconds a worker's claim on a batch of send items lasts without a heartbeat
+LEASE_SECONDS = 60
+
+# Seconds between heartbeats renewing a worker's lease
+HEARTBEAT_INTERVAL = 20
+
+# Claims after which an item whose lease keeps lapsing is failed instead of claimed again
+MAX_LEASES = 3
+
+# Seconds an idle worker or coordinator waits before looking for work again
+WORKER_POLL = 2.0
 
 
 class User(db.Model):
@@ -115,6 +144,69 @@ class UnknownUser(db.Model):
     ippis = db.Column(db.String(20), nullable=False)
 
 
+class Suppression(db.Model):
+    """
+    An address never mailed again: it hard-bounced, was rejected as invalid or opted out.
+
+    Attributes:
+        id (int): Primary key for the record.
+        email (str): The address, lowercased (unique, not null).
+        reason (str): "bounce", "invalid" or "opt_out".
+        detail (str): The SMTP reply that caused it, or a note.
+        created (datetime): When the address was added.
+    """
+
+    __tablename__ = "suppressions"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    email = db.Column(db.String(100), unique=True, nullable=False)
+    reason = db.Column(db.String(10), nullable=False)
+    detail = db.Column(db.Text, nullable=True)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.datetime.now)
+
+
+class SendItem(db.Model):
+    """
+    One file of a shared send job, claimed in batches by worker processes (see `claim_batch`).
+
+    Attributes:
+        id (int): Primary key for the item.
+        task_id (str): The send task the item belongs to.
+        folder (str): The split folder holding the file.
+        file (str): The file name.
+        ippis (str): IPPIS number of the recipient.
+        batch (int): Items with the same batch number are claimed and sent together.
+        state (str): "pending", "leased", "sent", "failed" or "canceled".
+        lease (str): Token of the claim holding the item, while leased.
+        lease_expires (float): When the lease lapses unless renewed by a heartbeat.
+        attempts (int): Times the item has been claimed.
+        email (str): Address the worker sent to.
+        error (str): The send result message.
+        location (str): Where the worker moved the file, once done.
+        finished (float): When the item was done.
+        reported (bool): Whether the task's coordinator has logged the result.
+        hold_until (float): The item is not claimed before then, while its task is paused or
+            outside its sending windows (see `send_distributed`).
+    """
+
+    __tablename__ = "send_items"
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    task_id = db.Column(db.String(40), nullable=False, index=True)
+    folder = db.Column(db.String(500), nullable=False)
+    file = db.Column(db.String(255), nullable=False)
+    ippis = db.Column(db.String(20), nullable=False)
+    batch = db.Column(db.Integer, nullable=False)
+    state = db.Column(db.String(10), nullable=False, default="pending", index=True)
+    lease = db.Column(db.String(100), nullable=True, index=True)
+    lease_expires = db.Column(db.Float, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    email = db.Column(db.String(100), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    location = db.Column(db.String(20), nullable=True)
+    finished = db.Column(db.Float, nullable=True)
+    reported = db.Column(db.Boolean, nullable=False, default=False)
+    hold_until = db.Column(db.Float, nullable=True)
+
+
 class Admins(db.Model):
     """
     Represents an administrator user with login credentials.
@@ -207,6 +299,134 @@ def login_required(route):
     return wrapper
 
 
+def start_job(task_id, target, *args):
+    """
+    Queues a background job with the scheduler (see `models.scheduler`).
+
+    The job waits in the queue of its task kind (taken from the task's metrics record)
+    until one of the queue's `JOB_LIMITS` slots is free, with slots shared fairly between
+    the admins who queued jobs. When the submitted form carries a `profile` field naming
+    one of `PROFILERS`, the job is wrapped in `run_profiled` so its profile is saved with
+    the task.
+
+    Args:
+        task_id (str): The unique identifier for the task.
+        target (callable): The job function.
+        *args: Arguments for `target`.
+    """
+    kind = metrics_data[task_id]["kind"] if task_id in metrics_data else "job"
+    owner = session.get("username")
+    profile = request.form.get("profile")
+    if profile in PROFILERS:
+        scheduler.submit(task_id, kind, owner, run_profiled, profile, task_id, target, *args)
+    else:
+        scheduler.submit(task_id, kind, owner, target, *args)
+
+
+def expire_tasks():
+    """
+    Drops tasks past `log_store.TASK_TTL` from the log store and from the in-memory
+    `progress`, `batch_progress`, `progress_data` and `metrics_data` dictionaries.
+    """
+    for task_id in log_store.expire():
+        progress.pop(task_id, None)
+        batch_progress.pop(task_id, None)
+        progress_data.pop(task_id, None)
+        metrics_data.pop(task_id, None)
+        control.forget(task_id)
+
+
+def create_mail_task(task_id, dry_run=False):
+    """
+    Registers a new email sending task.
+
+    The task's entry in `progress_data` only keeps the latest `LIVE_LOG_SIZE` logs and
+    errors for the live view; the complete history is written to `log_store`. Its `accounts`
+    are filled with each sender account's results by `send_batch_with_attachments`.
+
+    Args:
+        task_id (str): The unique identifier for the email sending task.
+        dry_run (bool): The task simulates a run (see `send_in_batches`).
+    """
+    expire_tasks()
+    log_store.create_task(task_id)
+    progress_data[task_id] = {"logs": deque(maxlen=LIVE_LOG_SIZE), "errors": deque(maxlen=LIVE_LOG_SIZE),
+                              "status": "running", "total": 0, "sent": 0, "failed": 0,
+                              "completed": False, "cancelled": False, "metrics": start_task(task_id, "mail"),
+                              "dry_run": dry_run, "invalid": 0, "projection": None, "accounts": {},
+                              "resume_at": None, "pace": None, "suppressed": 0, }
+    control.register(task_id)
+
+
+def suppressed_addresses():
+    """Loads the suppression list into a set of lowercased addresses, for constant-time checks."""
+    return {email for (email,) in db.session.query(Suppression.email)}
+
+
+def suppress(entries):
+    """
+    Adds addresses to the suppression list; those already on it keep their first reason.
+
+    Args:
+        entries (list): (email, reason, detail) tuples, e.g. from `take_bounces`.
+
+    Returns:
+        int: Addresses added.
+    """
+    new = {}
+    for email, reason, detail in entries:
+        new.setdefault(email.strip().lower(), (reason, detail))
+    if not new:
+        return 0
+    existing = {email for (email,) in db.session.query(Suppression.email).filter(Suppression.email.in_(list(new)))}
+    added = [{"email": email, "reason": reason, "detail": detail, "created": datetime.datetime.now()}
+             for email, (reason, detail) in new.items() if email not in existing]
+    db.session.bulk_insert_mappings(Suppression, added)
+    db.session.commit()
+    return len(added)
+
+
+def drop_suppressed(task_id, files, ippis_of):
+    """
+    Removes the files whose recipient is on the suppression list before anything is built
+    for them. Each one is logged with status "suppressed" and counted in the task's
+    `suppressed`; the files stay where they are.
+
+    Args:
+        task_id (str): The unique identifier for the email sending task.
+        files (list): File names to send.
+        ippis_of (callable): Returns the IPPIS number of a file name.
+
+    Returns:
+        list: The files to send.
+    """
+    suppressed = suppressed_addresses()
+    if not suppressed:
+        return files
+    emails = dict(db.session.query(User.ippis, User.email))
+    kept, logs = [], []
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    for file in files:
+        email = emails.get(ippis_of(file))
+        if email and email.lower() in suppressed:
+            logs.append({"timestamp": timestamp, "status": "suppressed",
+                         "message": f"{email} is on the suppression list.", "file": file, "email": email, })
+        else:
+            kept.append(file)
+    progress_data[task_id]["suppressed"] = len(logs)
+    incr(task_id, "suppressed", len(logs))
+    record_entries(task_id, logs, [])
+    return kept
+
+
+def record_entries(task_id, logs, errors):
+    """Adds a batch of log and error entries to the task's live view and to the log store."""
+    progress_data[task_id]["logs"].extend(logs)
+    progress_data[task_id]["errors"].extend(errors)
+    log_store.append(task_id, "logs", logs)
+    log_store.append(task_id, "errors", errors)
+
+
 @app.route("/")
 @app.route("/login/", methods=["GET", "POST"])
 def login():
@@ -283,13 +503,9 @@ def upload():
     if not os.path.exists(base_dir):
         os.makedirs(base_dir)
 
-    # Save the file to the file system.
+    # Save the file to the file system, replacing any file of the same name.
     if file and filename != "":
-        full_path = os.path.join(base_dir, filename)
-        # Remove the full path if it exists.
-        if os.path.exists(full_path):
-            os.remove(full_path)
-        file.save(full_path)
+        save_upload(file.stream, filename)
         flash(f"{file.filename} saved successfully.", "success")
 
     else:
@@ -298,6 +514,59 @@ def upload():
     return redirect(url_for("directories", rel_directory='base_dir'))
 
 
+@app.route("/upload/chunked/", methods=["POST"])
+@login_required
+def upload_chunked_start():
+    """
+    Starts or resumes a chunked upload.
+
+    Expects `filename`, `size` and a client `key` (e.g. name, size and modification time)
+    in the form. The same key always maps to the same upload, so a browser that lost its
+    connection can ask again and continue from the returned offset.
+
+    Returns:
+        flask.json. jsonify: The upload ID, the offset to send next and the part size to use.
+    """
+    filename = os.path.basename(request.form.get("filename", ""))
+    size = request.form.get("size", type=int)
+    key = request.form.get("key", "")
+    if not filename or size is None or size < 0:
+        return jsonify({"error": "filename and size are required"}), 400
+
+    upload_id = upload_id_for(f"{key}:{filename}:{size}")
+    state = start_upload(upload_id, filename, size)
+    return jsonify({"upload_id": upload_id, "offset": state["offset"], "chunk_size": CHUNK_SIZE})
+
+
+@app.route("/upload/chunked/<upload_id>/", methods=["PUT"])
+@login_required
+def upload_chunked_part(upload_id):
+    """
+    Receives one part of a chunked upload as the raw request body.
+
+    The `offset` query argument must equal the number of bytes already received. The part
+    is streamed to a temporary file and hashed on the fly; after the last part the file is
+    renamed into the base directory, or dropped if an identical file is already there.
+
+    Returns:
+        flask.json. jsonify: The new offset and, when complete, the SHA-256 and a redirect URL.
+    """
+    offset = request.args.get("offset", type=int)
+    try:
+        result = write_part(upload_id, offset, request.stream)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), 409
+
+    if result["complete"]:
+        name = Path(result["path"]).name
+        if result["duplicate_of"]:
+            flash(f"An identical file is already stored as {name}, upload skipped.", "success")
+        else:
+            flash(f"{name} saved successfully.", "success")
+        result["redirect"] = url_for("directories", rel_directory='base_dir')
+    return jsonify(result)
+
+
 @app.route("/directories/", methods=["GET", "POST"])
 @login_required
 def directories():
@@ -388,8 +657,12 @@ def delete_file_or_directory():
     Delete a file or directory. This is a form to delete a file
     or directory.
 
+    A directory is renamed into the trash at once and purged by a background job
+    (see `models.trash.purge`), which also picks up anything earlier purges left behind.
+
     Returns:
-        Redirect to the directories page if request method is POST
+        Redirect to the directories page if request method is POST, or the progress
+            page of the purge when a directory was moved to the trash
     """
     # This is a POST request.
     if request.method == "POST":
@@ -404,10 +677,27 @@ def delete_file_or_directory():
                 name = Path(path).name
                 if os.path.isfile(path):
                     os.remove(path)
+                    forget(path)
                     flash(f"{name} deleted successfully!", "success")
                 elif os.path.isdir(path):
-                    sh.rmtree(path)
-                    flash(f"{name} deleted successfully!", "success")
+                    try:
+                        move_to_trash(path)
+                    except OSError:
+                        # Not renameable into the trash (e.g. another file system): delete in place
+                        sh.rmtree(path)
+                        flash(f"{name} deleted successfully!", "success")
+                    else:
+                        # The folder is gone from its parent; its contents are purged in the background
+                        task_id = str(time.time())
+                        expire_tasks()
+                        log_store.create_task(task_id)
+                        progress[task_id] = 0
+                        start_task(task_id, "purge")
+                        control.register(task_id)
+                        start_job(task_id, purge, task_id, claim_leftovers())
+                        flash(f"{name} deleted successfully!", "success")
+                        return render_template("progress.html", task_id=task_id,
+                                               redirect_url=url_for("directories", rel_directory=current_directory))
             else:
                 flash("File or directory does not exist.", "error")
         except Exception as e:
@@ -454,7 +744,8 @@ def split_encrypt():
     Initiates the process of splitting and encrypting a file uploaded through a POST request.
 
     This route handles file splitting and encryption requests. It expects a file path
-    to be submitted in the request form under the key "file".
+    to be submitted in the request form under the key "file", and writes a sharded
+    output folder when "shard" is set (see `splitter`).
 
     Args:
         The incoming request object.
@@ -468,7 +759,11 @@ def split_encrypt():
     """
     try:
         task_id = str(time.time())  # Generate a unique task ID
+        expire_tasks()
+        log_store.create_task(task_id)
         progress[task_id] = 0  # Initialize progress
+        start_task(task_id, "split")
+        control.register(task_id)
 
         file = request.form.get("file")
         file = Path(file)
@@ -478,8 +773,7 @@ def split_encrypt():
         folder_encoded = quote(file_path)
 
         # Run the splitter function in a separate thread for asynchronous processing.
-        thread = Thread(target=splitter, args=(str(file), file_path, task_id))
-        thread.start()
+        start_job(task_id, splitter, str(file), file_path, task_id, None, bool(request.form.get("shard")))
 
         return render_template("progress.html", task_id=task_id, folder=folder_encoded)
 
@@ -488,6 +782,55 @@ def split_encrypt():
         return redirect(url_for("directories", rel_directory='base_dir'))
 
 
+@app.route("/split_batch/", methods=["POST"])
+@login_required
+def split_batch():
+    """
+    Splits and encrypts many PDFs in one background job.
+
+    The PDFs are either every PDF directly inside the submitted "folder", or the paths
+    submitted as a list under "files". Each one is split into its own output folder by
+    the shared worker process pool (see `batch_splitter`), sharded when "shard" is set.
+
+    Returns:
+        flask.Response: The rendered progress.html template, which shows per-file progress
+            and returns to the directory listing when the batch is done.
+    """
+    folder = request.form.get("folder")
+    if folder:
+        files = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                       if name.lower().endswith(".pdf") and os.path.isfile(os.path.join(folder, name)))
+    else:
+        files = [file for file in request.form.getlist("files") if file.lower().endswith(".pdf")]
+
+    if not files:
+        flash("No PDF files to split.", "error")
+        return redirect(url_for("directories", rel_directory='base_dir'))
+
+    conflicts = colliding_outputs(files)
+    if conflicts:
+        flash("These PDFs would be split into the same folder, split them separately or rename them: "
+              + "; ".join(", ".join(shared) for shared in conflicts.values()), "error")
+        return redirect(url_for("directories", rel_directory='base_dir'))
+
+    try:
+        task_id = str(time.time())
+        expire_tasks()
+        log_store.create_task(task_id)
+        progress[task_id] = 0
+        start_task(task_id, "split_batch")
+        control.register(task_id)
+
+        start_job(task_id, batch_splitter, files, task_id, None, bool(request.form.get("shard")))
+
+        return render_template("progress.html", task_id=task_id,
+                               redirect_url=url_for("directories", rel_directory='base_dir'))
+
+    except Exception as e:
+        flash(f"An error occurred while splitting the files.\n{e}", "error")
+        return redirect(url_for("directories", rel_directory='base_dir'))
+
+
 @app.route("/progress/<task_id>")
 def progress_status(task_id):
     """
@@ -500,9 +843,48 @@ def progress_status(task_id):
         task_id (str): The unique identifier for the split and encrypt task.
 
     Returns:
-        flask.json. jsonify: A JSON response containing the progress value (integer).
+        flask.json. jsonify: A JSON response containing the progress value (integer), the task's
+            stage timings and counters, the number of pages no payslip layout matched, the page
+            cache hit rate and, for batch splits, the progress of each file.
+    """
+    return jsonify(split_progress(task_id))
+
+
+def split_progress(task_id):
+    """Builds the progress payload of a split task, shared by `progress_status` and the ASGI entry point."""
+    files = {Path(file).name: value for file, value in batch_progress.get(task_id, {}).items()}
+    task_metrics = metrics_data.get(task_id)
+    counters = task_metrics["counters"] if task_metrics else {}
+    lookups = counters.get("cache_hits", 0) + counters.get("cache_misses", 0)
+    return {"progress": progress.get(task_id, 0), "metrics": task_metrics,
+            "unmatched": counters.get("pages_unparsed", 0), "bytes_saved": counters.get("bytes_saved", 0),
+            "cache_hit_rate": counters.get("cache_hits", 0) / lookups if lookups else None,
+            "files": files, "queue": scheduler.job_status(task_id),
+            "paused": control.is_paused(task_id), "canceled": control.is_canceled(task_id)}
+
+
+@app.route("/jobs/")
+@login_required
+def jobs():
+    """
+    Shows the scheduler's queues: for each job type, its concurrency limit, the running
+    jobs and the waiting jobs in the order they will start.
+
+    Returns:
+        flask.json. jsonify: A JSON response as built by `scheduler.snapshot`.
+    """
+    return jsonify(scheduler.snapshot())
+
+
+@app.route("/metrics")
+def metrics():
+    """
+    Exposes per-task stage timing histograms and counters in the Prometheus text format.
+
+    Returns:
+        flask.Response: A text/plain response suitable for a Prometheus scrape.
     """
-    return jsonify({"progress": progress.get(task_id, 0)})
+    return Response(render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 @app.route("/query_db/", methods=["GET", "POST"])
@@ -554,9 +936,30 @@ def results():
         return redirect(url_for("directories", rel_directory='base_dir'))
 
     folder = unquote(folder_encoded)
-    db_found = User.query.all()
+    active_found, inactive, unknown = reconcile(folder)
+
+    session["folder"] = folder_encoded
+    session["active_count"] = len(active_found)
+    session["inactive_count"] = len(inactive)
+    session["unknown_count"] = len(unknown)
+
+    return render_template("results.html",
+                           active=len(active_found), inactive=len(inactive), unknown=len(unknown),
+                           folder=folder, )
+
+
+def reconcile(folder):
+    """
+    Categorizes the users a split folder has payslips for and stores the result in the
+    ActiveUser, InactiveUser and UnknownUser tables, replacing the previous one.
+
+    Args:
+        folder (str): The split folder.
 
-    active_found, inactive, unknown = query_string(folder, db_found)
+    Returns:
+        tuple: The active, inactive and unknown IPPIS numbers (see `query_string`).
+    """
+    active_found, inactive, unknown = query_string(folder, User.query.all())
 
     ActiveUser.query.delete()
     InactiveUser.query.delete()
@@ -566,15 +969,7 @@ def results():
     db.session.bulk_insert_mappings(InactiveUser, [{"ippis": ippis} for ippis in inactive])
     db.session.bulk_insert_mappings(UnknownUser, [{"ippis": ippis} for ippis in unknown])
     db.session.commit()
-
-    session["folder"] = folder_encoded
-    session["active_count"] = len(active_found)
-    session["inactive_count"] = len(inactive)
-    session["unknown_count"] = len(unknown)
-
-    return render_template("results.html",
-                           active=len(active_found), inactive=len(inactive), unknown=len(unknown),
-                           folder=folder, )
+    return active_found, inactive, unknown
 
 
 @app.route("/view_users/<category>/", methods=["GET", "POST"])
@@ -650,8 +1045,13 @@ def send_mail():
 
     This route handles POST requests to send email notifications to users
     with attached PDFs. It retrieves the folder path from the request form,
-    generates a unique task ID for progress tracking, and initializes a dictionary
-    `progress_data` to store task information (logs, errors, status, counts).
+    generates a unique task ID for progress tracking, and registers the task with
+    `create_mail_task` to store task information (logs, errors, status, counts).
+
+    A "dry_run" field in the form runs a simulation instead (see `send_in_batches`), and a
+    "distribute" field lets worker processes share the sending (see `send_distributed`).
+    "windows" (e.g. "22:00-06:00") and "finish_by" schedule the sending into off-peak
+    hours, paced to finish by that time (see `models.send_window`).
 
     Args:
         The incoming request object.
@@ -661,22 +1061,27 @@ def send_mail():
             encoded folder path, and filename for progress visualization.
     """
     folder = request.form.get("folder")
+    dry_run = bool(request.form.get("dry_run"))
+    distribute = bool(request.form.get("distribute"))
+    try:
+        schedule = make_schedule(request.form.get("windows"), request.form.get("finish_by"))
+    except ValueError as e:
+        flash(str(e), "error")
+        return redirect(url_for("results"))
     task_id = str(time.time())  # Generate a unique task ID
-    progress_data[task_id] = {"logs": [], "errors": [], "status": "running", "total": 0, "sent": 0, "failed": 0,
-                              "completed": False, "cancelled": False, }
+    create_mail_task(task_id, dry_run=dry_run)
 
     file_name = Path(folder).name
     folder_encoded = quote(folder)
 
     # Run the email sending function in the background
-    thread = Thread(target=send_emails, args=(folder, task_id))
-    thread.start()
+    start_job(task_id, send_emails, folder, task_id, 1, None, dry_run, distribute, schedule)
 
     return render_template("results_visual.html",
                            task_id=task_id, folder=folder_encoded, filename=file_name, )
 
 
-def send_emails(folder, task_id):
+def send_emails(folder, task_id, workers=1, rate=None, dry_run=False, distribute=False, schedule=None):
     """
     Sends emails with attachments to users listed in the specified folder.
 
@@ -684,14 +1089,23 @@ def send_emails(folder, task_id):
         1. Defines paths for success and failed email folders within the given folder.
         2. Creates the folders if they don't exist.
         3. Retrieves a list of active users' IPPIS from the database.
-        4. Filters files within the folder based on active users' IPPIS.
-        5. Iterates through each file, sending an email with the attachment to the
-           corresponding user. Updates progress data and logs based on success/failure.
+        4. Picks the folder's files of active users from its index (see `models.split_index`),
+           leaving out recipients on the suppression list (see `drop_suppressed`).
+        5. Sends the files with `send_in_batches`, moving each file into the success or
+           failed folder as its result arrives, or shares them out as work items with
+           `send_distributed` when `distribute` is set.
         6. Marks the task as completed in `progress_data`.
 
     Args:
         folder (str): The path to the folder containing email attachments.
         task_id (str): The unique identifier for the email sending task.
+        workers (int): Batches sent at the same time, each over its own SMTP connection.
+        rate (float, optional): Most messages sent per second.
+        dry_run (bool): Simulate the run without sending or moving anything (see `send_in_batches`).
+        distribute (bool): Let `flask payroll worker` processes share the sending; `workers`,
+            `rate` and the schedule's target finish time then do not apply, and a dry run is
+            never distributed.
+        schedule (dict, optional): Sending windows and target finish time (see `send_in_batches`).
 
     Raises:
         Exception: If an error occurs during email sending or file operations.
@@ -700,46 +1114,516 @@ def send_emails(folder, task_id):
         success = os.path.join(folder, "success_mail")
         failed = os.path.join(folder, "failed_mail")
 
-        if not os.path.exists(success):
+        if not os.path.exists(success) and not dry_run:
             os.makedirs(success)
-        if not os.path.exists(failed):
+        if not os.path.exists(failed) and not dry_run:
             os.makedirs(failed)
 
-        active = [user.ippis for user in ActiveUser.query.all()]
-        files_list = [file for file in os.listdir(folder) if file.endswith(".pdf")]
-        files = [file for file in files_list if file.split("_")[0] in active]
-
-        progress_data[task_id]["total"] = len(files)
+        active = {user.ippis for user in ActiveUser.query.all()}
+        index = load_index(folder)
+        files = files_in(folder, ippis=active, entries=index)
+        files = drop_suppressed(task_id, files, lambda file: index[file]["ippis"])
 
-        for file in files:
-            if progress_data[task_id]["status"] == "canceled":
-                break
-            ippis = file.split("_")[0]
+        def job(file):
+            ippis = index[file]["ippis"]
             user = User.query.filter_by(ippis=ippis).first()
-            email = user.email
-            matched_path = os.path.join(folder, file)
+            return user and user.email, ippis, file, path_of(folder, file, index[file])
+
+        def move(file, full_path, sent):
+            return move_file(folder, file, index[file], "success_mail" if sent else "failed_mail", full_path)
 
-            mail_att, error_message = send_email_with_attachment(email, ippis, file, matched_path)
+        try:
+            if distribute and not dry_run:
+                send_distributed(task_id, folder, files, schedule)
+            else:
+                send_in_batches(task_id, folder, files, job, move, workers=workers, rate=rate, dry_run=dry_run,
+                                schedule=schedule)
+        finally:
+            progress_data[task_id]["completed"] = True
+            finish_task(task_id)
+
+
+def send_in_batches(task_id, folder, files, job, move, workers=1, rate=None, dry_run=False, schedule=None):
+    """
+    The mailing loop shared by `send_emails` and `retry_send_emails`.
+
+    Files are sent in batches of `SEND_BATCH_SIZE`, each batch over one pipelined SMTP
+    connection. Up to `workers` batches are in flight at once; their results are handled
+    here, in order, so progress, logs, file moves and the folder's index are only updated
+    from this thread. The loop stops submitting batches when the task is canceled.
 
-            full_path = os.path.join(folder, file)
+    A dry run hands the batches to `simulate_batch` instead, without pacing them, and
+    leaves the files where they are. It counts the messages that would be sent as sent,
+    counts the failures under `invalid` (they are in `log_store` like any task's errors, so
+    the task itself stays small however many there are) and ends with a `projection` of the real run's
+    duration (see `project_duration`).
+
+    Before each batch the loop waits while the task is paused, and stops once it is
+    canceled (see `models.control`); the batches in flight are finished either way.
+
+    A `schedule` (see `models.send_window`) restricts sending to its time windows: outside
+    them the task's status is "paused" with `resume_at` set, and it resumes by itself when
+    the next window opens, unless it was paused or canceled meanwhile. With a target finish
+    time, the pace (`pace`, messages per second, capped by `rate`) is worked out again before
+    each batch from the messages left and the sending time left in the windows before that
+    time. Dry runs ignore the schedule.
+
+    Args:
+        task_id (str): The unique identifier for the email sending task.
+        folder (str): The split folder, whose index records the moves.
+        files (list): File names to send.
+        job (callable): Returns the (email, ippis, file, path) job for a file name.
+        move (callable): Called as `move(file, path, sent)` after each result; returns the
+            file's new location in the index, or None when the file stays where it is.
+        workers (int): Batches sent at the same time.
+        rate (float, optional): Most messages sent per second, spread evenly over the run.
+        dry_run (bool): Simulate the run.
+        schedule (dict, optional): Sending windows and target finish time, from `make_schedule`.
+    """
+    task = progress_data[task_id]
+    task["total"] = len(files)
+    batch_size = send_batch_size()
+    sender = simulate_batch if dry_run else send_batch_with_attachments
+    if dry_run:
+        schedule = None
+    next_batch = time.monotonic()  # When the pace lets the next batch go
+    busy = 0.0  # Seconds spent on lookups and batches, as if run one after another
+    in_flight = deque()
+
+    def run(jobs):
+        batch_started = time.perf_counter()
+        return sender(jobs, task_id), time.perf_counter() - batch_started
+
+    def handle(jobs, future):
+        nonlocal busy
+        outcomes, seconds = future.result()
+        busy += seconds
+        logs, errors, moves = [], [], {}
+        for (email, ippis, file, full_path), (mail_att, error_message) in zip(jobs, outcomes):
             timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
             log_entry = {"timestamp": timestamp,
+                         "status": ("valid" if dry_run else "sent") if mail_att else "failed",
                          "message": (error_message if mail_att else f"Email notification failed to {email}."),
                          "file": file,
                          "email": email, }
-            progress_data[task_id]["logs"].append(log_entry)
+            logs.append(log_entry)
 
+            if not dry_run:
+                with timed(task_id, "file_move"):
+                    location = move(file, full_path, mail_att)
+                if location:
+                    moves[file] = location
             if mail_att:
-                sh.move(full_path, success)
-                progress_data[task_id]["sent"] += 1
+                task["sent"] += 1
+                incr(task_id, "valid" if dry_run else "sent")
             else:
-                sh.move(full_path, failed)
-                progress_data[task_id]["failed"] += 1
-                progress_data[task_id]["errors"].append(
-                    {"file": file, "email": email, "error": error_message, "timestamp": timestamp, })
+                task["failed"] += 1
+                incr(task_id, "failed")
+                errors.append({"file": file, "email": email, "error": error_message, "timestamp": timestamp, })
 
-        progress_data[task_id]["completed"] = True
+        if dry_run:
+            task["invalid"] += len(errors)
+        else:
+            suppress(take_bounces(task_id))
+        record_moves(folder, moves)
+        record_entries(task_id, logs, errors)
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for start in range(0, len(files), batch_size):
+            # Waits here while the task is paused
+            if control.checkpoint(task_id) or task["status"] == "canceled":
+                break
+            pace = None if dry_run else rate
+            if schedule:
+                while wait_for_window(task_id, schedule):
+                    next_batch = time.monotonic()
+                    # Paused or canceled while waiting; once resumed, the window may have closed again
+                    if control.checkpoint(task_id) or task["status"] == "canceled":
+                        break
+                if control.is_canceled(task_id) or task["status"] == "canceled":
+                    break
+                pace = task["pace"] = paced_rate(schedule, len(files) - start, datetime.datetime.now(), rate)
+            if pace:
+                # Hold the batch until the run is back under the rate
+                if control.sleep(task_id, next_batch - time.monotonic()):
+                    break
+                next_batch += min(batch_size, len(files) - start) / pace
+            lookup_started = time.perf_counter()
+            with timed(task_id, "db_lookup"):
+                jobs = [job(file) for file in files[start:start + batch_size]]
+            busy += time.perf_counter() - lookup_started
+            in_flight.append((jobs, pool.submit(run, jobs)))
+            if len(in_flight) >= workers:
+                handle(*in_flight.popleft())
+        while in_flight:
+            handle(*in_flight.popleft())
+
+    if dry_run:
+        simulated = task["sent"] + task["failed"]
+        task["projection"] = project_duration(task["sent"], busy / simulated if simulated else 0.0, workers, rate)
+
+
+def wait_for_window(task_id, schedule):
+    """
+    Pauses a mail task outside its schedule's sending windows until the next one opens,
+    or until the task is canceled.
+
+    Returns:
+        bool: Whether the task had to wait.
+    """
+    task = progress_data[task_id]
+    now = datetime.datetime.now()
+    opening = next_opening(schedule, now)
+    if opening <= now:
+        return False
+    task["status"], task["resume_at"] = "paused", opening.timestamp()
+    control.sleep(task_id, (opening - now).total_seconds())
+    task["resume_at"] = None
+    if task["status"] == "paused" and not control.is_paused(task_id):
+        task["status"] = "running"
+    return True
+
+
+def project_duration(messages, cost, workers=1, rate=None):
+    """
+    Projects how long sending `messages` takes from the cost per message measured by a dry run.
+
+    The dry run covers the lookup, MIME build and envelope of every message but not the DATA
+    step, so the projection is a lower bound that grows with attachment size and link speed.
+
+    Args:
+        messages (int): Messages to send.
+        cost (float): Measured seconds per message, one at a time.
+        workers (int): Batches sent at the same time.
+        rate (float, optional): Most messages sent per second.
+
+    Returns:
+        dict: `messages`, `cost_ms` per message, `workers`, `rate`, the projected `seconds`
+            and whether the workers or the `rate` limit it (`bound`).
+    """
+    by_workers = messages * cost / max(1, workers)
+    by_rate = messages / rate if rate else 0.0
+    return {"messages": messages, "cost_ms": round(cost * 1000, 2), "workers": workers, "rate": rate,
+            "seconds": round(max(by_workers, by_rate), 1), "bound": "rate" if by_rate > by_workers else "workers"}
+
+
+def worker_name():
+    """Names this process in the leases it takes: host name and process ID."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_send(task_id, folder, files, hold_until=None):
+    """
+    Stores a send job's files as `SendItem` work items, `SEND_BATCH_SIZE` to a batch.
+
+    Args:
+        task_id (str): The unique identifier for the email sending task.
+        folder (str): The split folder.
+        files (list): File names to send.
+        hold_until (float, optional): No item is claimed before then.
+    """
+    index = load_index(folder)
+    batch_size = send_batch_size()
+    db.session.bulk_insert_mappings(SendItem, [
+        {"task_id": task_id, "folder": folder, "file": file, "ippis": index[file]["ippis"],
+         "batch": position // batch_size, "state": "pending", "attempts": 0, "reported": False,
+         "hold_until": hold_until}
+        for position, file in enumerate(files)])
+    db.session.commit()
+
+
+def _free(now):
+    return db.or_(SendItem.state == "pending", db.and_(SendItem.state == "leased", SendItem.lease_expires < now))
+
+
+def _claimable(now):
+    return db.and_(_free(now), db.or_(SendItem.hold_until.is_(None), SendItem.hold_until <= now))
+
+
+def claim_batch(owner, task_id=None):
+    """
+    Leases the oldest batch of send items nobody holds, for `LEASE_SECONDS`.
+
+    Items are free when pending or when their lease has lapsed, i.e. the worker holding
+    them stopped sending heartbeats, and are claimed unless their task holds them
+    (`hold_until`). Each claim is a single conditional UPDATE, so two
+    workers racing for a batch cannot both get an item. Items already claimed
+    `MAX_LEASES` times whose lease lapsed again are failed instead (see `_abandon`), so a
+    batch that kills every worker taking it does not go round forever.
+
+    Args:
+        owner (str): The claiming worker, see `worker_name`.
+        task_id (str, optional): Only claim items of this task.
+
+    Returns:
+        tuple: The lease token and the claimed items, or (None, []) when there is no work.
+    """
+    now = time.time()
+    token = f"{owner}:{token_hex(4)}"
+    # Leased to this claim first, so no other worker abandons the same items meanwhile
+    abandoned = SendItem.query.filter(SendItem.state == "leased", SendItem.lease_expires < now,
+                                      SendItem.attempts >= MAX_LEASES).update(
+        {"lease": token, "lease_expires": now + LEASE_SECONDS}, synchronize_session=False)
+    db.session.commit()
+    if abandoned:
+        _abandon(token)
+    while True:
+        query = SendItem.query.filter(_claimable(now))
+        if task_id is not None:
+            query = query.filter(SendItem.task_id == task_id)
+        first = query.order_by(SendItem.task_id, SendItem.batch).first()
+        if first is None:
+            db.session.commit()
+            return None, []
+        claimed = SendItem.query.filter(_claimable(now), SendItem.task_id == first.task_id,
+                                        SendItem.batch == first.batch).update(
+            {"state": "leased", "lease": token, "lease_expires": now + LEASE_SECONDS,
+             "attempts": SendItem.attempts + 1}, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return token, SendItem.query.filter_by(lease=token, state="leased").order_by(SendItem.id).all()
+
+
+def _abandon(token):
+    """
+    Fails the send items of a lapsed lease that `claim_batch` gives up on, with the recipient's
+    address, moving their files to the failed folder as `work_batch` does. A file an earlier
+    attempt already moved is recorded from where it is instead.
+    """
+    items = SendItem.query.filter_by(lease=token, state="leased").all()
+    emails = _emails_of(items)
+    indexes = {}
+    for item in items:
+        email = emails.get(item.ippis)
+        try:
+            if item.folder not in indexes:
+                indexes[item.folder] = load_index(item.folder)
+            entry = indexes[item.folder][item.file]
+            moved = _moved_to(item.folder, item.file, entry)
+            if moved:
+                _finish_item(item, token, moved == "success_mail", email,
+                             f"Recorded from an earlier attempt that moved the file to {moved}.", moved)
+                continue
+            location = move_file(item.folder, item.file, entry, "failed_mail")
+            message = f"Abandoned after {MAX_LEASES} lapsed leases."
+        except Exception as e:
+            location, message = None, f"Abandoned after {MAX_LEASES} lapsed leases; the file could not be moved:\n{e}"
+        _finish_item(item, token, False, email, message, location)
+
+
+def _emails_of(items):
+    """Looks up the addresses of the recipients of some send items, by IPPIS number."""
+    return {user.ippis: user.email for user in User.query.filter(User.ippis.in_({item.ippis for item in items}))}
+
+
+def _heartbeat(token, stop):
+    """Renews a lease every `HEARTBEAT_INTERVAL` seconds until `stop` is set."""
+    with app.app_context():
+        while not stop.wait(HEARTBEAT_INTERVAL):
+            SendItem.query.filter_by(lease=token, state="leased").update(
+                {"lease_expires": time.time() + LEASE_SECONDS}, synchronize_session=False)
+            db.session.commit()
+
+
+def _moved_to(folder, file, entry):
+    """Returns the mail result folder a file was moved to without its index entry being updated yet, if any."""
+    if os.path.exists(path_of(folder, file, entry)):
+        return None
+    for location in ("success_mail", "failed_mail"):
+        if location != entry["location"] and os.path.exists(path_of(folder, file, entry, location)):
+            return location
+    return None
+
+
+def _finish_item(item, token, sent, email, message, location):
+    """Records the result of a send item and commits it, while the lease is still held."""
+    SendItem.query.filter_by(id=item.id, lease=token, state="leased").update(
+        {"state": "sent" if sent else "failed", "email": email, "error": message, "location": location,
+         "finished": time.time()}, synchronize_session=False)
+    db.session.commit()
+
+
+def work_batch(owner, task_id=None):
+    """
+    Claims one batch of send items, sends it and records each result on its item.
+
+    The lease is renewed by a heartbeat thread while the batch is sent. Files are moved to
+    their success or failed folder here; journalling the moves in the folder's index and
+    logging the results is left to the task's coordinator (see `send_distributed`).
+    A result is only recorded while the lease is still held, and each item's result is
+    committed as soon as its file is moved. Items of a batch taken over from a worker that
+    died between the two are recorded from where their file is instead of being sent again.
+    An item that cannot be sent or moved fails on its own without stopping the worker.
+
+    Args:
+        owner (str): The worker, see `worker_name`.
+        task_id (str, optional): Only work on items of this task.
+
+    Returns:
+        int: Items handled; 0 when there was nothing to claim.
+    """
+    token, items = claim_batch(owner, task_id)
+    if not items:
+        return 0
+    stop = Event()
+    Thread(target=_heartbeat, args=(token, stop), daemon=True).start()
+    try:
+        folder = items[0].folder
+        index = load_index(folder)
+        emails = _emails_of(items)
+        to_send, jobs = [], []
+        for item in items:
+            email = emails.get(item.ippis)
+            try:
+                entry = index[item.file]
+                moved = _moved_to(folder, item.file, entry)
+                if moved:
+                    sent = moved == "success_mail"
+                    _finish_item(item, token, sent, email, f"Recorded from an earlier attempt that moved the file "
+                                                           f"to {moved}.", moved)
+                    continue
+                jobs.append((email, item.ippis, item.file, path_of(folder, item.file, entry)))
+                to_send.append(item)
+            except Exception as e:
+                _finish_item(item, token, False, email, f"Error preparing {item.file}:\n{e}", None)
+
+        try:
+            outcomes = send_batch_with_attachments(jobs, items[0].task_id) if jobs else []
+        except Exception as e:
+            outcomes = [(False, f"Error sending the batch:\n{e}")] * len(jobs)
+        for item, (email, _, file, full_path), (sent, message) in zip(to_send, jobs, outcomes):
+            try:
+                with timed(item.task_id, "file_move"):
+                    location = move_file(folder, file, index[file], "success_mail" if sent else "failed_mail",
+                                         full_path)
+            except Exception as e:
+                location, message = None, f"{message}\nThe file could not be moved:\n{e}"
+            _finish_item(item, token, sent, email, message, location)
+        suppress(take_bounces(items[0].task_id))
+    finally:
+        stop.set()
+    return len(items)
+
+
+def report_items(task_id):
+    """
+    Logs the send items of a task finished since the last call, counts them in its
+    progress and journals their file moves, as `send_in_batches` does for its own batches.
+
+    Returns:
+        int: Items reported.
+    """
+    task = progress_data[task_id]
+    items = SendItem.query.filter(SendItem.task_id == task_id, SendItem.state.in_(("sent", "failed")),
+                                  SendItem.reported.is_(False)).order_by(SendItem.finished).all()
+    logs, errors, moves = [], [], {}
+    for item in items:
+        sent = item.state == "sent"
+        timestamp = datetime.datetime.fromtimestamp(item.finished).strftime("%Y-%m-%d %H:%M:%S")
+        logs.append({"timestamp": timestamp, "status": "sent" if sent else "failed",
+                     "message": item.error if sent else f"Email notification failed to {item.email}.",
+                     "file": item.file, "email": item.email, })
+        if item.location:
+            moves.setdefault(item.folder, {})[item.file] = item.location
+        if sent:
+            task["sent"] += 1
+            incr(task_id, "sent")
+        else:
+            task["failed"] += 1
+            incr(task_id, "failed")
+            errors.append({"file": item.file, "email": item.email, "error": item.error, "timestamp": timestamp, })
+    for folder, folder_moves in moves.items():
+        record_moves(folder, folder_moves)
+    record_entries(task_id, logs, errors)
+    if items:
+        SendItem.query.filter(SendItem.id.in_([item.id for item in items])).update(
+            {"reported": True}, synchronize_session=False)
+        db.session.commit()
+    return len(items)
+
+
+def _hold_until(task_id, schedule, held):
+    """
+    Works out until when a distributed send's items must not be claimed (see `send_distributed`).
+
+    Args:
+        task_id (str): The unique identifier for the email sending task.
+        schedule (dict, optional): Sending windows, from `make_schedule`.
+        held (float, optional): The hold last written to the items.
+
+    Returns:
+        tuple: The hold, or None to let the items be claimed, and whether it is a sending window's opening.
+    """
+    now = time.time()
+    if control.is_paused(task_id):
+        # Renewed like a lease while paused, so the items are freed should this coordinator die
+        return (held if held and held - now > LEASE_SECONDS / 2 else now + LEASE_SECONDS), False
+    if schedule:
+        opening = next_opening(schedule, datetime.datetime.now()).timestamp()
+        if opening > now:
+            return opening, True
+    return None, False
+
+
+def send_distributed(task_id, folder, files, schedule=None):
+    """
+    Runs a send job as work items that any number of `flask payroll worker` processes
+    sharing the database and the data folder can help with.
+
+    The files are stored as `SendItem` batches. This thread, the task's coordinator,
+    works on batches itself like any worker and reports every finished item to the
+    task's progress and logs. While the task is paused, or outside the `schedule`'s sending
+    windows, it holds the task's items (`SendItem.hold_until`), so no worker claims another
+    of its batches; the batches in flight are finished. When the task is canceled, items
+    not yet claimed (or whose lease lapsed) are canceled and the batches in flight are
+    waited for. The items are deleted once the task is done. The task is marked completed
+    even if the coordinator fails, so it never shows as running forever.
+
+    Args:
+        task_id (str): The unique identifier for the email sending task.
+        folder (str): The split folder.
+        files (list): File names to send.
+        schedule (dict, optional): Sending windows, from `make_schedule`; its target finish
+            time does not pace a distributed send.
+    """
+    task = progress_data[task_id]
+    task["total"] = len(files)
+    try:
+        held, _ = _hold_until(task_id, schedule, None)  # The hold last written to the task's items
+        enqueue_send(task_id, folder, files, held)
+        owner = worker_name()
+        while True:
+            worked = 0
+            if task["status"] != "canceled":
+                hold, window = _hold_until(task_id, schedule, held)
+                if hold != held:
+                    SendItem.query.filter_by(task_id=task_id).update({"hold_until": hold}, synchronize_session=False)
+                    db.session.commit()
+                    held = hold
+                if window:
+                    task["status"], task["resume_at"] = "paused", hold
+                elif task["resume_at"] is not None:
+                    task["resume_at"] = None
+                    if task["status"] == "paused" and not control.is_paused(task_id):
+                        task["status"] = "running"
+            if task["status"] == "canceled":
+                SendItem.query.filter(SendItem.task_id == task_id, _free(time.time())).update(
+                    {"state": "canceled"}, synchronize_session=False)
+                db.session.commit()
+            elif not held:
+                worked = work_batch(owner, task_id)
+            reported = report_items(task_id)
+            if not SendItem.query.filter(SendItem.task_id == task_id,
+                                         SendItem.state.in_(("pending", "leased"))).count():
+                if not reported:
+                    break
+            elif not worked:
+                time.sleep(WORKER_POLL)
+        SendItem.query.filter_by(task_id=task_id).delete()
+        db.session.commit()
+    finally:
+        task["completed"] = True
 
 
 @app.route("/progress_mail/<task_id>/")
@@ -761,7 +1645,15 @@ def progress_mail(task_id):
         KeyError: If the `task_id` is not found in the `progress_data` dictionary.
     """
 
-    return jsonify(progress_data.get(task_id, {"total": 0, "sent": 0, "failed": 0, "logs": [], "errors": []}))
+    return jsonify(mail_progress(task_id))
+
+
+def mail_progress(task_id):
+    """Builds the progress payload of a mail task, shared by `progress_mail` and the ASGI entry point."""
+    task = progress_data.get(task_id)
+    if task is None:
+        return {"total": 0, "sent": 0, "failed": 0, "logs": [], "errors": [], "completed": True}
+    return dict(task, logs=list(task["logs"]), errors=list(task["errors"]), queue=scheduler.job_status(task_id))
 
 
 @app.route("/retry_page/", methods=["GET", "POST"])
@@ -789,7 +1681,7 @@ def retry_logs():
     Provides paginated access to email sending task logs for a specified task ID.
 
     This route retrieves logs associated with an email sending task from the
-    `progress_data` dictionary. It supports pagination by accepting a page number
+    on-disk `log_store`. It supports pagination by accepting a page number
     as a query argument. The route returns a JSON response containing the requested
     page of logs, total number of logs, and total number of log pages.
 
@@ -800,16 +1692,7 @@ def retry_logs():
         flask.json. jsonify: A JSON response containing paginated email sending task logs,
             total log count, and total number of log pages.
     """
-    task_id = request.args.get("task_id")
-    page = int(request.args.get("page", 1))
-    per_page = 20
-    start = (page - 1) * per_page
-    end = start + per_page
-    logs_paginated = progress_data[task_id]["logs"][start:end]
-    total = len(progress_data[task_id]["logs"])
-    out_of = math.ceil(total / per_page)
-    out_of = out_of if out_of != 0 else 1
-    return jsonify(logs=logs_paginated, total=total, n_logs=out_of)
+    return jsonify(log_page(request.args.get("task_id"), "logs", int(request.args.get("page", 1))))
 
 
 @app.route("/retry_errors/", methods=["GET"])
@@ -818,7 +1701,7 @@ def retry_errors():
     Provides paginated access to email sending task errors for a specified task ID.
 
     This route retrieves errors associated with an email sending task from the
-    `progress_data` dictionary. It supports pagination by accepting a page number
+    on-disk `log_store`. It supports pagination by accepting a page number
     as a query argument. The route returns a JSON response containing the requested
     page of errors, total number of errors, and total number of error pages.
 
@@ -829,16 +1712,28 @@ def retry_errors():
         flask.json. jsonify: A JSON response containing paginated email sending task errors,
             total error count, and total number of error pages.
     """
-    task_id = request.args.get("task_id")
-    page = int(request.args.get("page", 1))
-    per_page = 15
-    start = (page - 1) * per_page
-    end = start + per_page
-    errors_paginated = progress_data[task_id]["errors"][start:end]
-    total = len(progress_data[task_id]["errors"])
+    return jsonify(log_page(request.args.get("task_id"), "errors", int(request.args.get("page", 1))))
+
+
+def log_page(task_id, kind, page):
+    """
+    Builds one page of a task's logs or errors, shared by `retry_logs`, `retry_errors` and
+    the ASGI entry point.
+
+    Args:
+        task_id (str): The unique identifier for the email sending task.
+        kind (str): "logs" or "errors".
+        page (int): 1-based page number; a page holds `LOG_PAGE_SIZE[kind]` entries.
+
+    Returns:
+        dict: The page under `kind`, the total entry count and the number of pages under `n_<kind>`.
+    """
+    per_page = LOG_PAGE_SIZE[kind]
+    entries = log_store.page(task_id, kind, (page - 1) * per_page, per_page)
+    total = log_store.count(task_id, kind)
     out_of = math.ceil(total / per_page)
     out_of = out_of if out_of != 0 else 1
-    return jsonify(errors=errors_paginated, total=total, n_errors=out_of)
+    return {kind: entries, "total": total, f"n_{kind}": out_of}
 
 
 @app.route("/retry_send_mail/", methods=["GET", "POST"])
@@ -857,24 +1752,22 @@ def retry_send_mail():
     failed_folder = os.path.join(folder, "failed_mail")
     file_name = Path(folder).name
 
-    progress_data[task_id] = {"logs": [], "errors": [], "status": "running", "total": 0, "sent": 0, "failed": 0,
-                              "completed": False, "cancelled": False, }
+    create_mail_task(task_id)
 
     # Run the email sending function in the background
     # Start a background thread to handle the email sending process
-    thread = Thread(target=retry_send_emails, args=(folder, task_id, failed_folder))
-    thread.start()
+    start_job(task_id, retry_send_emails, folder, task_id, failed_folder)
 
     return render_template("results_visual.html",
                            task_id=task_id, folder=quote(folder), filename=file_name)
 
 
-def retry_send_emails(main_folder, task_id, failed_folder):
+def retry_send_emails(main_folder, task_id, failed_folder, workers=1, rate=None, dry_run=False, schedule=None):
     """
     Retries sending emails that previously failed for a specified task.
 
     This function reattempts sending emails associated with a task identified by
-    `task_id`. It retrieves active users and failed email filenames. It then
+    `task_id`. It retrieves active users and failed email filenames from the folder's index. It then
     processes both new and failed email files:
 
     1. Combines new email files (from the main folder) with failed email files.
@@ -891,6 +1784,10 @@ def retry_send_emails(main_folder, task_id, failed_folder):
         main_folder (str): The path to the main folder containing email attachments.
         task_id (str): The unique identifier for the email sending task.
         failed_folder (str): The path to the folder containing failed email attachments.
+        workers (int): Batches sent at the same time, each over its own SMTP connection.
+        rate (float, optional): Most messages sent per second.
+        dry_run (bool): Simulate the run without sending or moving anything (see `send_in_batches`).
+        schedule (dict, optional): Sending windows and target finish time (see `send_in_batches`).
 
     Raises:
         Exception: If an error occurs during email sending or file operations.
@@ -899,121 +1796,163 @@ def retry_send_emails(main_folder, task_id, failed_folder):
         db_found = User.query.all()
         active_found, inactive, unknown = query_string(main_folder, db_found)
 
-        files_list = [file for file in os.listdir(main_folder) if file.endswith(".pdf")]
-        files_new = [file for file in files_list if file.split("_")[0] in active_found]
-
-        files_failed = [file for file in os.listdir(failed_folder) if file.endswith(".pdf")]
+        index = load_index(main_folder)
+        files_new = files_in(main_folder, ippis=active_found, entries=index)
 
-        files = files_failed + files_new
+        files_failed = files_in(main_folder, location=os.path.basename(failed_folder), entries=index)
 
-        progress_data[task_id]["total"] = len(files)
+        files = drop_suppressed(task_id, files_failed + files_new, lambda file: index[file]["ippis"])
 
-        for file in files:
-            if progress_data[task_id]["status"] == "canceled":
-                break
-            user_id = file.split("_")[0]
+        def job(file):
+            user_id = index[file]["ippis"]
             user = User.query.filter_by(ippis=user_id).first()
-            email = user.email
-
-            full_path = os.path.join(failed_folder, file)
+            return user and user.email, user_id, file, path_of(main_folder, file, index[file])
 
-            matched_path = (full_path if os.path.exists(full_path) else os.path.join(main_folder, file))
+        def move(file, matched_path, sent):
+            if not sent:
+                return None
+            return move_file(main_folder, file, index[file], "success_mail", matched_path)
 
-            mail_att, error_message = send_email_with_attachment(email, user_id, file, matched_path)
-
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-            log_entry = {"timestamp": timestamp,
-                         "message": (error_message if mail_att else f"Email notification failed to {email}."),
-                         "file": file,
-                         "email": email, }
-            progress_data[task_id]["logs"].append(log_entry)
-
-            if mail_att:
-                sh.move(matched_path, os.path.join(main_folder, "success_mail", file))
-                progress_data[task_id]["sent"] += 1
-            else:
-                progress_data[task_id]["failed"] += 1
-                progress_data[task_id]["errors"].append(
-                    {"file": file, "email": email, "error": error_message, "timestamp": timestamp, })
+        send_in_batches(task_id, main_folder, files, job, move, workers=workers, rate=rate, dry_run=dry_run,
+                        schedule=schedule)
 
         progress_data[task_id]["completed"] = True
+        finish_task(task_id)
 
 
 @app.route("/cancel_task/", methods=["POST"])
+@login_required
 def cancel_task():
-    """Cancels an email sending task by task ID.
+    """Cancels an email sending or split task by task ID.
 
     - Retrieves task ID, folder, and filename from request form.
-    - Cancels task if ID exists in `progress_data`.
-    - Returns JSON with cancellation status and retry page redirect URL.
+    - Cancels task if ID exists in `progress_data` or `progress`; a task still waiting in
+      the scheduler's queue is removed from it.
+    - The task's waits (retry intervals, rate limits, sending windows) end at once and it
+      stops at its next checkpoint, after the page or batch in hand (see `models.control`).
+    - Returns JSON with cancellation status and, for mail tasks, the retry page redirect URL.
 
     Raises:
         KeyError: If task ID is not found.
     """
     try:
         task_id = request.form["task_id"]
-        folder = request.form["folder"]
-        filename = request.form["filename"]
 
         if task_id in progress_data:
+            folder = request.form["folder"]
+            filename = request.form["filename"]
             progress_data[task_id]["cancelled"] = True
             progress_data[task_id]["status"] = "canceled"
+            control.cancel(task_id)
+            if scheduler.cancel(task_id):
+                # It never started, so nothing else will mark it done
+                progress_data[task_id]["completed"] = True
+                finish_task(task_id)
             return jsonify({"status": "Task canceled",
                             "redirect": url_for("retry_page", task_id=task_id, folder=folder, filename=filename), })
+        if task_id in progress:
+            control.cancel(task_id)
+            if scheduler.cancel(task_id):
+                progress[task_id] = 100
+                finish_task(task_id)
+            return jsonify({"status": "Task canceled"})
+        return jsonify({"status": "Unknown task"}), 404
     except KeyError:
         flash("No task ID provided", "error")
         return redirect(url_for("directories", rel_directory='base_dir'))
 
 
+@app.route("/pause_task/", methods=["POST"])
+@login_required
+def pause_task():
+    """
+    Pauses a split or mail task by task ID.
+
+    The task stops at its next checkpoint, after the page or batch in hand, and keeps its
+    place until resumed (see `models.control`); a mail task's status shows "paused".
+
+    Returns:
+        flask.json. jsonify: The new status, or 404 for an unknown or canceled task.
+    """
+    task_id = request.form.get("task_id")
+    if not control.pause(task_id):
+        return jsonify({"status": "Unknown task"}), 404
+    if task_id in progress_data:
+        progress_data[task_id]["status"] = "paused"
+    return jsonify({"status": "Task paused"})
+
+
+@app.route("/resume_task/", methods=["POST"])
+@login_required
+def resume_task():
+    """
+    Resumes a paused split or mail task by task ID from where it stopped.
+
+    Returns:
+        flask.json. jsonify: The new status, or 404 for an unknown task.
+    """
+    task_id = request.form.get("task_id")
+    if not control.resume(task_id):
+        return jsonify({"status": "Unknown task"}), 404
+    task = progress_data.get(task_id)
+    # A task waiting for its sending window stays paused until the window opens
+    if task is not None and task["status"] == "paused" and task["resume_at"] is None:
+        task["status"] = "running"
+    return jsonify({"status": "Task resumed"})
+
+
 @app.route("/export_logs/", methods=["POST", "GET"])
 def export_logs():
     """
-    Exports email sending task logs and errors as a ZIP archive.
-
-    - Retrieves task ID from the request form.
-    - Generates CSV data for logs and errors from `progress_data`.
-    - Creates a ZIP archive containing logs.csv and errors.csv.
+    Exports email sending task logs and errors as a streamed download.
+
+    - Retrieves task ID and optional filters from the request form or query string:
+      `since`/`until` (timestamps, "YYYY-MM-DD HH:MM[:SS]") and `status` ("sent" or "failed").
+    - By default streams a ZIP archive containing logs.csv and errors.csv; `format=gzip`
+      streams a single gzip-compressed CSV of the `kind` ("logs" or "errors") requested.
+    - Rows are read from `log_store` and compressed chunk by chunk, so memory use does not
+      grow with the size of the log.
     - Flashes a success message with the filename.
-    - Returns the ZIP archive for download.
+    """
+    download_name, body, mimetype = export_stream(request.values)
 
-    Raises:
-        KeyError: If the task ID is not found in `progress_data`.
+    flash(f"Saving to {download_name}", 'success')
+
+    return Response(stream_with_context(body), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{download_name}"'})
+
+
+def export_stream(values):
     """
-    task_id = request.form.get("task_id")
+    Prepares a log export from request values, shared by `export_logs` and the ASGI entry point.
 
-    def generate_csv(data, columns):
-        """
-        Generates CSV data for logs and errors from task data.
-
-        - Takes task data dictionary as input.
-        - Returns separate lists of dictionaries for logs and errors
-        formatted for CSV generation.
-    """
-        output = StringIO()
-        writer = csv.DictWriter(output, fieldnames=columns)
-        writer.writeheader()
-        writer.writerows(data)
-        return output.getvalue()
-
-    logs_csv = generate_csv(
-        [{"timestamp": log["timestamp"], "message": log["message"], "file": log["file"], "email": log["email"], } for
-         log in progress_data[task_id]["logs"]], ["timestamp", "message", "file", "email"], )
-    errors_csv = generate_csv(
-        [{"timestamp": error["timestamp"], "file": error["file"], "email": error["email"], "error": error["error"], }
-         for error in progress_data[task_id]["errors"]], ["timestamp", "file", "email", "error"], )
-
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w") as zip_file:
-        zip_file.writestr("logs.csv", logs_csv)
-        zip_file.writestr("errors.csv", errors_csv)
-    zip_buffer.seek(0)
+    Returns:
+        tuple: The download name, a generator of compressed chunks and the mimetype.
+    """
+    task_id = values.get("task_id")
+    filters = {"since": _export_timestamp(values.get("since")),
+               "until": _export_timestamp(values.get("until"), end=True),
+               "status": values.get("status") or None}
 
     timedate = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    flash(f"Saving to logs_and_errors_{timedate}.zip", 'success')
+    if values.get("format") == "gzip":
+        kind = "errors" if values.get("kind") == "errors" else "logs"
+        download_name = f"{kind}_{timedate}.csv.gz"
+        body, mimetype = stream_gzip(task_id, kind, **filters), "application/gzip"
+    else:
+        download_name = f"logs_and_errors_{timedate}.zip"
+        body, mimetype = stream_zip(task_id, **filters), "application/zip"
+    return download_name, body, mimetype
 
-    return send_file(zip_buffer, mimetype="application/zip", as_attachment=True,
-                     download_name=f"logs_and_errors_{timedate}.zip", )
+
+def _export_timestamp(value, end=False):
+    """Normalises an HTML datetime-local value to the log timestamp format, None when empty."""
+    if not value:
+        return None
+    value = value.replace("T", " ")
+    if len(value) == 16:  # No seconds given
+        value += ":59" if end else ":00"
+    return value
 
 
 @app.route("/add_user/", methods=["GET", "POST"])
@@ -1159,8 +2098,19 @@ def remove_admin():
 @app.route('/admin_control/', methods=['GET'])
 @login_required
 def admin_control():
-    """Renders the admin control panel template."""
-    return render_template('admin_control.html')
+    """Renders the admin control panel template, listing saved job profiles."""
+    return render_template('admin_control.html', profiles=list_profiles())
+
+
+@app.route('/profiles/<task_id>/<name>/', methods=['GET'])
+@login_required
+def download_profile(task_id, name):
+    """Downloads a saved profiling artefact (collapsed stacks, cProfile stats or summary) of a task."""
+    path = os.path.join(tasks_dir, os.path.basename(task_id), name)
+    if name not in PROFILE_FILES or not os.path.isfile(path):
+        flash("Profile not found.", "error")
+        return redirect(url_for('admin_control'))
+    return send_file(path, as_attachment=True, download_name=f"{task_id}_{name}")
 
 
 @app.route('/manage_users/', methods=['GET'])
@@ -1232,5 +2182,316 @@ def change_pswd():
     return redirect(url_for('manage_admins'))
 
 
+class PayrollCommand(click.Command):
+    """
+    A `flask payroll` command, which sets up the application with `create_app` only when it runs,
+    after its arguments are parsed, so `--help` and usage errors leave the file system alone.
+    """
+
+    def invoke(self, ctx):
+        create_app()
+        return super().invoke(ctx)
+
+
+class PayrollGroup(AppGroup):
+    """The `flask payroll` command group; its commands are `PayrollCommand`s."""
+
+    command_class = PayrollCommand
+
+
+@click.group("payroll", cls=PayrollGroup)
+def payroll_cli():
+    """Run the split, reconcile and mailing jobs without the web interface."""
+
+
+# Seconds between progress lines of a payroll command
+CLI_PROGRESS_INTERVAL = 2.0
+
+
+def _emit(as_json, payload, text):
+    """Prints one progress line: the payload as a JSON object, or the text for people."""
+    click.echo(json.dumps(payload, default=str) if as_json else text)
+
+
+def _watch(thread, snapshot, describe, as_json):
+    """Prints the progress of a job running in `thread` every `CLI_PROGRESS_INTERVAL` seconds until it ends."""
+    while thread.is_alive():
+        thread.join(CLI_PROGRESS_INTERVAL)
+        payload = snapshot()
+        _emit(as_json, payload, describe(payload))
+
+
+def _pdfs(paths):
+    """Expands folders to the PDFs directly inside them."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                if name.lower().endswith(".pdf") and os.path.isfile(os.path.join(path, name))))
+        elif path.lower().endswith(".pdf"):
+            files.append(path)
+    return files
+
+
+@payroll_cli.command("split")
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True))
+@click.option("--workers", type=int, default=None, help="Worker processes (default: one per CPU core).")
+@click.option("--shard", is_flag=True, help="Spread each output folder over hashed subfolders.")
+@click.option("--dry-run", is_flag=True, help="List the PDFs, their pages and output folders without splitting.")
+@click.option("--json", "as_json", is_flag=True, help="Print progress as JSON lines.")
+def split_command(paths, workers, shard, dry_run, as_json):
+    """Splits and encrypts PDFs, or every PDF in the given folders, like Split & Encrypt."""
+    files = _pdfs(paths)
+    if not files:
+        raise click.ClickException("No PDF files to split.")
+    conflicts = colliding_outputs(files)
+    if conflicts:
+        raise click.ClickException("These PDFs would be split into the same folder, split them separately or "
+                                   "rename them: " + "; ".join(", ".join(shared) for shared in conflicts.values()))
+
+    if dry_run:
+        from PyPDF2 import PdfReader
+        for file in files:
+            pages = len(PdfReader(file).pages)
+            _emit(as_json, {"file": file, "pages": pages, "folder": output_folder(file)},
+                  f"{file}: {pages} pages -> {output_folder(file)}")
+        return
+
+    task_id = str(time.time())
+    expire_tasks()
+    log_store.create_task(task_id)
+    progress[task_id] = 0
+    start_task(task_id, "split_batch")
+    control.register(task_id)
+
+    results = {}
+    thread = Thread(target=lambda: results.update(batch_splitter(files, task_id, workers, shard) or {}))
+    thread.start()
+    try:
+        _watch(thread, lambda: dict(split_progress(task_id), task_id=task_id),
+               lambda payload: f"{payload['progress']:.1f}% of {len(files)} PDFs, "
+                               f"{payload['unmatched']} unmatched pages", as_json)
+    except KeyboardInterrupt:
+        # Workers stop after the page in hand and remove their partial output
+        control.cancel(task_id)
+        thread.join()
+
+    failed = [file for file in files if not results.get(file)]
+    _emit(as_json, {"task_id": task_id, "completed": True, "split": len(files) - len(failed), "failed": failed},
+          f"Split {len(files) - len(failed)} of {len(files)} PDFs." + (f" Failed: {', '.join(failed)}" if failed else ""))
+    if failed:
+        sys.exit(1)
+
+
+@payroll_cli.command("reconcile")
+@click.argument("folder", type=click.Path(exists=True, file_okay=False))
+@click.option("--dry-run", is_flag=True, help="Count the users without storing the categories.")
+@click.option("--json", "as_json", is_flag=True, help="Print the result as JSON.")
+def reconcile_command(folder, dry_run, as_json):
+    """Categorizes a split folder's users into active, inactive and unknown, like Query DB."""
+    folder = os.path.abspath(folder)
+    if dry_run:
+        active, inactive, unknown = query_string(folder, User.query.all())
+    else:
+        active, inactive, unknown = reconcile(folder)
+    _emit(as_json, {"folder": folder, "active": len(active), "inactive": len(inactive), "unknown": len(unknown)},
+          f"{folder}: {len(active)} active, {len(inactive)} inactive, {len(unknown)} unknown")
+
+
+def _mail_command(folder, target, args, workers, rate, dry_run, as_json, **options):
+    """
+    Runs `send_emails` or `retry_send_emails` for a payroll command and reports its progress.
+
+    A dry run ends with the projected duration and every file that would fail. An interrupt
+    (Ctrl+C) cancels the task the way `/cancel_task/` does and waits for the batches in
+    flight. The exit status is 1 when any message failed or the task was canceled.
+    """
+    task_id = str(time.time())
+    create_mail_task(task_id, dry_run=dry_run)
+    thread = Thread(target=target, args=(folder, task_id, *args),
+                    kwargs=dict(options, workers=workers, rate=rate, dry_run=dry_run))
+    thread.start()
+
+    def snapshot():
+        task = progress_data[task_id]
+        return {"task_id": task_id, "total": task["total"], "sent": task["sent"], "failed": task["failed"],
+                "status": task["status"], "completed": task["completed"], "dry_run": dry_run,
+                "resume_at": task["resume_at"], "pace": task["pace"], "suppressed": task["suppressed"],
+                "accounts": {name: dict(stats) for name, stats in task["accounts"].items()}}
+
+    try:
+        _watch(thread, snapshot, lambda p: f"{p['sent'] + p['failed']}/{p['total']} "
+                                           f"({p['sent']} sent, {p['failed']} failed)"
+                                           + (f", paused until {datetime.datetime.fromtimestamp(p['resume_at']):%H:%M}"
+                                              if p['status'] == "paused" else "")
+                                           + (f", {p['pace']:.2f}/s" if p['pace'] else ""), as_json)
+    except KeyboardInterrupt:
+        progress_data[task_id]["cancelled"] = True
+        progress_data[task_id]["status"] = "canceled"
+        control.cancel(task_id)
+        thread.join()
+
+    result = snapshot()
+    if dry_run:
+        projection = progress_data[task_id]["projection"] or project_duration(0, 0.0, workers, rate)
+        for error in log_store.iter_entries(task_id, "errors"):
+            _emit(as_json, error, f"{error['file']} ({error['email']}): {error['error']}")
+        result.update(projection=projection, invalid=progress_data[task_id]["invalid"])
+        _emit(as_json, result, f"Dry run: {result['sent']} of {result['total']} would be sent, "
+                               f"{result['failed']} would fail. Projected duration "
+                               f"{datetime.timedelta(seconds=round(projection['seconds']))} at "
+                               f"{projection['cost_ms']} ms per message (limited by {projection['bound']})."
+                               + (f" Skipped {result['suppressed']} suppressed." if result["suppressed"] else ""))
+    else:
+        accounts = "; ".join(f"{name}: {stats['sent']} sent, {stats['failed']} failed, {stats['per_second']}/s"
+                             for name, stats in result["accounts"].items())
+        _emit(as_json, result, f"Sent {result['sent']} of {result['total']}, {result['failed']} failed"
+                               f"{' (canceled)' if result['status'] == 'canceled' else ''}."
+                               + (f" Skipped {result['suppressed']} suppressed." if result["suppressed"] else "")
+                               + (f" Accounts: {accounts}." if accounts else ""))
+    if result["failed"] or result["status"] == "canceled":
+        sys.exit(1)
+
+
+_mail_options = [
+    click.argument("folder", type=click.Path(exists=True, file_okay=False)),
+    click.option("--workers", type=int, default=1, show_default=True,
+                 help="Batches sent at the same time, each over its own SMTP connection."),
+    click.option("--rate", type=float, default=None, help="Most messages sent per second."),
+    click.option("--dry-run", is_flag=True,
+                 help="Check every message and recipient without sending, and project the run's duration."),
+    click.option("--window", "windows", multiple=True,
+                 help="Only send within this local time window, e.g. 22:00-06:00; repeat for more windows."),
+    click.option("--finish-by", default=None,
+                 help="Pace the sending to finish by this local time (YYYY-MM-DD HH:MM)."),
+    click.option("--json", "as_json", is_flag=True, help="Print progress as JSON lines."),
+]
+
+
+def _schedule(windows, finish_by):
+    """Builds the schedule of a payroll mail command from its `--window` and `--finish-by` options."""
+    try:
+        return make_schedule(",".join(windows), finish_by)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
+def mail_options(command):
+    """Adds the options shared by `payroll send` and `payroll retry`."""
+    for option in reversed(_mail_options):
+        command = option(command)
+    return command
+
+
+@payroll_cli.command("send")
+@mail_options
+@click.option("--distribute", is_flag=True,
+              help="Store the batches as work items that `payroll worker` processes share.")
+def send_command(folder, workers, rate, dry_run, windows, finish_by, as_json, distribute):
+    """Mails the payslips of the active users of a reconciled folder, like Send Mail."""
+    _mail_command(os.path.abspath(folder), send_emails, (), workers, rate, dry_run, as_json, distribute=distribute,
+                  schedule=_schedule(windows, finish_by))
+
+
+@payroll_cli.command("retry")
+@mail_options
+def retry_command(folder, workers, rate, dry_run, windows, finish_by, as_json):
+    """Mails a folder's failed payslips and those of users who became active since, like Retry."""
+    folder = os.path.abspath(folder)
+    _mail_command(folder, retry_send_emails, (os.path.join(folder, "failed_mail"),), workers, rate, dry_run, as_json,
+                  schedule=_schedule(windows, finish_by))
+
+
+@payroll_cli.command("worker")
+@click.option("--task", "task_id", default=None, help="Only work on this send task.")
+@click.option("--once", is_flag=True, help="Exit when there is no work left instead of waiting for more.")
+@click.option("--rate", type=float, default=None, help="Most messages this worker sends per second.")
+def worker_command(task_id, once, rate):
+    """
+    Sends batches of distributed send jobs (`payroll send --distribute` or the Send Mail
+    option) until interrupted. Run any number of workers, on any machine sharing the
+    database and the data folder; a worker that dies has its batch taken over once its
+    lease lapses.
+    """
+    owner = worker_name()
+    click.echo(f"Worker {owner} waiting for send items.")
+    handled = 0
+    try:
+        while True:
+            started = time.monotonic()
+            worked = work_batch(owner, task_id)
+            handled += worked
+            if worked and rate:
+                time.sleep(max(0.0, started + worked / rate - time.monotonic()))
+            elif not worked:
+                if once:
+                    break
+                time.sleep(WORKER_POLL)
+    except KeyboardInterrupt:
+        pass
+    click.echo(f"Worker {owner} handled {handled} items.")
+
+
+@payroll_cli.command("suppress")
+@click.argument("emails", nargs=-1)
+@click.option("--reason", type=click.Choice(["opt_out", "bounce", "invalid"]), default="opt_out", show_default=True)
+@click.option("--remove", is_flag=True, help="Take the addresses off the list instead.")
+@click.option("--list", "show", is_flag=True, help="Print the suppression list.")
+def suppress_command(emails, reason, remove, show):
+    """
+    Adds addresses to the suppression list, which sends skip. Hard bounces are added
+    automatically; use this for opt-outs, or --remove for an address that works again.
+    """
+    if remove:
+        removed = Suppression.query.filter(Suppression.email.in_([email.lower() for email in emails])).delete(
+            synchronize_session=False)
+        db.session.commit()
+        click.echo(f"Removed {removed} address(es).")
+    elif emails:
+        added = suppress([(email, reason, "Added from the command line.") for email in emails])
+        click.echo(f"Added {added} address(es).")
+    if show:
+        for entry in Suppression.query.order_by(Suppression.email):
+            click.echo(f"{entry.email}\t{entry.reason}\t{entry.created:%Y-%m-%d %H:%M}\t{entry.detail or ''}")
+
+
+class LazyMigrateGroup(click.Group):
+    """
+    Stands in for the `flask db` command group and sets up Flask-Migrate only when it is run,
+    so other commands and importers of this module never load alembic.
+    """
+
+    def make_context(self, info_name, args, parent=None, **extra):
+        create_app(migrations=True)
+        from flask_migrate.cli import db as db_group
+        return db_group.make_context(info_name, args, parent=parent, **extra)
+
+
+def create_app(migrations=False):
+    """
+    Returns the application ready to serve: the entry point for servers, CLI tools and workers.
+
+    Importing this module only defines the application; the working directory is set up here,
+    so tools and scripts that import it leave the file system alone until they run.
+
+    Flask-Migrate pulls in alembic, which is most of this module's import time, so it is only
+    set up when `migrations` is true, as in init_db.py and the `flask db` commands.
+
+    Args:
+        migrations (bool): Set up Flask-Migrate.
+
+    Returns:
+        Flask: The application.
+    """
+    os.makedirs(base_dir, exist_ok=True)
+    if migrations and "migrate" not in app.extensions:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    return app
+
+
+app.cli.add_command(LazyMigrateGroup("db", help="Perform database migrations."))
+app.cli.add_command(payroll_cli)
+
 if __name__ == "__main__":
-    app.run()
+    create_app().run()
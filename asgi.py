@@ -0,0 +1,138 @@
+"""
+ASGI entry point: `uvicorn asgi:application` (needs `pip install asgiref uvicorn`).
+
+The dashboard's hot read-only endpoints are served natively on the event loop, so a
+client waiting between progress updates or downloading a large export does not hold a
+worker thread:
+
+- `/progress/<task_id>` and `/progress_mail/<task_id>/` (JSON, read from memory)
+- `/events/progress/<task_id>` and `/events/progress_mail/<task_id>/` (Server-Sent Events,
+  pushed whenever the progress changes; the progress pages use them when available)
+- `/retry_logs/` and `/retry_errors/` (log store reads run in the default thread pool)
+- `GET /export_logs/` (each compressed chunk is produced in the thread pool and sent
+  without holding a thread while the client reads it)
+
+Every other route is the Flask app itself, run through asgiref's WSGI adapter.
+"""
+import asyncio
+import contextlib
+import re
+from urllib.parse import parse_qs
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    raise ImportError("The ASGI entry point needs asgiref: pip install asgiref uvicorn") from None
+
+from werkzeug.datastructures import MultiDict
+
+from app import create_app, split_progress, mail_progress, log_page, export_stream
+
+app = create_app()
+
+# Seconds between progress checks of an event stream
+EVENT_INTERVAL = 1.0
+
+# Seconds between keep-alive comments on an idle event stream, so proxies keep it open
+KEEPALIVE_INTERVAL = 15.0
+
+wsgi_application = WsgiToAsgi(app)
+
+
+async def _send_json(send, payload, status=200):
+    body = app.json.dumps(payload).encode("utf-8")
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _stream_events(send, payload_for, finished):
+    """Pushes `payload_for()` as an event whenever it changes, until `finished(payload)` is true."""
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")]})
+    last, idle = None, 0.0
+    while True:
+        data = app.json.dumps(payload_for())
+        if data != last:
+            await send({"type": "http.response.body", "body": f"data: {data}\n\n".encode("utf-8"), "more_body": True})
+            last, idle = data, 0.0
+            if finished(app.json.loads(data)):
+                break
+        elif idle >= KEEPALIVE_INTERVAL:
+            await send({"type": "http.response.body", "body": b": keep-alive\n\n", "more_body": True})
+            idle = 0.0
+        await asyncio.sleep(EVENT_INTERVAL)
+        idle += EVENT_INTERVAL
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _stream_export(send, args):
+    download_name, body, mimetype = export_stream(args)
+    await send({"type": "http.response.start", "status": 200,
+                "headers": [(b"content-type", mimetype.encode()),
+                            (b"content-disposition", f'attachment; filename="{download_name}"'.encode())]})
+    while True:
+        chunk = await asyncio.to_thread(next, body, None)
+        if chunk is None:
+            break
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def _log_page(send, args, kind):
+    page = await asyncio.to_thread(log_page, args.get("task_id"), kind, int(args.get("page", 1)))
+    await _send_json(send, page)
+
+
+async def _client_gone(receive):
+    """Resolves when the client disconnects, so event streams stop promptly."""
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+def _split_finished(payload):
+    return payload["progress"] >= 100
+
+
+def _mail_finished(payload):
+    return payload.get("completed", False) or payload.get("status") == "canceled"
+
+
+# (pattern, handler) pairs for GET requests served on the event loop
+ROUTES = [
+    (re.compile(r"^/progress/(?P<task_id>[^/]+)$"),
+     lambda send, args, task_id: _send_json(send, split_progress(task_id))),
+    (re.compile(r"^/progress_mail/(?P<task_id>[^/]+)/$"),
+     lambda send, args, task_id: _send_json(send, mail_progress(task_id))),
+    (re.compile(r"^/events/progress/(?P<task_id>[^/]+)$"),
+     lambda send, args, task_id: _stream_events(send, lambda: split_progress(task_id), _split_finished)),
+    (re.compile(r"^/events/progress_mail/(?P<task_id>[^/]+)/$"),
+     lambda send, args, task_id: _stream_events(send, lambda: mail_progress(task_id), _mail_finished)),
+    (re.compile(r"^/retry_logs/$"), lambda send, args: _log_page(send, args, "logs")),
+    (re.compile(r"^/retry_errors/$"), lambda send, args: _log_page(send, args, "errors")),
+    (re.compile(r"^/export_logs/$"), _stream_export),
+]
+
+
+async def application(scope, receive, send):
+    """ASGI application: native handlers for `ROUTES`, the Flask app for everything else."""
+    if scope["type"] == "http" and scope["method"] == "GET":
+        for pattern, handler in ROUTES:
+            match = pattern.match(scope["path"])
+            if match:
+                args = MultiDict(parse_qs(scope["query_string"].decode("latin-1")))
+                response = asyncio.ensure_future(handler(send, args, **match.groupdict()))
+                disconnect = asyncio.ensure_future(_client_gone(receive))
+                done, _ = await asyncio.wait({response, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                disconnect.cancel()
+                if response not in done:
+                    response.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await response
+                return
+    elif scope["type"] == "lifespan":
+        while (await receive())["type"] != "lifespan.shutdown":
+            await send({"type": "lifespan.startup.complete"})
+        await send({"type": "lifespan.shutdown.complete"})
+        return
+    await wsgi_application(scope, receive, send)
@@ -0,0 +1,175 @@
+"""
+Concurrent dashboard clients against one server process: `app.run()`'s threaded WSGI
+server versus the ASGI entry point (`asgi.py`) under uvicorn.
+
+The server runs in a child process with a throwaway workspace and a fake mail task that
+"sends" a message every 100 ms. Each client then watches that task the way the progress
+page does, for `--duration` seconds:
+
+- poll: GET `/progress_mail/<task_id>/` every `--interval` seconds (both servers).
+- sse: one `/events/progress_mail/<task_id>/` stream per client (ASGI only).
+
+Reports requests or events per second, p50/p95/p99 latency and failed connections.
+The ASGI run needs `pip install asgiref uvicorn`.
+
+Usage: `python -m bench.dashboard_clients --clients 10 100 500 --duration 10`
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from bench.load_test import ROOT, percentile, write_config
+
+TASK_ID = 'dashboard-bench'
+
+
+def serve(mode, port):
+    """Runs the server side in the child process: a fake mail task and the chosen server."""
+    sys.path.insert(0, ROOT)
+    import app as web
+
+    web.create_mail_task(TASK_ID)
+    task = web.progress_data[TASK_ID]
+    task['total'] = 10 ** 6
+
+    def tick():
+        while True:
+            time.sleep(0.1)
+            task['sent'] += 1
+            task['logs'].append({'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'status': 'sent',
+                                 'message': f"Email sent to user{task['sent']}@example.test.",
+                                 'file': f"{task['sent']}_BENCH_JAN-2024.pdf",
+                                 'email': f"user{task['sent']}@example.test"})
+
+    threading.Thread(target=tick, daemon=True).start()
+
+    if mode == 'wsgi':
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        # What `app.run()` starts: werkzeug's development server with a thread per request
+        web.create_app().run(host='127.0.0.1', port=port, threaded=True, use_reloader=False)
+    else:
+        import uvicorn
+        from asgi import application
+        uvicorn.run(application, host='127.0.0.1', port=port, log_level='warning')
+
+
+async def _request(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n'.encode())
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    if not data.startswith(b'HTTP/1.1 200') and not data.startswith(b'HTTP/1.0 200'):
+        raise ConnectionError(data.split(b'\r\n', 1)[0].decode(errors='replace'))
+
+
+async def poll_client(port, deadline, interval, latencies, failures):
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(_request(port, f'/progress_mail/{TASK_ID}/'), timeout=10)
+            latencies.append((time.perf_counter() - started) * 1000)
+        except (OSError, asyncio.TimeoutError):
+            failures.append(1)
+        await asyncio.sleep(max(0.0, interval - (time.perf_counter() - started)))
+
+
+async def sse_client(port, deadline, latencies, failures):
+    """Counts events on one stream; the latency recorded is the gap between events."""
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'GET /events/progress_mail/{TASK_ID}/ HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+        await writer.drain()
+        if not (await reader.readline()).startswith(b'HTTP/1.1 200'):
+            raise ConnectionError('stream refused')
+        last = time.perf_counter()
+        while time.monotonic() < deadline:
+            line = await asyncio.wait_for(reader.readline(), timeout=max(0.1, deadline - time.monotonic()))
+            if line.startswith(b'data:'):
+                now = time.perf_counter()
+                latencies.append((now - last) * 1000)
+                last = now
+        writer.close()
+    except asyncio.TimeoutError:
+        pass
+    except OSError:
+        failures.append(1)
+
+
+async def run_clients(kind, port, clients, duration, interval):
+    latencies, failures = [], []
+    deadline = time.monotonic() + duration
+    if kind == 'poll':
+        await asyncio.gather(*(poll_client(port, deadline, interval, latencies, failures) for _ in range(clients)))
+    else:
+        await asyncio.gather(*(sse_client(port, deadline, latencies, failures) for _ in range(clients)))
+    return latencies, failures
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server did not start on port {port}')
+
+
+def run(args):
+    print(f"{'server':<6} {'clients':>7} {'kind':<5} {'per sec':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'failed':>7}")
+    for mode in args.servers:
+        workspace = tempfile.mkdtemp(prefix='mailing-dashboard-')
+        write_config(workspace, 2525)
+        port = _free_port()
+        server = subprocess.Popen([sys.executable, '-m', 'bench.dashboard_clients', '--serve', mode,
+                                   '--port', str(port)], cwd=workspace,
+                                  env=dict(os.environ, PYTHONPATH=ROOT), stdout=subprocess.DEVNULL)
+        try:
+            _wait_for_port(port)
+            for clients in args.clients:
+                for kind in (('poll', 'sse') if mode == 'asgi' else ('poll',)):
+                    latencies, failures = asyncio.run(run_clients(kind, port, clients, args.duration,
+                                                                  args.interval))
+                    print(f"{mode:<6} {clients:>7} {kind:<5} {len(latencies) / args.duration:>9.1f} "
+                          f"{percentile(latencies, 0.50):>8.1f} {percentile(latencies, 0.95):>8.1f} "
+                          f"{percentile(latencies, 0.99):>8.1f} {len(failures):>7}")
+        finally:
+            server.terminate()
+            server.wait()
+            shutil.rmtree(workspace, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent dashboard clients, WSGI vs ASGI')
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 100, 500], help='concurrent clients per run')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per run')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between polls of one client')
+    parser.add_argument('--servers', nargs='+', choices=('wsgi', 'asgi'), default=['wsgi', 'asgi'])
+    parser.add_argument('--serve', choices=('wsgi', 'asgi'), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Start-up cost of the application, measured with `python -X importtime`.
+
+Imports each target module in a fresh interpreter inside a throwaway workspace (so no
+config.ini or data/ folder is needed), repeats it `--runs` times and reports the best
+total import time plus the slowest top-level imports of the last run. With `--max-ms`
+it exits with status 1 when a target is slower, so it can gate CI or a pre-commit hook.
+
+Usage: `python -m bench.import_time --runs 5 --max-ms 400`
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from bench.load_test import ROOT
+
+# Entry points whose start-up matters: the web app, and what CLI tools and workers load
+TARGETS = ('app', 'models.pdf_rel', 'models.mail_mod')
+
+
+def import_times(module, workspace):
+    """
+    Imports `module` in a new interpreter and parses its `-X importtime` report.
+
+    Returns:
+        list: (cumulative microseconds, depth, module name) for every import, in report order.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=workspace,
+                            env=dict(os.environ, PYTHONPATH=ROOT), capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((int(cumulative), depth, name.strip()))
+    return rows
+
+
+def _own_imports(rows, module):
+    """Returns the cumulative time of `module` and the imports it made directly."""
+    end = max(index for index, (_, depth, name) in enumerate(rows) if depth == 0 and name == module)
+    start = max((index for index in range(end) if rows[index][1] == 0), default=-1) + 1
+    return rows[end][0], [row for row in rows[start:end] if row[1] == 1]
+
+
+def run(args):
+    workspace = tempfile.mkdtemp(prefix='mailing-importtime-')
+    too_slow = []
+    try:
+        for module in args.targets:
+            runs = [_own_imports(import_times(module, workspace), module) for _ in range(args.runs)]
+            best = min(total for total, _ in runs) / 1000
+            print(f"{module}: {best:.1f} ms (best of {args.runs})")
+            top_level = sorted(runs[-1][1], reverse=True)[:args.top]
+            for cumulative, _, name in top_level:
+                print(f"  {cumulative / 1000:8.1f} ms  {name}")
+            if args.max_ms and best > args.max_ms:
+                too_slow.append(module)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+    if too_slow:
+        print(f"slower than {args.max_ms} ms: {', '.join(too_slow)}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import time of the application entry points')
+    parser.add_argument('targets', nargs='*', default=list(TARGETS), help='modules to import')
+    parser.add_argument('--runs', type=int, default=5, help='imports per target; the best is reported')
+    parser.add_argument('--top', type=int, default=8, help='slowest top-level imports to list')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail when a target takes longer')
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""
+End-to-end mailing load test against the local SMTP sink.
+
+Builds a throwaway workspace (config.ini pointing at the sink, an empty SQLite database
+and a `data/` folder), generates N synthetic split payslips and matching users, then
+drives the real web flow through Flask's test client: login, `/results/` to reconcile
+the folder, `/send_mail/` to start the background send, polling `progress_data` until
+the task completes. Reports messages/sec, p50/p95/p99 send latency as seen by the sink,
+and retry counts.
+
+Usage: `python -m bench.load_test --users 500 --latency 0.005 --rate-4xx 0.02 --rate-5xx 0.01`
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from PyPDF2 import PdfWriter
+
+from bench.smtp_sink import SinkServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of `values`, 0.0 when empty."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def write_config(workspace, port):
+    with open(os.path.join(workspace, 'config.ini'), 'w') as f:
+        f.write('[Email]\n'
+                'smtp_server = 127.0.0.1\n'
+                f'smtp_port = {port}\n'
+                'smtp_security = none\n'
+                'sender_email = loadtest@example.test\n'
+                'sender_password = loadtest\n')
+
+
+def make_split_folder(folder, count):
+    """Writes `count` one-page PDFs named like `splitter` output and returns their IPPIS numbers."""
+    os.makedirs(folder)
+    writer = PdfWriter()
+    writer.add_blank_page(width=595, height=842)
+    template = os.path.join(folder, '.template.pdf')
+    with open(template, 'wb') as f:
+        writer.write(f)
+
+    ippis_numbers = [str(200000 + i) for i in range(count)]
+    for ippis in ippis_numbers:
+        shutil.copyfile(template, os.path.join(folder, f'{ippis}_LOAD_JAN-2024.pdf'))
+    os.remove(template)
+    return ippis_numbers
+
+
+def run(args):
+    sink = SinkServer(latency=args.latency, jitter=args.jitter, rate_4xx=args.rate_4xx, rate_5xx=args.rate_5xx,
+                      seed=args.seed).start()
+    workspace = tempfile.mkdtemp(prefix='mailing-load-')
+    cwd = os.getcwd()
+    try:
+        write_config(workspace, sink.port)
+        os.chdir(workspace)
+        sys.path.insert(0, ROOT)
+
+        # Imported here so the app picks up the workspace's config.ini, database and data/ folder
+        import app as web
+        from models import mail_mod
+        web.create_app()
+        mail_mod.RETRY_INTERVAL = args.retry_interval
+
+        folder = os.path.join(web.base_dir, 'loadtest')
+        ippis_numbers = make_split_folder(folder, args.users)
+
+        with web.app.app_context():
+            web.db.create_all()
+            admin = web.Admins()
+            admin.username = 'loadtest'
+            admin.password = 'loadtest'
+            web.db.session.add(admin)
+            web.db.session.bulk_insert_mappings(web.User, [
+                {'ippis': ippis, 'email': f'user{ippis}@example.test', 'first_name': 'Load', 'surname': 'Test',
+                 'phone': None, 'active': True} for ippis in ippis_numbers])
+            web.db.session.commit()
+
+        client = web.app.test_client()
+        client.post('/login/', data={'username': 'loadtest', 'password': 'loadtest'})
+        client.post('/results/', data={'folder': folder})
+
+        before = set(web.progress_data)
+        started = time.perf_counter()
+        client.post('/send_mail/', data={'folder': folder})
+        task_id = (set(web.progress_data) - before).pop()
+        while not web.progress_data[task_id]['completed']:
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+        task = web.progress_data[task_id]
+    finally:
+        os.chdir(cwd)
+        sink.stop()
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    latencies = [value * 1000 for value in sink.latencies]
+    print(f"messages:   {task['total']} total, {task['sent']} sent, {task['failed']} failed in {elapsed:.2f}s")
+    print(f"throughput: {task['sent'] / elapsed if elapsed else 0:.1f} msg/s over {sink.connections} connections")
+    print(f"latency:    p50 {percentile(latencies, 0.50):.1f} ms, p95 {percentile(latencies, 0.95):.1f} ms, "
+          f"p99 {percentile(latencies, 0.99):.1f} ms")
+    print(f"retries:    {sink.retries()} (refused {sink.refused_4xx} with 4xx, {sink.refused_5xx} with 5xx)")
+    print("stages:")
+    for stage, data in sorted(task["metrics"]["stages"].items()):
+        print(f"  {stage:<13} {data['count']:>7} x  mean {data['sum'] / data['count'] * 1000:8.2f} ms  "
+              f"max {data['max'] * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mailing load test against a local SMTP sink')
+    parser.add_argument('--users', type=int, default=500, help='synthetic payslips and users to generate')
+    parser.add_argument('--latency', type=float, default=0.005, help='sink round trip, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random sink delay, seconds')
+    parser.add_argument('--rate-4xx', type=float, default=0.0, help='fraction of recipients refused with 451')
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help='fraction of recipients refused with 550')
+    parser.add_argument('--retry-interval', type=float, default=0.1, help='overrides mail_mod.RETRY_INTERVAL')
+    parser.add_argument('--seed', type=int, default=1)
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Compares SMTP send paths in `models.mail_mod` against the local sink.
+
+- connection per message: `send_email_with_attachment`, the original path.
+- batched: `send_batch_with_attachments` on a server without PIPELINING.
+- pipelined: `send_batch_with_attachments` on a server advertising PIPELINING.
+
+The sends run in a throwaway workspace with its own `config.ini` and `data/` folder, so they
+are not counted against the real sender accounts' daily quotas.
+
+Usage: `python -m bench.smtp_pipelining --messages 200 --latency 0.01`
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from PyPDF2 import PdfWriter
+
+from bench.smtp_sink import SinkServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported by `main` once the workspace is the working directory
+mail_mod = None
+
+
+def make_attachment(folder):
+    """Writes a one-page PDF named like a split payslip and returns its path."""
+    writer = PdfWriter()
+    writer.add_blank_page(width=595, height=842)
+    path = os.path.join(folder, '100001_DOE_JAN-2024.pdf')
+    with open(path, 'wb') as f:
+        writer.write(f)
+    return path
+
+
+def write_config(workspace):
+    with open(os.path.join(workspace, 'config.ini'), 'w') as f:
+        f.write('[Email]\n'
+                'smtp_server = 127.0.0.1\n'
+                'smtp_port = 25\n'
+                'smtp_security = none\n'
+                'sender_email = bench@example.test\n'
+                'sender_password = bench\n')
+
+
+def point_mail_mod_at(server):
+    mail_mod.smtp_server = '127.0.0.1'
+    mail_mod.smtp_port = server.port
+    mail_mod.smtp_security = 'none'
+
+
+def run_single(jobs):
+    for job in jobs:
+        ok, message = mail_mod.send_email_with_attachment(*job)
+        assert ok, message
+
+
+def run_batched(jobs, batch_size):
+    for start in range(0, len(jobs), batch_size):
+        for ok, message in mail_mod.send_batch_with_attachments(jobs[start:start + batch_size]):
+            assert ok, message
+
+
+def measure(label, server, func, *args):
+    point_mail_mod_at(server)
+    server.reset_counters()
+    started = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - started
+    rate = server.messages / elapsed if elapsed else float('inf')
+    print(f'{label:<26} {server.messages:>6} msgs {elapsed:>8.2f}s {rate:>10.1f} msg/s '
+          f'{server.connections:>5} connections')
+    return rate
+
+
+def main():
+    global mail_mod
+    parser = argparse.ArgumentParser(description='SMTP pipelining benchmark')
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.01, help='simulated round trip, seconds')
+    parser.add_argument('--batch-size', type=int, default=None, help='default: batch_size of the workspace config')
+    args = parser.parse_args()
+
+    workspace = tempfile.mkdtemp(prefix='smtp-pipelining-')
+    cwd = os.getcwd()
+    try:
+        write_config(workspace)
+        os.chdir(workspace)
+        sys.path.insert(0, ROOT)
+
+        # Imported here so account usage and task logs go to the workspace's data/ folder
+        from models import mail_mod
+        args.batch_size = args.batch_size or mail_mod.send_batch_size()
+
+        path = make_attachment(workspace)
+        jobs = [(f'user{i}@example.com', '100001', os.path.basename(path), path) for i in range(args.messages)]
+
+        plain = SinkServer(latency=args.latency, pipelining=False).start()
+        pipelined = SinkServer(latency=args.latency, pipelining=True).start()
+        try:
+            base = measure('connection per message', plain, run_single, jobs)
+            batched = measure('batched', plain, run_batched, jobs, args.batch_size)
+            fast = measure('batched + pipelining', pipelined, run_batched, jobs, args.batch_size)
+        finally:
+            plain.stop()
+            pipelined.stop()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    print(f'batched: {batched / base:.1f}x, pipelined: {fast / base:.1f}x vs connection per message')
+
+
+if __name__ == '__main__':
+    main()
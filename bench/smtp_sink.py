@@ -0,0 +1,244 @@
+"""
+A small local SMTP stand-in for benchmarks and load tests.
+
+The sink speaks enough ESMTP for `smtplib` (EHLO, AUTH PLAIN, MAIL, RCPT, DATA, RSET,
+NOOP, QUIT), optionally advertises PIPELINING, and discards every message it accepts.
+Replies are buffered until the client has nothing more in flight and are then flushed
+after `latency` seconds (plus up to `jitter`), so each client round trip costs one
+simulated network delay. Recipients can be refused at random with temporary (4xx) or
+permanent (5xx) errors to exercise retry and failure handling.
+
+Run it standalone with `python -m bench.smtp_sink --port 2525 --latency 0.02 --rate-4xx 0.05`.
+"""
+import argparse
+import collections
+import random
+import socketserver
+import threading
+import time
+
+
+class SinkServer(socketserver.ThreadingTCPServer):
+    """
+    Threaded SMTP sink.
+
+    Args:
+        address (tuple): Host and port to bind, port 0 picks a free one.
+        latency (float): Seconds to wait before every flush of replies.
+        pipelining (bool): Whether to advertise the PIPELINING extension.
+        jitter (float): Extra random delay of up to this many seconds per flush.
+        rate_4xx (float): Fraction of recipients refused with a temporary 451 error.
+        rate_5xx (float): Fraction of recipients refused with a permanent 550 error.
+        seed (int): Seed for the failure injection, for repeatable runs.
+    """
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.0, pipelining=True, jitter=0.0, rate_4xx=0.0,
+                 rate_5xx=0.0, seed=None):
+        super().__init__(address, SinkHandler)
+        self.latency = latency
+        self.pipelining = pipelining
+        self.jitter = jitter
+        self.rate_4xx = rate_4xx
+        self.rate_5xx = rate_5xx
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self._thread = None
+        self.reset_counters()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serves in a daemon thread and returns the server."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops serving and releases the socket."""
+        self.shutdown()
+        self.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            self.connections = 0
+            self.messages = 0
+            self.refused_4xx = 0
+            self.refused_5xx = 0
+            self.attempts = collections.Counter()  # RCPT commands per address
+            self.latencies = []  # Seconds from MAIL FROM to the flushed acceptance reply
+
+    def roll(self):
+        """Returns the injected failure for the next recipient: None, '4xx' or '5xx'."""
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.rate_5xx:
+            return '5xx'
+        if draw < self.rate_5xx + self.rate_4xx:
+            return '4xx'
+        return None
+
+    def retries(self):
+        """Number of RCPT attempts beyond the first for each address."""
+        with self.lock:
+            return sum(count - 1 for count in self.attempts.values())
+
+
+class SinkHandler(socketserver.BaseRequestHandler):
+    """Handles one SMTP session for `SinkServer`."""
+
+    def setup(self):
+        self.replies = []
+        self.closing = False
+        self.mail_from = None
+        self.recipients = []
+        self.in_data = False
+        self.started = None
+        self.accepted = []  # MAIL FROM times of messages accepted since the last flush
+        with self.server.lock:
+            self.server.connections += 1
+
+    def reply(self, line):
+        self.replies.append(line.encode('ascii') + b'\r\n')
+
+    def flush(self):
+        if self.replies:
+            delay = self.server.latency
+            if self.server.jitter:
+                delay += self.server.random.uniform(0, self.server.jitter)
+            if delay:
+                time.sleep(delay)
+            self.request.sendall(b''.join(self.replies))
+            self.replies = []
+        if self.accepted:
+            now = time.perf_counter()
+            with self.server.lock:
+                self.server.latencies.extend(now - started for started in self.accepted)
+            self.accepted = []
+
+    def handle(self):
+        self.reply('220 sink ESMTP ready')
+        buffer = b''
+        while True:
+            self.flush()
+            if self.closing:
+                return
+            try:
+                chunk = self.request.recv(65536)
+            except OSError:
+                return
+            if not chunk:
+                return
+            buffer += chunk
+            while b'\r\n' in buffer and not self.closing:
+                line, buffer = buffer.split(b'\r\n', 1)
+                if self.in_data:
+                    self.data_line(line)
+                else:
+                    self.command(line.decode('ascii', 'replace'))
+
+    def data_line(self, line):
+        if line != b'.':
+            return
+        self.in_data = False
+        self.accept_message()
+
+    def accept_message(self):
+        with self.server.lock:
+            self.server.messages += 1
+        self.accepted.append(self.started)
+        self.mail_from = None
+        self.recipients = []
+        self.reply('250 2.0.0 Message accepted')
+
+    def command(self, line):
+        verb, _, argument = line.partition(' ')
+        verb = verb.upper()
+        if verb == 'EHLO':
+            extensions = ['AUTH PLAIN LOGIN', '8BITMIME']
+            if self.server.pipelining:
+                extensions.insert(0, 'PIPELINING')
+            self.reply('250-sink')
+            for extension in extensions[:-1]:
+                self.reply(f'250-{extension}')
+            self.reply(f'250 {extensions[-1]}')
+        elif verb == 'HELO':
+            self.reply('250 sink')
+        elif verb == 'AUTH':
+            self.reply('235 2.7.0 Authentication successful')
+        elif verb == 'MAIL':
+            self.mail_from = argument
+            self.recipients = []
+            self.started = time.perf_counter()
+            self.reply('250 2.1.0 OK')
+        elif verb == 'RCPT':
+            if self.mail_from is None:
+                self.reply('503 5.5.1 Need MAIL first')
+            else:
+                self.recipient(argument)
+        elif verb == 'DATA':
+            if not self.recipients:
+                self.reply('554 5.5.1 No valid recipients')
+            else:
+                self.in_data = True
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+        elif verb == 'RSET':
+            self.mail_from = None
+            self.recipients = []
+            self.reply('250 2.0.0 OK')
+        elif verb == 'NOOP':
+            self.reply('250 2.0.0 OK')
+        elif verb == 'QUIT':
+            self.reply('221 2.0.0 Bye')
+            self.closing = True
+        else:
+            self.reply('500 5.5.2 Command not recognized')
+
+    def recipient(self, argument):
+        failure = self.server.roll()
+        with self.server.lock:
+            self.server.attempts[argument.lower()] += 1
+            if failure == '4xx':
+                self.server.refused_4xx += 1
+            elif failure == '5xx':
+                self.server.refused_5xx += 1
+        if failure == '4xx':
+            self.reply('451 4.3.0 Temporary failure, try again later')
+        elif failure == '5xx':
+            self.reply('550 5.1.1 Mailbox unavailable')
+        else:
+            self.recipients.append(argument)
+            self.reply('250 2.1.5 OK')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2525)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per reply flush')
+    parser.add_argument('--jitter', type=float, default=0.0, help='extra random seconds per flush')
+    parser.add_argument('--rate-4xx', type=float, default=0.0, help='fraction of recipients refused with 451')
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help='fraction of recipients refused with 550')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--no-pipelining', action='store_true')
+    args = parser.parse_args()
+
+    server = SinkServer((args.host, args.port), latency=args.latency, pipelining=not args.no_pipelining,
+                        jitter=args.jitter, rate_4xx=args.rate_4xx, rate_5xx=args.rate_5xx, seed=args.seed)
+    print(f'SMTP sink listening on {args.host}:{server.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f'{server.messages} messages accepted over {server.connections} connections, '
+              f'{server.refused_4xx} refused 4xx, {server.refused_5xx} refused 5xx, {server.retries()} retries')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,25 +1,31 @@
 #!/usr/bin/env python3
 
 import os
-from app import app, db, Admins
 
-if 'migrations' not in os.listdir('.'):
-    os.system('flask db init')
-    os.system('flask db migrate -m "Initial migration."')
-    os.system('flask db upgrade')
+from flask_migrate import init, migrate, upgrade
+
+from app import create_app, db, Admins
+
+app = create_app(migrations=True)
+
+# Runs the `flask db` steps in this process instead of starting a new interpreter for each
+with app.app_context():
+    if 'migrations' not in os.listdir('.'):
+        init()
+        migrate(message="Initial migration.")
+        upgrade()
 
-    with app.app_context():
         default_admin = Admins()
         default_admin.username = 'admin'
         default_admin.password = '12345'
-        
+
         db.session.add(default_admin)
         db.session.commit()
-        
+
         print('admin account created with 12345 as the default password')
-        
-else:
-    os.system('flask db migrate -m "db update"')
-    os.system('flask db upgrade')
-    print('admin account default password is already created')
-    print('db migrated successfully.')
+
+    else:
+        migrate(message="db update")
+        upgrade()
+        print('admin account default password is already created')
+        print('db migrated successfully.')
@@ -0,0 +1,116 @@
+import threading
+import time
+
+# Cancel and pause flags of tasks, keyed by task ID like `progress` and `progress_data`:
+# {"cancel": set once canceled, "running": cleared while paused}
+controls = dict()
+
+_lock = threading.Lock()
+
+
+def register(task_id, event=threading.Event):
+    """
+    Creates the control flags of a task, or replaces them keeping their state.
+
+    Batch splits replace the flags with `multiprocessing.Manager().Event` proxies, which
+    worker processes can wait on too (see `attach`).
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        event (callable): Makes the flags; `threading.Event` by default.
+
+    Returns:
+        dict: The flags, also stored in `controls[task_id]`.
+    """
+    with _lock:
+        old = controls.get(task_id)
+        flags = {"cancel": event(), "running": event()}
+        if old is None or old["running"].is_set():
+            flags["running"].set()
+        if old is not None and old["cancel"].is_set():
+            flags["cancel"].set()
+        controls[task_id] = flags
+    return flags
+
+
+def attach(task_id, cancel, running):
+    """Uses flags created by another process for a task, e.g. in a batch split worker."""
+    controls[task_id] = {"cancel": cancel, "running": running}
+
+
+def forget(task_id):
+    controls.pop(task_id, None)
+
+
+def cancel(task_id):
+    """
+    Cancels a task: its waits end at once and its next checkpoint reports it.
+
+    Returns:
+        bool: Whether the task has control flags.
+    """
+    flags = controls.get(task_id)
+    if flags is None:
+        return False
+    flags["cancel"].set()
+    flags["running"].set()  # A paused task has to wake up to stop
+    return True
+
+
+def pause(task_id):
+    """Pauses a task at its next checkpoint. Returns whether the task has control flags."""
+    flags = controls.get(task_id)
+    if flags is None or flags["cancel"].is_set():
+        return False
+    flags["running"].clear()
+    return True
+
+
+def resume(task_id):
+    """Lets a paused task carry on from where it stopped. Returns whether the task has control flags."""
+    flags = controls.get(task_id)
+    if flags is None:
+        return False
+    flags["running"].set()
+    return True
+
+
+def is_canceled(task_id):
+    flags = controls.get(task_id)
+    return flags is not None and flags["cancel"].is_set()
+
+
+def is_paused(task_id):
+    flags = controls.get(task_id)
+    return flags is not None and not flags["running"].is_set()
+
+
+def checkpoint(task_id):
+    """
+    Blocks while the task is paused.
+
+    Jobs call this between units of work (a page, a batch of messages), so a pause keeps
+    their position and a cancel is noticed within one unit.
+
+    Returns:
+        bool: Whether the task was canceled.
+    """
+    flags = controls.get(task_id)
+    if flags is None:
+        return False
+    flags["running"].wait()
+    return flags["cancel"].is_set()
+
+
+def sleep(task_id, seconds):
+    """
+    Sleeps like `time.sleep`, but wakes up as soon as the task is canceled.
+
+    Returns:
+        bool: Whether the task was canceled.
+    """
+    flags = controls.get(task_id)
+    if flags is None:
+        time.sleep(max(0.0, seconds))
+        return False
+    return flags["cancel"].wait(max(0.0, seconds))
@@ -2,6 +2,8 @@ import os
 from datetime import datetime
 from pathlib import Path
 
+from models.split_index import INDEX_FILE, LOCATIONS, load_index
+
 
 def format_file_size(size_in_bytes):
     """
@@ -34,10 +36,37 @@ def datetimeformat(value):
     return datetime.fromtimestamp(value).strftime(format_time)
 
 
+def _sharded_files(directory):
+    """
+    Lists the files of a sharded split folder location as "<shard>/<name>" paths.
+
+    Args:
+        directory (Path): A split folder or one of its mail result folders.
+
+    Returns:
+        tuple: The set of shard subfolders and the set of file paths, both empty when the
+            directory is not a sharded location of an indexed split folder.
+    """
+    if (directory / INDEX_FILE).exists():
+        folder, location = directory, ''
+    elif directory.name in LOCATIONS[1:] and (directory.parent / INDEX_FILE).exists():
+        folder, location = directory.parent, directory.name
+    else:
+        return set(), set()
+    entries = load_index(str(folder))
+    # Every shard is hidden, including those whose files have all moved to another location
+    shards = {entry['shard'] for entry in entries.values() if entry.get('shard')}
+    return shards, {f"{entry['shard']}/{name}" for name, entry in entries.items()
+                    if entry['location'] == location and entry.get('shard')}
+
+
 def get_sorted_files(directory):
     """
     Get a sorted list of directories and files in the given directory.
 
+    The shard subfolders of a sharded split folder are not listed; their files are, as
+    "<shard>/<name>" paths, so the folder reads like a flat one.
+
     Args:
         directory (str): The directory path.
 
@@ -97,7 +126,11 @@ def get_sorted_files(directory):
                             # Add the file name to the set of seen files
                             seen_files.add(name)
                             
-    return sorted(list(seen_dirs)) + sorted(list(seen_files)), directory
+    shards, sharded_files = _sharded_files(directory)
+    seen_dirs -= shards
+    seen_files |= sharded_files
+
+    return sorted(list(seen_dirs)) + sorted(seen_files, key=lambda file: Path(file).name), directory
 
 
 def get_file_info(file_path):
@@ -129,7 +162,7 @@ def get_file_info(file_path):
 def query_string(folder, db_found):
     """Analyzes a folder of PDF filenames and a database of users.
 
-    - Extracts user IDs from filenames in a specified folder (`folder`).
+    - Reads user IDs of the files in a specified folder (`folder`) from its index (see `models.split_index`).
     - Extracts user IDs (IPPIS) from a database query result (`db_found`).
     - Identifies three sets of users:
         - `active_found`: Users found in both PDF filenames and the database (active users).
@@ -143,7 +176,7 @@ def query_string(folder, db_found):
     Returns:
         tuple: A tuple containing three sets: `active_found`, `inactive`, and `unknown`.
     """
-    split_files = [f.split('_')[0] for f in os.listdir(folder) if f.endswith('.pdf')]
+    split_files = [entry['ippis'] for entry in load_index(folder).values() if entry['location'] == '']
     db_ippis = [user.ippis for user in db_found]
 
     file_users = set(split_files)
@@ -0,0 +1,87 @@
+import csv
+import gzip
+import io
+import zipfile
+
+from models.log_store import COLUMNS, iter_entries
+
+# Bytes of compressed output collected before a chunk is handed to the client
+CHUNK_SIZE = 64 * 1024
+
+
+class _ChunkSink(io.RawIOBase):
+    """Unseekable write target that collects compressed bytes until they are drained."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def _write_rows(text, kind, task_id, filters, sink):
+    """Writes the CSV for one kind of entry, yielding whenever `sink` holds a full chunk."""
+    writer = csv.DictWriter(text, fieldnames=COLUMNS[kind], extrasaction="ignore")
+    writer.writeheader()
+    for entry in iter_entries(task_id, kind, **filters):
+        writer.writerow(entry)
+        if sink.size >= CHUNK_SIZE:
+            yield sink.drain()
+    text.flush()
+
+
+def stream_zip(task_id, **filters):
+    """
+    Streams a ZIP archive holding logs.csv and errors.csv for a task.
+
+    Rows are read from `log_store` in batches and compressed as they are written, so
+    only about `CHUNK_SIZE` bytes are held in memory however large the task's logs are.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        **filters: `since`, `until` and `status` filters passed to `iter_entries`.
+
+    Yields:
+        bytes: Consecutive chunks of the archive.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for kind in ("logs", "errors"):
+            with archive.open(f"{kind}.csv", "w", force_zip64=True) as member:
+                text = io.TextIOWrapper(member, encoding="utf-8", newline="")
+                yield from _write_rows(text, kind, task_id, filters, sink)
+                text.detach()
+    yield sink.drain()
+
+
+def stream_gzip(task_id, kind, **filters):
+    """
+    Streams one kind of entry ("logs" or "errors") for a task as a gzip-compressed CSV.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        kind (str): "logs" or "errors".
+        **filters: `since`, `until` and `status` filters passed to `iter_entries`.
+
+    Yields:
+        bytes: Consecutive chunks of the compressed CSV.
+    """
+    sink = _ChunkSink()
+    with gzip.GzipFile(filename=f"{kind}.csv", mode="wb", fileobj=sink) as compressed:
+        text = io.TextIOWrapper(compressed, encoding="utf-8", newline="")
+        yield from _write_rows(text, kind, task_id, filters, sink)
+        text.detach()
+    yield sink.drain()
@@ -0,0 +1,214 @@
+import os
+import sqlite3
+import threading
+import time
+
+from models.tasks import tasks_dir
+
+# Entries kept in memory per task for the live progress view; the full history is on disk
+LIVE_LOG_SIZE = 50
+
+# Seconds a finished task's logs are kept before `expire` removes them
+TASK_TTL = 14 * 24 * 3600
+
+# Columns stored for each kind of entry, in CSV/export order
+COLUMNS = {"logs": ("timestamp", "status", "message", "file", "email"),
+           "errors": ("timestamp", "file", "email", "error")}
+
+# Rows fetched per query when iterating over a task's entries
+ITER_BATCH = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    logs INTEGER NOT NULL DEFAULT 0,
+    errors INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS entries (
+    task_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    timestamp TEXT,
+    file TEXT,
+    email TEXT,
+    message TEXT,
+    status TEXT,
+    PRIMARY KEY (task_id, kind, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS account_usage (
+    account TEXT NOT NULL,
+    day TEXT NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (account, day)
+) WITHOUT ROWID;
+"""
+
+_lock = threading.Lock()
+_connection = None
+
+
+def _db():
+    """Opens the shared log database on first use. Callers must hold `_lock`."""
+    global _connection
+    if _connection is None:
+        os.makedirs(tasks_dir, exist_ok=True)
+        _connection = sqlite3.connect(os.path.join(tasks_dir, "logs.sqlite"), check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.executescript(_SCHEMA)
+        columns = [row[1] for row in _connection.execute("PRAGMA table_info(entries)")]
+        if "status" not in columns:
+            _connection.execute("ALTER TABLE entries ADD COLUMN status TEXT")
+    return _connection
+
+
+def _text_column(kind):
+    return "message" if kind == "logs" else "error"
+
+
+def create_task(task_id):
+    """Registers a task so its entries can be counted and expired."""
+    with _lock:
+        db = _db()
+        db.execute("INSERT OR IGNORE INTO tasks (task_id, created) VALUES (?, ?)", (task_id, time.time()))
+        db.commit()
+
+
+def append(task_id, kind, entries):
+    """
+    Appends log or error entries for a task in one transaction.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        kind (str): "logs" or "errors".
+        entries (list): Entry dictionaries with the keys listed in `COLUMNS[kind]`; error
+            entries are stored with the status "failed".
+    """
+    if not entries:
+        return
+    text = _text_column(kind)
+    default_status = "failed" if kind == "errors" else None
+    with _lock:
+        db = _db()
+        row = db.execute(f"SELECT {kind} FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        start = row[0] if row else 0
+        db.executemany("INSERT INTO entries (task_id, kind, seq, timestamp, file, email, message, status) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       [(task_id, kind, start + offset, entry["timestamp"], entry["file"], entry["email"], entry[text],
+                         entry.get("status", default_status))
+                        for offset, entry in enumerate(entries)])
+        db.execute(f"INSERT INTO tasks (task_id, created, {kind}) VALUES (?, ?, ?) "
+                   f"ON CONFLICT(task_id) DO UPDATE SET {kind} = excluded.{kind}",
+                   (task_id, time.time(), start + len(entries)))
+        db.commit()
+
+
+def count(task_id, kind):
+    """Returns the number of stored entries of `kind` for a task."""
+    with _lock:
+        row = _db().execute(f"SELECT {kind} FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def page(task_id, kind, offset, limit):
+    """
+    Returns one page of entries, oldest first, using the (task_id, kind, seq) index.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        kind (str): "logs" or "errors".
+        offset (int): Number of entries to skip.
+        limit (int): Maximum number of entries to return.
+
+    Returns:
+        list: Entry dictionaries with the keys listed in `COLUMNS[kind]`.
+    """
+    with _lock:
+        rows = _db().execute("SELECT seq, timestamp, file, email, message, status FROM entries "
+                             "WHERE task_id = ? AND kind = ? AND seq >= ? ORDER BY seq LIMIT ?",
+                             (task_id, kind, offset, limit)).fetchall()
+    return [_entry(kind, row) for row in rows]
+
+
+def _entry(kind, row):
+    _, timestamp, file, email, message, status = row
+    entry = {"timestamp": timestamp, "file": file, "email": email, _text_column(kind): message}
+    if kind == "logs":
+        entry["status"] = status
+    return entry
+
+
+def iter_entries(task_id, kind, since=None, until=None, status=None):
+    """
+    Yields a task's entries oldest first, fetching `ITER_BATCH` rows per query so memory
+    stays constant however many entries the task has.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        kind (str): "logs" or "errors".
+        since (str, optional): Earliest timestamp to include, "YYYY-MM-DD HH:MM:SS".
+        until (str, optional): Latest timestamp to include, same format.
+        status (str, optional): Only include entries with this status ("sent" or "failed").
+
+    Yields:
+        dict: Entry dictionaries with the keys listed in `COLUMNS[kind]`.
+    """
+    filters, params = "", []
+    if since:
+        filters += " AND timestamp >= ?"
+        params.append(since)
+    if until:
+        filters += " AND timestamp <= ?"
+        params.append(until)
+    if status:
+        filters += " AND status = ?"
+        params.append(status)
+
+    last = -1
+    while True:
+        with _lock:
+            rows = _db().execute("SELECT seq, timestamp, file, email, message, status FROM entries "
+                                 f"WHERE task_id = ? AND kind = ? AND seq > ?{filters} ORDER BY seq LIMIT ?",
+                                 (task_id, kind, last, *params, ITER_BATCH)).fetchall()
+        for row in rows:
+            yield _entry(kind, row)
+        if len(rows) < ITER_BATCH:
+            return
+        last = rows[-1][0]
+
+
+def add_usage(account, day, sent):
+    """Adds `sent` messages to a sender account's count for a day ("YYYY-MM-DD")."""
+    if not sent:
+        return
+    with _lock:
+        db = _db()
+        db.execute("INSERT INTO account_usage (account, day, sent) VALUES (?, ?, ?) "
+                   "ON CONFLICT(account, day) DO UPDATE SET sent = sent + excluded.sent", (account, day, sent))
+        db.commit()
+
+
+def usage(day):
+    """Returns the messages sent by each sender account on a day ("YYYY-MM-DD")."""
+    with _lock:
+        return dict(_db().execute("SELECT account, sent FROM account_usage WHERE day = ?", (day,)).fetchall())
+
+
+def expire(max_age=TASK_TTL):
+    """
+    Deletes tasks older than `max_age` seconds together with their entries, and sender
+    account usage from before then.
+
+    Returns:
+        list: IDs of the expired tasks.
+    """
+    cutoff = time.time() - max_age
+    with _lock:
+        db = _db()
+        expired = [row[0] for row in db.execute("SELECT task_id FROM tasks WHERE created < ?", (cutoff,))]
+        db.executemany("DELETE FROM entries WHERE task_id = ?", [(task_id,) for task_id in expired])
+        db.executemany("DELETE FROM tasks WHERE task_id = ?", [(task_id,) for task_id in expired])
+        db.execute("DELETE FROM account_usage WHERE day < ?", (time.strftime("%Y-%m-%d", time.localtime(cutoff)),))
+        db.commit()
+    return expired
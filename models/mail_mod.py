@@ -1,14 +1,14 @@
 import configparser
 import os
-import smtplib
+import re
 import time
-from email import encoders
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 import socket
+import threading
 from pathlib import Path
 
+from models import control, log_store
+from models.metrics import timed, incr
+
 # In-memory storage for progress and logs
 progress_data = dict()
 
@@ -20,86 +20,667 @@ def read_config(filename='config.ini'):
     return configure
 
 
-# Email configuration
-config = read_config()
+# Email configuration, read from config.ini by `load_config` on first use so importing this
+# module does not touch the file system. Values assigned before then (e.g. by the benchmarks) are kept.
+config = None
+smtp_server = None
+smtp_port = None
+smtp_security = None  # ssl, starttls or none
+sender_email = None
+sender_password = None
+
+# Number of messages sent over one SMTP connection before reconnecting
+SEND_BATCH_SIZE = None
+
+# Sender accounts by name: "default" is the [Email] section and each [Email:<name>] section
+# adds one. An account's `daily_quota` (0 for none) and any connection settings it sets are
+# stored here; the settings it leaves out are taken from [Email] (see `account_settings`).
+accounts = {}
+
+# Connection settings an [Email:<name>] section can set
+ACCOUNT_SETTINGS = ('smtp_server', 'smtp_port', 'smtp_security', 'sender_email', 'sender_password')
+
+# Seconds an account is passed over after it was throttled (4xx replies) or could not connect
+ACCOUNT_COOLDOWN = 300
+
+_accounts_lock = threading.Lock()
+_throttled = {}  # Account name -> time until which it is passed over
+_in_flight = {}  # Account name -> messages handed to it and not yet counted in the log store
+
+
+def load_config():
+    """Reads the [Email] settings into the module's configuration globals that are still unset, and the sender accounts."""
+    global config, smtp_server, smtp_port, smtp_security, sender_email, sender_password, SEND_BATCH_SIZE
+    if config is not None:
+        return
+    config = read_config()
+    email = config['Email']
+    smtp_server = smtp_server or email['smtp_server']
+    smtp_port = smtp_port or email.getint('smtp_port')
+    smtp_security = smtp_security or email.get('smtp_security', 'ssl')
+    sender_email = sender_email or email['sender_email']
+    sender_password = sender_password or email['sender_password']
+    SEND_BATCH_SIZE = SEND_BATCH_SIZE or email.getint('batch_size', 20)
+
+    accounts['default'] = {'daily_quota': email.getint('daily_quota', 0)}
+    for section in config.sections():
+        if section.startswith('Email:'):
+            profile = config[section]
+            account = {key: profile[key] for key in ACCOUNT_SETTINGS if key in profile}
+            if 'smtp_port' in account:
+                account['smtp_port'] = profile.getint('smtp_port')
+            account['daily_quota'] = profile.getint('daily_quota', 0)
+            accounts[section[len('Email:'):]] = account
+
+
+def account_settings(name='default'):
+    """
+    Returns the connection settings of a sender account.
+
+    Args:
+        name (str): An account in `accounts`.
+
+    Returns:
+        dict: The `ACCOUNT_SETTINGS` of the account, with those it does not set taken from [Email].
+    """
+    load_config()
+    defaults = {'smtp_server': smtp_server, 'smtp_port': smtp_port, 'smtp_security': smtp_security,
+                'sender_email': sender_email, 'sender_password': sender_password}
+    account = accounts.get(name, {})
+    return {key: account.get(key) or value for key, value in defaults.items()}
+
+
+def _today():
+    return time.strftime('%Y-%m-%d')
+
+
+def pick_account(count, exclude=()):
+    """
+    Picks the sender account for up to `count` messages and reserves its quota for them.
+
+    Accounts not throttled in the last `ACCOUNT_COOLDOWN` seconds come first; among them
+    the one with the fewest messages in flight wins, so concurrent batches are spread over
+    the accounts, then the one with the most quota left today. Throttled accounts are only
+    picked when every other one is excluded or has no quota left. Release the reservation
+    with `release_account`.
+
+    Args:
+        count (int): Messages to send.
+        exclude (tuple): Accounts already tried for these messages.
+
+    Returns:
+        tuple: The account name and how many of the messages it may send, or (None, 0)
+            when no account is left.
+    """
+    load_config()
+    now = time.time()
+    used = log_store.usage(_today())
+    with _accounts_lock:
+        candidates = []
+        for name, account in accounts.items():
+            if name in exclude:
+                continue
+            quota = account['daily_quota'] or float('inf')
+            remaining = quota - used.get(name, 0) - _in_flight.get(name, 0)
+            if remaining >= 1:
+                candidates.append((_throttled.get(name, 0) > now, _in_flight.get(name, 0), -remaining, name))
+        if not candidates:
+            return None, 0
+        _, _, remaining, name = min(candidates)
+        allowed = int(min(count, -remaining))
+        _in_flight[name] = _in_flight.get(name, 0) + allowed
+        return name, allowed
+
+
+def release_account(name, reserved, sent):
+    """Ends a reservation made by `pick_account`, counting the messages the account sent today."""
+    log_store.add_usage(name, _today(), sent)
+    with _accounts_lock:
+        _in_flight[name] -= reserved
+
+
+def throttle_account(name):
+    """Passes over an account for `ACCOUNT_COOLDOWN` seconds."""
+    with _accounts_lock:
+        _throttled[name] = time.time() + ACCOUNT_COOLDOWN
+
+
+def _record_account(task_id, name, sent, failed, seconds, throttled=False):
+    """Adds a batch's results to the task's per-account figures under `progress_data[task_id]["accounts"]`."""
+    task = progress_data.get(task_id)
+    if task is None:
+        return
+    with _accounts_lock:
+        stats = task.setdefault('accounts', {}).setdefault(
+            name, {'sent': 0, 'failed': 0, 'seconds': 0.0, 'per_second': 0.0, 'throttled': 0})
+        stats['sent'] += sent
+        stats['failed'] += failed
+        stats['seconds'] += seconds
+        stats['throttled'] += throttled
+        stats['per_second'] = round(stats['sent'] / stats['seconds'], 2) if stats['seconds'] else 0.0
+
+
+def send_batch_size():
+    """Returns `SEND_BATCH_SIZE`, loading the configuration if needed."""
+    load_config()
+    return SEND_BATCH_SIZE
 
-smtp_server = config['Email']['smtp_server']
-smtp_port = config['Email'].getint('smtp_port')
-sender_email = config['Email']['sender_email']
-sender_password = config['Email']['sender_password']
 
 # Maximum retry attempts for email sending
 MAX_RETRY_ATTEMPTS = 3
 RETRY_INTERVAL = 2  # Seconds between retries
 
+# Seconds an SMTP connection waits for the server before giving up, which bounds how long
+# a canceled task can be held by a stalled server
+SMTP_TIMEOUT = 60
+
+CANCELED = "Canceled before sending."
+
+# Enhanced status codes (RFC 3463) of permanent rejections that say the recipient's address itself
+# is bad, so later sends to it would fail too. Basic reply codes such as 550 are also used for
+# policy, authentication and spam refusals (5.7.x), so a rejection without one of these is never a bounce.
+BOUNCE_STATUSES = {'5.1.1': 'bounce', '5.1.10': 'bounce', '5.2.1': 'bounce', '5.1.3': 'invalid'}
+_ENHANCED_STATUS = re.compile(r'^\s*(5\.\d{1,3}\.\d{1,3})\b')
 
-def send_email_with_attachment(recipient_email, user_id, filename, matched_file_path):
+# Hard bounces seen by the send functions, per task, until `take_bounces` collects them
+bounces = dict()
+_bounces_lock = threading.Lock()
+
+
+def hard_bounce(code, text):
+    """
+    Classifies a permanent SMTP rejection of a recipient by the enhanced status code that
+    starts the reply text (see `BOUNCE_STATUSES`).
+
+    Args:
+        code (int): The SMTP reply code.
+        text (str or bytes): The reply text.
+
+    Returns:
+        str: "bounce" (no such or a disabled mailbox) or "invalid" (malformed address), or None
+            when the rejection is not known to be about the address, e.g. a policy or spam
+            refusal (5.7.x) or a reply without an enhanced status code.
+    """
+    if isinstance(text, bytes):
+        text = text.decode('utf-8', 'replace')
+    match = _ENHANCED_STATUS.match(text or '')
+    if code < 500 or match is None:
+        return None
+    return BOUNCE_STATUSES.get(match.group(1))
+
+
+def _record_bounce(task_id, recipient_email, code, text):
+    """
+    Notes a hard bounce for `take_bounces`, if the rejection is one (see `hard_bounce`).
+
+    Only pass replies to RCPT TO: rejections of MAIL FROM or of the message come from the
+    sender account or the content, and would suppress every recipient of a batch.
+    """
+    reason = hard_bounce(code, text)
+    if reason and recipient_email:
+        if isinstance(text, bytes):
+            text = text.decode('utf-8', 'replace')
+        with _bounces_lock:
+            bounces.setdefault(task_id, []).append((recipient_email, reason, f"{code} {text}"))
+
+
+def take_bounces(task_id):
+    """
+    Collects the hard bounces recorded for a task since the last call.
+
+    Returns:
+        list: (email, reason, detail) tuples, reason being "bounce" or "invalid".
+    """
+    with _bounces_lock:
+        return bounces.pop(task_id, [])
+
+# Loose address check for dry runs; when envelopes are probed the server has the final say
+_ADDRESS = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+_EOL = re.compile(br'(?:\r\n|\n|\r(?!\n))')
+_LEADING_PERIOD = re.compile(br'(?m)^\.')
+
+
+def build_message(recipient_email, user_id, filename, matched_file_path, sender=None):
+    """
+    Builds the notification message for a user, attaching the matched PDF.
+
+    Args:
+        recipient_email (str): User's email address
+        user_id (str): User ID
+        filename (str): Matched filename containing the user ID
+        matched_file_path (str): Full path to the matched file
+        sender (str, optional): From address; the [Email] sender_email by default
+
+    Returns:
+        tuple: The MIMEMultipart message (or None) and an error message (or None).
+    """
+    # Imported here, with smtplib in the sending functions, to keep the mail stack out of start-up
+    from email import encoders
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    # Validate input for clarity and security
+    if not all([recipient_email, user_id, filename]):
+        return None, "Error: Missing information for email notification."
+    load_config()
+
+    # Configure email details
+    subject = f"User ID: {user_id} in File: {filename}"
+    body = f"Hi {recipient_email},\n\n" \
+           f"Please find the attached file for your reference.\n\n" \
+           f"Regards,\n" \
+           f"Yours Thankfully."
+
+    # Create the message with multipart structure
+    message = MIMEMultipart()
+    message["From"] = sender or sender_email
+    message["To"] = recipient_email
+    message["Subject"] = subject
+
+    # Add the plain text body
+    message.attach(MIMEText(body, "plain"))
+
+    # Attach the PDF if provided and accessible
+    if matched_file_path and filename.lower().endswith(".pdf") and os.path.isfile(matched_file_path):
+        with open(matched_file_path, "rb") as attachment_file:
+            pdf_part = MIMEBase("application", "octet-stream")
+            pdf_part.set_payload(attachment_file.read())
+            encoders.encode_base64(pdf_part)
+            nane = filename.split('_')
+            new_filename = f'{nane[0][:-2]}**_{nane[1]}_{nane[2]}'
+            pdf_part.add_header('Content-Disposition', f'attachment; filename="{new_filename}"')
+            message.attach(pdf_part)
+    elif matched_file_path:
+        mfp = Path(matched_file_path)
+        return None, f"Warning: {mfp.name} is not a PDF file or does not exist."
+
+    return message, None
+
+
+def smtp_connect(task_id=None, account='default'):
+    """
+    Opens an authenticated connection to a sender account's SMTP server.
+
+    The `smtp_security` setting selects implicit TLS (`ssl`, the default), an upgraded
+    plain connection (`starttls`) or no encryption at all (`none`, for local relays).
+
+    Args:
+        task_id (str, optional): Task whose metrics record the connect and login timings.
+        account (str): The sender account (see `accounts`).
+
+    Returns:
+        smtplib.SMTP: A logged-in SMTP connection; the caller is responsible for closing it.
+    """
+    import smtplib
+
+    settings = account_settings(account)
+    with timed(task_id, "smtp_connect"):
+        if settings['smtp_security'] == 'ssl':
+            server = smtplib.SMTP_SSL(settings['smtp_server'], settings['smtp_port'], timeout=SMTP_TIMEOUT)
+        else:
+            server = smtplib.SMTP(settings['smtp_server'], settings['smtp_port'], timeout=SMTP_TIMEOUT)
+            if settings['smtp_security'] == 'starttls':
+                server.starttls()
+    try:
+        with timed(task_id, "smtp_login"):
+            server.ehlo_or_helo_if_needed()
+            if server.has_extn('auth'):
+                server.login(settings['sender_email'], settings['sender_password'])
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def send_email_with_attachment(recipient_email, user_id, filename, matched_file_path, task_id=None, account='default'):
     """
     Sends an email notification to the user with details about the matched file
     and optionally attaches the PDF if it exists and is accessible. Implements
-    a basic retry mechanism with a configurable retry count and interval.
+    a basic retry mechanism with a configurable retry count and interval; the wait
+    between retries ends early, without sending, when the task is canceled. Permanent
+    (5xx) rejections are not retried, and hard bounces of the recipient among them are
+    recorded for `take_bounces`.
 
     Args:
         recipient_email (str): User's email address
         user_id (str): User ID
         filename (str): Matched filename containing the user ID
         matched_file_path (str): Full path to the matched file
+        task_id (str, optional): Task whose metrics record the stage timings and retries
+        account (str): The sender account (see `accounts`)
     """
+    import smtplib
+
+    sender = account_settings(account)['sender_email']
     attempts = 0
     while attempts < MAX_RETRY_ATTEMPTS:
         try:
-            # Validate input for clarity and security
-            if not all([recipient_email, user_id, filename]):
-                error = "Error: Missing information for email notification."
+            with timed(task_id, "mime_build"):
+                message, error = build_message(recipient_email, user_id, filename, matched_file_path, sender)
+            if message is None:
                 return False, error
 
-            # Configure email details
-            subject = f"User ID: {user_id} in File: {filename}"
-            body = f"Hi {recipient_email},\n\n" \
-                   f"Please find the attached file for your reference.\n\n" \
-                   f"Regards,\n" \
-                   f"Yours Thankfully."
-
-            # Create the message with multipart structure
-            message = MIMEMultipart()
-            message["From"] = sender_email
-            message["To"] = recipient_email
-            message["Subject"] = subject
-
-            # Add the plain text body
-            message.attach(MIMEText(body, "plain"))
-
-            # Attach the PDF if provided and accessible
-            if matched_file_path and filename.lower().endswith(".pdf") and os.path.isfile(matched_file_path):
-                with open(matched_file_path, "rb") as attachment_file:
-                    pdf_part = MIMEBase("application", "octet-stream")
-                    pdf_part.set_payload(attachment_file.read())
-                    encoders.encode_base64(pdf_part)
-                    nane = filename.split('_')
-                    new_filename = f'{nane[0][:-2]}**_{nane[1]}_{nane[2]}'
-                    pdf_part.add_header('Content-Disposition', f'attachment; filename="{new_filename}"')
-                    message.attach(pdf_part)
-            elif matched_file_path:
-                mfp = Path(matched_file_path)
-                return False, f"Warning: {mfp.name} is not a PDF file or does not exist."
-
             # Create a secure connection with SMTP server
-            with smtplib.SMTP_SSL(smtp_server, smtp_port) as server:
-                server.login(sender_email, sender_password)
-
+            with smtp_connect(task_id, account) as server:
                 # Send the email
-                server.sendmail(sender_email, recipient_email, message.as_string())
+                with timed(task_id, "smtp_send"):
+                    server.sendmail(sender, recipient_email, message.as_string())
                 error = f"Email notification sent to {recipient_email} for user ID {user_id}."
                 return True, error  # Success, exit retry loop
 
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException) as e:
+            if isinstance(e, smtplib.SMTPRecipientsRefused):
+                code, text = next(iter(e.recipients.values()))
+            else:
+                code, text = e.smtp_code, e.smtp_error
+            attempts += 1
+            incr(task_id, "smtp_errors")
+            if code >= 500:
+                # A permanent rejection fails the same way on every retry
+                if isinstance(e, smtplib.SMTPRecipientsRefused):
+                    _record_bounce(task_id, recipient_email, code, text)
+                if isinstance(text, bytes):
+                    text = text.decode('utf-8', 'replace')
+                return False, f"Error sending email notification:\n{code} {text}"
+            if attempts < MAX_RETRY_ATTEMPTS:
+                incr(task_id, "smtp_retries")
+                if control.sleep(task_id, RETRY_INTERVAL):  # Wait before retrying
+                    return False, CANCELED
+            else:
+                return False, f"Maximum retries ({MAX_RETRY_ATTEMPTS}) reached.\nError sending email notification:\n{str(e)}"
+
         except (smtplib.SMTPException, FileNotFoundError, socket.gaierror, Exception) as e:
             attempts += 1
+            incr(task_id, "smtp_errors")
 
             if attempts < MAX_RETRY_ATTEMPTS:
-                time.sleep(RETRY_INTERVAL)  # Wait before retrying
+                incr(task_id, "smtp_retries")
+                if control.sleep(task_id, RETRY_INTERVAL):  # Wait before retrying
+                    return False, CANCELED
 
             else:
                 error = f"Maximum retries ({MAX_RETRY_ATTEMPTS}) reached.\nError sending email notification:\n{str(e)}"
                 return False, error
 
     # End of retry loop
+
+
+def _message_data(message):
+    """Encodes a message for the DATA phase: CRLF line endings, leading periods doubled, terminating dot."""
+    data = _LEADING_PERIOD.sub(b'..', _EOL.sub(b'\r\n', message.as_string().encode('ascii')))
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return data + b'.\r\n'
+
+
+def pipeline_messages(server, envelopes, sender=None, refused=None):
+    """
+    Sends several messages over one connection using ESMTP PIPELINING (RFC 2920).
+
+    Each message's MAIL FROM, RCPT TO and DATA commands are written in a single group,
+    together with the body and terminating dot of the previous message, so the client
+    waits for the server once per message instead of once per command. Servers that do
+    not advertise PIPELINING are served one `sendmail` at a time on the same connection.
+
+    Args:
+        server (smtplib.SMTP): An authenticated SMTP connection.
+        envelopes (list): `(recipient_email, message)` pairs.
+        sender (str, optional): MAIL FROM address; the [Email] sender_email by default.
+        refused (set, optional): Receives the indexes of the envelopes whose recipient was
+            refused at RCPT TO, as opposed to the sender or the message.
+
+    Returns:
+        list: One `(code, reply)` pair per envelope; code 250 means the message was accepted.
+              Entries are None for messages whose outcome is unknown because the connection
+              dropped before the server answered.
+    """
+    import smtplib
+
+    sender = sender or sender_email
+    results = [None] * len(envelopes)
+    if refused is None:
+        refused = set()
+    try:
+        if server.has_extn('pipelining'):
+            _pipeline(server, envelopes, results, sender, refused)
+        else:
+            for index, (recipient, message) in enumerate(envelopes):
+                try:
+                    server.sendmail(sender, recipient, message.as_string())
+                    results[index] = (250, b'OK')
+                except smtplib.SMTPRecipientsRefused as e:
+                    results[index] = e.recipients[recipient]
+                    refused.add(index)
+                except smtplib.SMTPResponseException as e:
+                    results[index] = (e.smtp_code, e.smtp_error)
+    except (smtplib.SMTPServerDisconnected, OSError):
+        pass
+    return results
+
+
+def _pipeline(server, envelopes, results, sender, refused):
+    """Runs the pipelined command groups for `pipeline_messages`, filling `results` in place."""
+    import smtplib
+
+    mail_from = f"MAIL FROM:{smtplib.quoteaddr(sender)}\r\n".encode('ascii')
+    outgoing = b''
+    pending = None  # Index of the message whose body is in `outgoing`
+
+    for index, (recipient, message) in enumerate(envelopes):
+        outgoing += mail_from + f"RCPT TO:{smtplib.quoteaddr(recipient)}\r\nDATA\r\n".encode('ascii')
+        server.send(outgoing)
+        outgoing = b''
+
+        if pending is not None:
+            results[pending] = server.getreply()
+            pending = None
+
+        mail_reply = server.getreply()
+        rcpt_reply = server.getreply()
+        data_reply = server.getreply()
+
+        if mail_reply[0] != 250:
+            failure = mail_reply
+        elif rcpt_reply[0] not in (250, 251):
+            failure = rcpt_reply
+            refused.add(index)
+        else:
+            failure = None
+
+        if data_reply[0] == 354 and failure is None:
+            outgoing = _message_data(message)
+            pending = index
+        elif data_reply[0] == 354:
+            # The server opened DATA despite rejecting the envelope, close it with an empty body
+            server.send(b'.\r\n')
+            server.getreply()
+            results[index] = failure
+        else:
+            results[index] = failure or data_reply
+            if mail_reply[0] == 250:
+                server.rset()
+
+    if pending is not None:
+        server.send(outgoing)
+        results[pending] = server.getreply()
+
+
+def send_batch_with_attachments(jobs, task_id=None, exclude=()):
+    """
+    Sends a batch of notifications over a single SMTP connection.
+
+    The batch goes to the sender account chosen by `pick_account`; jobs beyond that
+    account's quota left today are sent the same way by the next account. Messages are
+    built up front, then delivered with `pipeline_messages`. Temporary (4xx) rejections
+    and connection failures mark the account throttled and fail the affected messages
+    over to another account; when none is left, `send_email_with_attachment` retries each
+    message on its own connection. Permanent (5xx) rejections are reported as failures
+    straight away, and recipients refused with a hard bounce are recorded for `take_bounces`. Per-account results are added to the task's progress.
+
+    Args:
+        jobs (list): `(recipient_email, user_id, filename, matched_file_path)` tuples.
+        task_id (str, optional): Task whose metrics record the stage timings. The
+            `smtp_send` stage is observed once per batch.
+        exclude (tuple): Accounts already tried for these jobs.
+
+    Returns:
+        list: One `(success, message)` pair per job, in the same order as `jobs`. When every
+            account is excluded the pairs are None, so the caller falls back to its own account.
+    """
+    import smtplib
+
+    account, allowed = pick_account(len(jobs), exclude)
+    if account is None:
+        if exclude:
+            return [None] * len(jobs)
+        return [(False, "No sender account has quota left today.")] * len(jobs)
+    jobs, rest = jobs[:allowed], jobs[allowed:]
+
+    started = time.perf_counter()
+    outcomes = [None] * len(jobs)
+    handed_over = set()
+    try:
+        sender = account_settings(account)['sender_email']
+        envelopes = []
+        positions = []
+
+        for index, (recipient_email, user_id, filename, matched_file_path) in enumerate(jobs):
+            try:
+                with timed(task_id, "mime_build"):
+                    message, error = build_message(recipient_email, user_id, filename, matched_file_path, sender)
+            except OSError as e:
+                message, error = None, f"Error reading attachment {filename}:\n{str(e)}"
+            if message is None:
+                outcomes[index] = (False, error)
+            else:
+                envelopes.append((recipient_email, message))
+                positions.append(index)
+
+        replies = [None] * len(envelopes)
+        refused = set()
+        if envelopes:
+            try:
+                with smtp_connect(task_id, account) as server:
+                    with timed(task_id, "smtp_send"):
+                        replies = pipeline_messages(server, envelopes, sender, refused)
+            except (smtplib.SMTPException, OSError):
+                pass
+
+        for envelope, (position, reply) in enumerate(zip(positions, replies)):
+            if reply is None:
+                continue
+            code, text = reply
+            recipient_email, user_id = jobs[position][:2]
+            if code == 250:
+                outcomes[position] = (True, f"Email notification sent to {recipient_email} for user ID {user_id}.")
+            elif code >= 500:
+                if envelope in refused:
+                    _record_bounce(task_id, jobs[position][0], code, text)
+                if isinstance(text, bytes):
+                    text = text.decode('utf-8', 'replace')
+                outcomes[position] = (False, f"Error sending email notification:\n{code} {text}")
+
+        # Fail the unsent messages over to the other accounts
+        retry = [index for index, outcome in enumerate(outcomes) if outcome is None]
+        failover_seconds = 0.0
+        if retry:
+            throttle_account(account)
+            failover_started = time.perf_counter()
+            for index, outcome in zip(retry, send_batch_with_attachments([jobs[index] for index in retry], task_id,
+                                                                         exclude + (account,))):
+                if outcome is not None:
+                    outcomes[index] = outcome
+                    handed_over.add(index)
+            failover_seconds = time.perf_counter() - failover_started
+            if handed_over:
+                incr(task_id, "account_failovers")
+
+        for index, outcome in enumerate(outcomes):
+            if outcome is None:
+                if control.is_canceled(task_id):
+                    outcomes[index] = (False, CANCELED)
+                    continue
+                incr(task_id, "smtp_fallbacks")
+                outcomes[index] = send_email_with_attachment(*jobs[index], task_id=task_id, account=account)
+    finally:
+        # Also on an unexpected error, or the account's quota would stay reserved for the rest of the day
+        sent = sum(1 for index, outcome in enumerate(outcomes) if outcome and outcome[0] and index not in handed_over)
+        release_account(account, allowed, sent)
+    _record_account(task_id, account, sent, len(jobs) - len(handed_over) - sent,
+                    time.perf_counter() - started - failover_seconds, throttled=bool(retry))
+
+    if rest:
+        outcomes += send_batch_with_attachments(rest, task_id, exclude)
+    return outcomes
+
+
+def simulate_batch(jobs, task_id=None, probe=True):
+    """
+    Runs a batch through every step of `send_batch_with_attachments` except the DATA step.
+
+    Each message is built and encoded for DATA, so missing or unreadable attachments
+    and malformed addresses show up as failures. With `probe`, one SMTP connection is
+    opened for the batch and every recipient is offered with MAIL FROM and RCPT TO, then
+    the transaction is reset, so no message is delivered. The encoded sizes are counted
+    in the task's `message_bytes` counter. The probe uses the account `pick_account` would
+    pick for the batch.
+
+    Args:
+        jobs (list): `(recipient_email, user_id, filename, matched_file_path)` tuples.
+        task_id (str, optional): Task whose metrics record the stage timings.
+        probe (bool): Offer the envelopes to the SMTP server.
+
+    Returns:
+        list: One `(valid, message)` pair per job, in the same order as `jobs`.
+    """
+    import smtplib
+
+    outcomes = [None] * len(jobs)
+    envelopes = []
+
+    for index, (recipient_email, user_id, filename, matched_file_path) in enumerate(jobs):
+        try:
+            with timed(task_id, "mime_build"):
+                message, error = build_message(recipient_email, user_id, filename, matched_file_path)
+                if message is not None:
+                    incr(task_id, "message_bytes", len(_message_data(message)))
+        except OSError as e:
+            message, error = None, f"Error reading attachment {filename}:\n{str(e)}"
+        if message is None:
+            outcomes[index] = (False, error)
+        elif not _ADDRESS.match(recipient_email):
+            outcomes[index] = (False, f"Invalid email address {recipient_email!r} for user ID {user_id}.")
+        else:
+            envelopes.append(index)
+
+    account, reserved = pick_account(len(envelopes)) if envelopes and probe else (None, 0)
+    if account:
+        release_account(account, reserved, 0)
+        sender = account_settings(account)['sender_email']
+        try:
+            with smtp_connect(task_id, account) as server:
+                with timed(task_id, "smtp_envelope"):
+                    for index in envelopes:
+                        server.mail(sender)
+                        code, text = server.rcpt(jobs[index][0])
+                        server.rset()
+                        if code not in (250, 251):
+                            if isinstance(text, bytes):
+                                text = text.decode('utf-8', 'replace')
+                            outcomes[index] = (False, f"Recipient refused:\n{code} {text}")
+        except (smtplib.SMTPException, OSError) as e:
+            for index in envelopes:
+                if outcomes[index] is None:
+                    outcomes[index] = (False, f"Error connecting to the SMTP server:\n{str(e)}")
+    elif envelopes and probe:
+        for index in envelopes:
+            outcomes[index] = (False, "No sender account has quota left today.")
+
+    for index in envelopes:
+        if outcomes[index] is None:
+            recipient_email, user_id = jobs[index][:2]
+            outcomes[index] = (True, f"Email notification would be sent to {recipient_email} for user ID {user_id}.")
+
+    return outcomes
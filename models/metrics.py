@@ -0,0 +1,151 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# In-memory per-task metrics, keyed by task ID like `progress` and `progress_data`
+metrics_data = dict()
+
+# Upper bounds (seconds) of the stage timing histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+
+
+def start_task(task_id, kind):
+    """
+    Creates an empty metrics record for a task.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        kind (str): Task type, e.g. "split" or "mail".
+
+    Returns:
+        dict: The metrics record, also stored in `metrics_data[task_id]`.
+    """
+    record = {"kind": kind, "started": time.time(), "finished": None, "stages": {}, "counters": {}}
+    with _lock:
+        metrics_data[task_id] = record
+    return record
+
+
+def finish_task(task_id):
+    """Stamps the task's metrics record with its finish time."""
+    with _lock:
+        if task_id in metrics_data:
+            metrics_data[task_id]["finished"] = time.time()
+
+
+def observe(task_id, stage, seconds):
+    """
+    Records one timing for a stage of a task.
+
+    Args:
+        task_id (str): Unique identifier for the task; None records nothing.
+        stage (str): Stage name, e.g. "extract" or "smtp_send".
+        seconds (float): Duration of the stage.
+    """
+    if task_id is None or task_id not in metrics_data:
+        return
+    with _lock:
+        stages = metrics_data[task_id]["stages"]
+        stage_data = stages.get(stage)
+        if stage_data is None:
+            stage_data = stages[stage] = {"count": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)}
+        stage_data["count"] += 1
+        stage_data["sum"] += seconds
+        stage_data["max"] = max(stage_data["max"], seconds)
+        for index, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                stage_data["buckets"][index] += 1
+                break
+
+
+def incr(task_id, name, amount=1):
+    """Adds `amount` to a named counter of a task; None records nothing."""
+    if task_id is None or task_id not in metrics_data:
+        return
+    with _lock:
+        counters = metrics_data[task_id]["counters"]
+        counters[name] = counters.get(name, 0) + amount
+
+
+def merge(task_id, record):
+    """
+    Adds the stage timings and counters of another metrics record to a task.
+
+    Used to fold in records produced in worker processes, whose `metrics_data` is separate.
+
+    Args:
+        task_id (str): Unique identifier of the task receiving the metrics.
+        record (dict): A metrics record as created by `start_task`.
+    """
+    if task_id is None or task_id not in metrics_data or not record:
+        return
+    with _lock:
+        target = metrics_data[task_id]
+        for stage, data in record["stages"].items():
+            stage_data = target["stages"].get(stage)
+            if stage_data is None:
+                target["stages"][stage] = dict(data, buckets=list(data["buckets"]))
+                continue
+            stage_data["count"] += data["count"]
+            stage_data["sum"] += data["sum"]
+            stage_data["max"] = max(stage_data["max"], data["max"])
+            stage_data["buckets"] = [a + b for a, b in zip(stage_data["buckets"], data["buckets"])]
+        for name, value in record["counters"].items():
+            target["counters"][name] = target["counters"].get(name, 0) + value
+
+
+@contextmanager
+def timed(task_id, stage):
+    """Context manager that records the duration of its block as one `stage` observation."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(task_id, stage, time.perf_counter() - started)
+
+
+def _labels(**labels):
+    """Formats Prometheus label pairs, escaping backslashes and quotes in the values."""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+        pairs.append(f'{key}="{value}"')
+    return ",".join(pairs)
+
+
+def render_prometheus():
+    """
+    Renders every task's metrics in the Prometheus text exposition format.
+
+    Returns:
+        str: `mailing_stage_seconds` histograms and `mailing_task_events_total` counters,
+             labelled by task ID, task kind and stage or event name.
+    """
+    with _lock:
+        tasks = [(task_id, record["kind"], {stage: dict(data, buckets=list(data["buckets"]))
+                                            for stage, data in record["stages"].items()},
+                  dict(record["counters"]))
+                 for task_id, record in metrics_data.items()]
+
+    lines = ["# HELP mailing_stage_seconds Time spent in each stage of split and mail tasks.",
+             "# TYPE mailing_stage_seconds histogram"]
+    for task_id, kind, stages, _ in tasks:
+        for stage, data in sorted(stages.items()):
+            labels = _labels(task=task_id, kind=kind, stage=stage)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, data["buckets"]):
+                cumulative += count
+                lines.append(f'mailing_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'mailing_stage_seconds_bucket{{{labels},le="+Inf"}} {data["count"]}')
+            lines.append(f"mailing_stage_seconds_sum{{{labels}}} {data['sum']:.6f}")
+            lines.append(f"mailing_stage_seconds_count{{{labels}}} {data['count']}")
+
+    lines += ["# HELP mailing_task_events_total Events counted while running split and mail tasks.",
+              "# TYPE mailing_task_events_total counter"]
+    for task_id, kind, _, counters in tasks:
+        for event, value in sorted(counters.items()):
+            lines.append(f"mailing_task_events_total{{{_labels(task=task_id, kind=kind, event=event)}}} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Most pages kept in the cache; the least recently used are evicted beyond this
+CACHE_SIZE = 200000
+
+# Digests looked up per query
+QUERY_BATCH = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    digest TEXT PRIMARY KEY,
+    details TEXT NOT NULL,
+    used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS pages_used ON pages (used);
+"""
+
+_lock = threading.Lock()
+_connection = None
+
+
+def _db():
+    """Opens the cache database on first use. Callers must hold `_lock`."""
+    global _connection
+    if _connection is None:
+        # Imported here because models.tasks imports models.pdf_rel, which imports this module
+        from models.tasks import tasks_dir
+        os.makedirs(tasks_dir, exist_ok=True)
+        # Batch split workers are separate processes sharing the file, so wait for their writes
+        _connection = sqlite3.connect(os.path.join(tasks_dir, "page_cache.sqlite"), timeout=30,
+                                      check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.executescript(_SCHEMA)
+    return _connection
+
+
+def page_digest(page, seen=None):
+    """
+    Hashes everything that draws a PDF page: its content stream(s) and the resources they use.
+
+    Pages drawn by identical content streams and resources produce the same text, so the
+    digest identifies a page across runs and across copies of the same PDF without extracting
+    its text. The resources count as much as the content: a page that only says `q /X1 Do Q`
+    shows whatever its form XObject `/X1` draws, and the same text operators print different
+    characters with different fonts.
+
+    Args:
+        page (PdfReader.Page): A page object from a PyPDF2 PdfReader instance.
+        seen (dict, optional): Digests of indirect objects already hashed, shared by the pages
+            of one document so fonts and images used on every page are hashed once.
+
+    Returns:
+        str: Hex SHA-256 of the page's content stream(s) and resources, or None for a page
+            without content.
+    """
+    contents = page.get("/Contents")
+    if contents is None:
+        return None
+    if seen is None:
+        seen = {}
+    resources, node = page.get("/Resources"), page
+    while resources is None and node.get("/Parent") is not None:  # Resources may be inherited
+        node = node["/Parent"].get_object()
+        resources = node.get("/Resources")
+    digest = hashlib.sha256()
+    digest.update(_object_digest(contents, seen))
+    digest.update(_object_digest(resources, seen))
+    return digest.hexdigest()
+
+
+def _object_digest(value, seen):
+    """Hashes a PDF object with the objects it refers to, each indirect object once per `seen`."""
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+    if isinstance(value, IndirectObject):
+        key = (value.idnum, value.generation)
+        if key not in seen:
+            seen[key] = b"cycle"  # Stands in for the object while it is being hashed
+            seen[key] = _object_digest(value.get_object(), seen)
+        return seen[key]
+    digest = hashlib.sha256(type(value).__name__.encode())
+    skip = {"/Parent"}
+    if isinstance(value, StreamObject):
+        try:
+            data = value.get_data()
+            # Hashed decoded, so a copy saved with other compression still matches
+            skip.update(("/Length", "/Filter", "/DecodeParms"))
+        except Exception:  # Filters PyPDF2 cannot decode, e.g. JBIG2 images: the raw bytes do as well
+            data = value._data
+        data = data if isinstance(data, bytes) else data.encode()
+        digest.update(len(data).to_bytes(8, "big") + data)
+    if isinstance(value, DictionaryObject):
+        for name in sorted(value):
+            if name not in skip:
+                digest.update(name.encode() + _object_digest(value[name], seen))
+    elif isinstance(value, ArrayObject):
+        for item in value:
+            digest.update(_object_digest(item, seen))
+    else:
+        digest.update(repr(value).encode())
+    return digest.digest()
+
+
+def discard_many(digests):
+    """Removes pages from the cache, e.g. when one digest gave different details within a document."""
+    digests = [digest for digest in set(digests) if digest]
+    if not digests:
+        return
+    with _lock:
+        db = _db()
+        db.executemany("DELETE FROM pages WHERE digest = ?", [(digest,) for digest in digests])
+        db.commit()
+
+
+def get_many(digests):
+    """
+    Looks up cached details for many pages and marks the hits as recently used.
+
+    Args:
+        digests (list): Digests from `page_digest`; None entries are ignored.
+
+    Returns:
+        dict: Maps each cached digest to its details (IPPIS, surname, month, year).
+    """
+    wanted = [digest for digest in set(digests) if digest]
+    found = {}
+    with _lock:
+        db = _db()
+        for start in range(0, len(wanted), QUERY_BATCH):
+            batch = wanted[start:start + QUERY_BATCH]
+            rows = db.execute(f"SELECT digest, details FROM pages WHERE digest IN ({', '.join('?' * len(batch))})",
+                              batch).fetchall()
+            found.update((digest, json.loads(details)) for digest, details in rows)
+        if found:
+            now = time.time()
+            db.executemany("UPDATE pages SET used = ? WHERE digest = ?", [(now, digest) for digest in found])
+            db.commit()
+    return found
+
+
+def put_many(entries, max_size=CACHE_SIZE):
+    """
+    Stores extracted details in one transaction, then evicts the least recently used
+    pages if the cache holds more than `max_size`.
+
+    Only pages that parsed are stored, so a page that failed with one layout is extracted
+    again once a matching layout is registered.
+
+    Args:
+        entries (dict): Maps digests to details (IPPIS, surname, month, year).
+        max_size (int): Most pages to keep.
+    """
+    entries = {digest: details for digest, details in entries.items() if digest and details}
+    if not entries:
+        return
+    now = time.time()
+    with _lock:
+        db = _db()
+        db.executemany("INSERT OR REPLACE INTO pages (digest, details, used) VALUES (?, ?, ?)",
+                       [(digest, json.dumps(details), now) for digest, details in entries.items()])
+        excess = db.execute("SELECT COUNT(*) FROM pages").fetchone()[0] - max_size
+        if excess > 0:
+            db.execute("DELETE FROM pages WHERE digest IN (SELECT digest FROM pages ORDER BY used LIMIT ?)",
+                       (excess,))
+        db.commit()
+
+
+def clear():
+    """Empties the cache, e.g. after changing a layout's patterns."""
+    with _lock:
+        db = _db()
+        db.execute("DELETE FROM pages")
+        db.commit()
@@ -0,0 +1,104 @@
+import re
+
+# Registered payslip layouts, tried in order when a document's layout is selected
+LAYOUTS = []
+
+# Fields every layout must capture, in the order `parse_page` returns them
+FIELDS = ("ippis", "surname", "month", "year")
+
+
+def register_layout(name, fingerprint, fields):
+    """
+    Registers a payslip layout.
+
+    Args:
+        name (str): Name of the layout, shown in logs.
+        fingerprint (str): Regular expression that only matches the first page of this layout.
+        fields (dict): Maps each name in `FIELDS` to a regular expression with a group of the
+            same name, e.g. `{"ippis": r"IPPIS Number:\\s*(?P<ippis>\\d+)", ...}`.
+
+    Returns:
+        dict: The compiled layout.
+    """
+    missing = set(FIELDS) - set(fields)
+    if missing:
+        raise ValueError(f"Layout {name} has no pattern for {', '.join(sorted(missing))}.")
+    layout = {"name": name, "fingerprint": re.compile(fingerprint, re.MULTILINE),
+              "fields": [(field, re.compile(fields[field], re.MULTILINE)) for field in FIELDS]}
+    LAYOUTS.append(layout)
+    return layout
+
+
+def select_layout(text):
+    """
+    Picks the layout of a document from the text of its first page.
+
+    This runs once per document, so every later page is parsed with one known layout
+    instead of trying each layout in turn.
+
+    Args:
+        text (str): Extracted text of the first page.
+
+    Returns:
+        dict: The first registered layout whose fingerprint matches, or None to use the
+              line offset parser.
+    """
+    for layout in LAYOUTS:
+        if layout["fingerprint"].search(text):
+            return layout
+    return None
+
+
+def parse_page(layout, text):
+    """
+    Extracts the payslip details from the text of one page.
+
+    Args:
+        layout (dict): Layout from `select_layout`, or None for the line offset parser.
+        text (str): Extracted text of the page.
+
+    Returns:
+        list: The details (IPPIS, surname, month, year) or None if the page does not match.
+    """
+    if layout is None:
+        return _parse_offsets(text)
+    details = []
+    for field, pattern in layout["fields"]:
+        match = pattern.search(text)
+        if not match:
+            return None
+        details.append(match.group(field).strip())
+    return details
+
+
+def _parse_offsets(text):
+    """Original parser for documents no registered layout recognises: reads fixed line offsets."""
+    try:
+        contents = text.split('\n')
+        content = contents[3:6]
+
+        dates = content[0].strip().split('-')
+        d_mon = dates[0]
+        d_year = dates[-1]
+        sur_name = content[1].split(':')[1].split(',')[0].strip()
+        if ':' in content[-1]:
+            ippis = content[-1].split(':')[-1].strip()
+        else:
+            ippis = contents[6].split(':')[-1].strip()
+        return [ippis, sur_name, d_mon, d_year]
+    except IndexError:
+        return None
+
+
+# IPPIS payslips: a "MON-YYYY" line followed by "Name: SURNAME, OTHER NAMES" and the IPPIS number,
+# which is either on the same line as its label or on the next one.
+register_layout(
+    "ippis_payslip",
+    fingerprint=r"^\s*Name\s*:.*,[\s\S]*IPPIS",
+    fields={
+        "ippis": r"IPPIS[^:]{0,40}:\s*(?P<ippis>\d+)",
+        "surname": r"^\s*Name\s*:\s*(?P<surname>[^,\n]+),",
+        "month": r"^\s*(?P<month>[A-Za-z]{3,9})\s*-(?:[^\n]*-)?\s*\d{4}\s*$",
+        "year": r"^\s*[A-Za-z]{3,9}\s*-(?:[^\n]*-)?\s*(?P<year>\d{4})\s*$",
+    },
+)
@@ -0,0 +1,196 @@
+import re
+from io import BytesIO
+
+# Resource categories whose entries content streams refer to by name
+RESOURCE_TYPES = ('/Font', '/XObject', '/ExtGState', '/ColorSpace', '/Pattern', '/Shading', '/Properties')
+
+# Objects never merged with an identical twin: the document structure itself
+_STRUCTURE_TYPES = ('/Catalog', '/Pages', '/Page')
+
+# Passes of `_dedupe`; each one can merge the parents of the objects merged by the previous one
+DEDUPE_PASSES = 3
+
+_NAME = re.compile(rb'/([^\s/\[\]()<>{}%]+)')
+_ESCAPE = re.compile(rb'#([0-9A-Fa-f]{2})')
+
+
+def _streams(page):
+    """Returns the content stream objects of a page, or an empty list for a page without content."""
+    from PyPDF2.generic import ArrayObject
+
+    contents = page.get('/Contents')
+    if contents is None:
+        return []
+    contents = contents.get_object()
+    return [stream.get_object() for stream in contents] if isinstance(contents, ArrayObject) else [contents]
+
+
+def used_names(page):
+    """
+    Lists the names a page's content streams use, such as the fonts selected with `Tf`
+    and the images drawn with `Do`.
+
+    Every name token counts, whatever operator it belongs to, so a name is never missed;
+    at worst an unused resource whose name also appears in the stream is kept.
+
+    Returns:
+        set: Names with their leading slash, e.g. "/F1".
+    """
+    names = set()
+    for stream in _streams(page):
+        for name in _NAME.findall(stream.get_data()):
+            name = _ESCAPE.sub(lambda match: bytes([int(match.group(1), 16)]), name)
+            names.add('/' + name.decode('latin-1'))
+    return names
+
+
+def prune_resources(page):
+    """
+    Gives a page its own resource dictionary holding only the entries its content uses.
+
+    Source documents often share one resource dictionary (every font and image of the
+    document) between all pages, and a copied page drags all of it along. Resources
+    shared with other pages of the same output file are replaced, not modified.
+    """
+    from PyPDF2.generic import DictionaryObject, NameObject
+
+    resources = page.get('/Resources')
+    if resources is None or page.get('/Contents') is None:
+        return
+    names = used_names(page)
+    pruned = DictionaryObject()
+    for category, entries in resources.get_object().items():
+        if category in RESOURCE_TYPES:
+            used = DictionaryObject({name: value for name, value in entries.get_object().items() if name in names})
+            if used:
+                pruned[NameObject(category)] = used
+        else:
+            pruned[NameObject(category)] = entries
+    page[NameObject('/Resources')] = pruned
+
+
+def compress_contents(page):
+    """
+    Flate-compresses a page's content streams if none of them is compressed yet.
+
+    Returns:
+        int: Bytes saved.
+    """
+    streams = _streams(page)
+    if not streams or any('/Filter' in stream for stream in streams):
+        return 0
+    before = sum(len(stream.get_data()) for stream in streams)
+    page.compress_content_streams()
+    return max(0, before - sum(len(stream._data) for stream in _streams(page)))
+
+
+def _serialize(obj):
+    output = BytesIO()
+    obj.write_to_stream(output, None)
+    return output.getvalue()
+
+
+def _children(obj):
+    """Yields (container, key, value) for every value inside a dictionary or array, recursing into direct ones."""
+    from PyPDF2.generic import ArrayObject, DictionaryObject
+
+    stack = [obj]
+    while stack:
+        container = stack.pop()
+        if isinstance(container, DictionaryObject):
+            # Items, unlike indexing, leave indirect references unresolved
+            items = list(container.items())
+        else:
+            items = list(enumerate(container))
+        for key, value in items:
+            yield container, key, value
+            if isinstance(value, (DictionaryObject, ArrayObject)):
+                stack.append(value)
+
+
+def _reachable(writer):
+    """Returns the numbers of the writer's objects reachable from its catalog and info dictionary."""
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject
+
+    seen = set()
+    stack = [writer._root, writer._info]
+    while stack:
+        reference = stack.pop()
+        if reference.idnum in seen:
+            continue
+        seen.add(reference.idnum)
+        obj = writer._objects[reference.idnum - 1]
+        if not isinstance(obj, (DictionaryObject, ArrayObject)):
+            continue
+        for _, _, value in _children(obj):
+            if isinstance(value, IndirectObject) and value.pdf is writer and value.idnum not in seen:
+                stack.append(value)
+    return seen
+
+
+def _dedupe(writer, reachable):
+    """
+    Points every reference to an object at the first object that serializes to the same
+    bytes, e.g. the same font program embedded once per page.
+
+    Returns:
+        bool: Whether any object was merged.
+    """
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject
+
+    first, duplicates = {}, {}
+    for idnum in sorted(reachable):
+        obj = writer._objects[idnum - 1]
+        if idnum in (writer._root.idnum, writer._info.idnum) or (
+                isinstance(obj, DictionaryObject) and obj.get('/Type') in _STRUCTURE_TYPES):
+            continue
+        duplicates[idnum] = first.setdefault(_serialize(obj), idnum)
+    duplicates = {idnum: kept for idnum, kept in duplicates.items() if idnum != kept}
+    if not duplicates:
+        return False
+
+    for idnum in reachable:
+        obj = writer._objects[idnum - 1]
+        if not isinstance(obj, (DictionaryObject, ArrayObject)):
+            continue
+        for container, key, value in _children(obj):
+            if isinstance(value, IndirectObject) and value.pdf is writer and value.idnum in duplicates:
+                container[key] = IndirectObject(duplicates[value.idnum], 0, writer)
+    return True
+
+
+def optimize(writer):
+    """
+    Shrinks a PdfWriter's output before it is encrypted and written.
+
+    - Prunes each page's resources to those its content uses (`prune_resources`).
+    - Compresses uncompressed content streams (`compress_contents`).
+    - Merges identical objects, such as fonts embedded once per source page (`_dedupe`).
+    - Drops the objects nothing refers to any more. PdfWriter writes every object it
+      holds, so they are replaced by `null` to keep the object numbers valid.
+
+    Args:
+        writer (PdfWriter): A writer whose pages have been added.
+
+    Returns:
+        int: Bytes saved: the serialized size of the dropped objects plus the content
+            stream compression.
+    """
+    from PyPDF2.generic import NullObject
+
+    saved = 0
+    for page in writer.pages:
+        prune_resources(page)
+        saved += compress_contents(page)
+
+    reachable = _reachable(writer)
+    for _ in range(DEDUPE_PASSES):
+        if not _dedupe(writer, reachable):
+            break
+        reachable = _reachable(writer)
+
+    for index, obj in enumerate(writer._objects):
+        if obj is not None and index + 1 not in reachable and not isinstance(obj, NullObject):
+            saved += len(_serialize(obj))
+            writer._objects[index] = NullObject()
+    return saved
@@ -1,59 +1,56 @@
+import hashlib
+import multiprocessing
 import os
 import shutil
-import time
+from collections import Counter
+from concurrent.futures import CancelledError, ProcessPoolExecutor, wait
+from io import BytesIO
 
-from PyPDF2 import PdfReader, PdfWriter
-
-if not os.path.exists('data'):
-    os.makedirs('data')
+from models import control
+from models.metrics import timed, incr, finish_task, start_task, merge, metrics_data
+from models.page_cache import page_digest, get_many, put_many, discard_many
+from models.pdf_optimize import optimize
+from models.parsers import select_layout, parse_page
+from models.split_index import write_index, shard_of
 
+# Created by `app.create_app` and by the jobs that write into it
 base_dir = os.path.abspath('data')
 progress = dict()
 
+# Per-file progress of batch split tasks: {task_id: {file: percent}}
+batch_progress = dict()
 
-def detail_extract(file_page):
-    """Extracts specific details from a single PDF page.
+# Worker processes shared by every batch split, created on first use
+SPLIT_WORKERS = os.cpu_count() or 1
+_pool = None
+_manager = None
 
-    - Attempts to extract name, month, year, and potentially an IPPIS number
-      from the provided PDF page object.
-    - Handles potential exceptions and returns `None` if extraction fails.
 
-    Args:
-        file_page (PdfReader.Page): A page object from a PyPDF2 PdfReader instance.
-
-    Returns:
-        list: A list containing extracted details (IPPIS, surname, month, year)
-              or None if extraction fails.
-    """
-    try:
-        contents = file_page.extract_text().split('\n')
-        content = contents[3:6]
-
-        dates = content[0].strip().split('-')
-        d_mon = dates[0]
-        d_year = dates[-1]
-        sur_name = content[1].split(':')[1].split(',')[0].strip()
-        if ':' in content[-1]:
-            ippis = content[-1].split(':')[-1].strip()
-        else:
-            ippis = content[6].split(':')[-1].strip()
-        new_name = [ippis, sur_name, d_mon, d_year]
-        return new_name
-    except Exception as e:
-        print(str(e))
-        return None
-
-
-def splitter(file, file_path, task_id):
-    """Splits a PDF file into individual pages with encryption.
+def splitter(file, file_path, task_id, store=None, shard=False):
+    """Splits a PDF file into one encrypted PDF per person.
 
     - Creates a new directory for the split pages (if it doesn't exist).
     - Iterates through each page in the PDF.
-        - Extracts details (name, month, year, IPPIS) using `detail_extract`.
-        - Updates task progress in the `progress` dictionary.
+        - Selects the payslip layout from the first page and extracts details
+          (name, month, year, IPPIS) from every page with it (see `models.parsers`).
+        - Counts pages the layout does not match as `pages_unparsed`.
+        - Reuses details of pages seen in earlier runs from `models.page_cache`,
+          counting `cache_hits` and `cache_misses`; only missed pages are extracted.
+          Pages whose digest occurs more than once in the document are always extracted,
+          and a digest whose pages give different details is dropped from the cache
+          instead of stored, counting `cache_conflicts`.
         - Skips pages where details cannot be extracted.
-        - Creates a new single-page PDF with extracted details in the filename.
-        - Encrypts the new PDF using a password derived from details.
+        - Groups the pages by IPPIS number, counting pages after a person's first as `pages_merged`.
+    - Writes one PDF per person with all of their pages, named after the details of the
+      first page, and encrypts it using a password derived from those details. Each file is
+      shrunk by `models.pdf_optimize.optimize` first, counting `bytes_saved`.
+    - Writes the folder's index (see `models.split_index`) once every file is written.
+    - Updates task progress in the `progress` dictionary: extraction is the first half.
+    - Records extract/encrypt/write timings and page counters in the task's metrics.
+
+    - Stops at a checkpoint before each page and each person's file while the task is paused
+      (see `models.control`), carrying on from there when resumed. When the task is canceled,
+      the output folder is removed and `canceled` is counted.
 
     - Marks task progress as complete (100%) on success, or error (also 100%) on exception.
 
@@ -61,10 +58,19 @@ def splitter(file, file_path, task_id):
         file (str): Path to the original PDF file.
         file_path (str): Path to the directory for storing split pages.
         task_id (str): Unique identifier for the task.
+        store (dict, optional): Mapping that receives the progress, defaults to `progress`.
+            Batch splits pass a shared dictionary so worker processes can report back.
+        shard (bool): Spread the files over subfolders named by `split_index.shard_of`, so no
+            directory of a large split holds more than a few hundred entries.
 
     Returns:
-        bool: True on success, False on exception.
+        bool: True on success, False on exception or cancellation.
     """
+    # Imported here to keep PyPDF2 out of the start-up of everything that imports this module
+    from PyPDF2 import PdfReader, PdfWriter
+
+    if store is None:
+        store = progress
     try:
         if os.path.exists(file_path):
             shutil.rmtree(file_path)
@@ -74,34 +80,217 @@ def splitter(file, file_path, task_id):
         pdf_reader = PdfReader(file)
         pages = len(pdf_reader.pages)
 
+        with timed(task_id, 'cache_lookup'):
+            seen = {}
+            digests = [page_digest(page, seen) for page in pdf_reader.pages]
+            cached = get_many(digests)
+        repeated = {digest for digest, count in Counter(digests).items() if count > 1}
+        extracted = {}
+        conflicts = set()
+        index = {}
+
+        layout, layout_selected = None, False
+        people = {}  # IPPIS -> (details of its first page, its page numbers), in page order
         for i in range(pages):
-            name = detail_extract(pdf_reader.pages[i])
+            if control.checkpoint(task_id):
+                return _cancel_split(file_path, task_id, store)
+            name = cached.get(digests[i]) if digests[i] not in repeated else None
+            if name:
+                incr(task_id, 'cache_hits')
+            else:
+                incr(task_id, 'cache_misses')
+                with timed(task_id, 'extract'):
+                    if not layout_selected:
+                        # The layout is chosen once per document; later pages go straight to its patterns
+                        layout, layout_selected = select_layout(pdf_reader.pages[0].extract_text()), True
+                    name = parse_page(layout, pdf_reader.pages[i].extract_text())
+                if digests[i] in extracted and extracted[digests[i]] != name:
+                    conflicts.add(digests[i])
+                extracted[digests[i]] = name
+            incr(task_id, 'pages')
 
-            # Update progress
-            progress[task_id] = (i + 1) / pages * 100
-            time.sleep(0.1)  # Simulate time taken for processing each page
+            # Update progress; extraction is the first half of the work
+            store[task_id] = (i + 1) / pages * 50
+            if control.sleep(task_id, 0.1):  # Simulate time taken for processing each page
+                return _cancel_split(file_path, task_id, store)
 
             if not name:
+                incr(task_id, 'pages_unparsed')
                 continue
 
-            pdf_writer = PdfWriter()
-            pdf_writer.add_page(pdf_reader.pages[i])
+            if name[0] in people:
+                incr(task_id, 'pages_merged')
+            people.setdefault(name[0], (name, []))[1].append(i)
 
-            # if name[0] == '482427':
-            #     name[0] = str(int(name[0]) + i)
+        for written, (ippis, (name, numbers)) in enumerate(people.items(), 1):
+            if control.checkpoint(task_id):
+                return _cancel_split(file_path, task_id, store)
+            # All of a person's pages go into one file, so they get one message with nothing left out
+            pdf_writer = PdfWriter()
+            for number in numbers:
+                pdf_writer.add_page(pdf_reader.pages[number])
+            with timed(task_id, 'optimize'):
+                incr(task_id, 'bytes_saved', optimize(pdf_writer))
 
             pswd = f'{name[1][:2]}{name[0][-2:]}'
-            pdf_writer.encrypt(pswd)
+            with timed(task_id, 'encrypt'):
+                pdf_writer.encrypt(pswd)
 
             name = f'{name[0]}_{name[1]}_{name[2]}-{name[3]}.pdf'
 
-            file_name = str(os.path.join(file_path, name))
-            with open(file_name, 'wb') as f:
-                pdf_writer.write(f)
+            subfolder = shard_of(ippis) if shard else ''
+            if subfolder:
+                os.makedirs(os.path.join(file_path, subfolder), exist_ok=True)
+            file_name = str(os.path.join(file_path, subfolder, name))
+            with timed(task_id, 'write'):
+                output = BytesIO()
+                pdf_writer.write(output)
+                data = output.getvalue()
+                with open(file_name, 'wb') as f:
+                    f.write(data)
+            index[name] = {'ippis': ippis, 'page': numbers[0], 'pages': numbers, 'size': len(data),
+                           'sha256': hashlib.sha256(data).hexdigest(), 'location': '', 'shard': subfolder}
+            incr(task_id, 'files_written')
+            store[task_id] = 50 + written / len(people) * 50
 
-        progress[task_id] = 100  # Ensure progress is marked complete
+        write_index(file_path, index)
+        with timed(task_id, 'cache_store'):
+            if conflicts:
+                # Never reuse details for pages the digest cannot tell apart
+                incr(task_id, 'cache_conflicts', len(conflicts))
+                discard_many(conflicts)
+            put_many({digest: name for digest, name in extracted.items() if digest not in conflicts})
+        store[task_id] = 100  # Ensure progress is marked complete
         return True
     except Exception as e:
-        progress[task_id] = 100  # Indicate error
+        store[task_id] = 100  # Indicate error
+        incr(task_id, 'errors')
         print('error:', e)
         return False
+    finally:
+        finish_task(task_id)
+
+
+def _cancel_split(file_path, task_id, store):
+    """Drops the partial output of a canceled split and marks it done."""
+    shutil.rmtree(file_path, ignore_errors=True)
+    incr(task_id, 'canceled')
+    store[task_id] = 100
+    return False
+
+
+def output_folder(file):
+    """Returns the split output folder for a PDF: a folder named after it in the base directory."""
+    return os.path.join(base_dir, os.path.basename(file).split(".", maxsplit=1)[0])
+
+
+def colliding_outputs(files):
+    """
+    Finds PDFs of a batch that would be split into the same output folder (see `output_folder`),
+    e.g. `a/March.pdf` and `b/March.pdf`, or `March.v1.pdf` and `March.v2.pdf`.
+
+    Returns:
+        dict: Maps each shared output folder to the files that would write it.
+    """
+    targets = {}
+    for file in files:
+        targets.setdefault(output_folder(file), []).append(file)
+    return {folder: shared for folder, shared in targets.items() if len(shared) > 1}
+
+
+def _split_worker(file, file_path, task_id, store, shard=False, flags=None):
+    """Runs `splitter` in a worker process and returns its result with the metrics it recorded."""
+    start_task(task_id, "split")
+    if flags:
+        control.attach(task_id, *flags)
+    try:
+        result = splitter(file, file_path, task_id, store, shard)
+    finally:
+        control.forget(task_id)
+    return result, metrics_data.pop(task_id, None)
+
+
+def _get_pool(workers=None):
+    """Returns the shared split worker pool and progress manager, starting them on first use."""
+    global _pool, _manager
+    if _pool is None:
+        context = multiprocessing.get_context("spawn")
+        _manager = context.Manager()
+        _pool = ProcessPoolExecutor(max_workers=workers or SPLIT_WORKERS, mp_context=context)
+    return _pool, _manager
+
+
+def batch_splitter(files, task_id, workers=None, shard=False):
+    """Splits and encrypts many PDFs in one task using the shared worker process pool.
+
+    - Each file is split by `splitter` in a worker process into its own folder
+      (see `output_folder`), so a batch uses every core instead of one thread.
+    - Per-file progress is published in `batch_progress[task_id]` and the aggregate,
+      weighted by file size, in `progress[task_id]`.
+    - Metrics recorded by the workers are merged into the task's metrics.
+    - The task's control flags are shared with the workers, so pausing or canceling the
+      batch pauses or cancels every file (see `splitter`); files not started yet are
+      dropped from the pool when it is canceled.
+    - Files that would share an output folder with another file of the batch (see
+      `colliding_outputs`) are not split at all, since their workers would overwrite each
+      other's output; they fail, counting `output_conflicts`.
+
+    Args:
+        files (list): Paths of the PDF files to split.
+        task_id (str): Unique identifier for the batch task.
+        workers (int, optional): Pool size, only used when the pool is first created.
+        shard (bool): Write sharded output folders (see `splitter`).
+
+    Returns:
+        dict: Maps each file to True on success, False on failure.
+    """
+    results = {}
+    try:
+        pool, manager = _get_pool(workers)
+        store = manager.dict()
+        sizes = {file: max(os.path.getsize(file), 1) for file in files}
+        total_size = sum(sizes.values()) or 1
+        batch_progress[task_id] = {file: 0 for file in files}
+        flags = control.register(task_id, manager.Event)
+
+        conflicts = {file for shared in colliding_outputs(files).values() for file in shared}
+        for file in conflicts:
+            print('error:', file, 'shares its output folder', output_folder(file), 'with another file of the batch')
+            results[file] = False
+            batch_progress[task_id][file] = 100
+            incr(task_id, 'output_conflicts')
+            incr(task_id, 'files_failed')
+
+        futures = {pool.submit(_split_worker, file, output_folder(file), f"{task_id}-{index}", store, shard,
+                               (flags["cancel"], flags["running"])): file
+                   for index, file in enumerate(files) if file not in conflicts}
+        sub_tasks = {file: f"{task_id}-{index}" for index, file in enumerate(files) if file not in conflicts}
+
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=0.5)
+            if control.is_canceled(task_id):
+                for future in pending:
+                    future.cancel()
+            snapshot = dict(store)
+            for file, sub_task in sub_tasks.items():
+                batch_progress[task_id][file] = snapshot.get(sub_task, 0)
+            aggregate = sum(batch_progress[task_id][file] * sizes[file] for file in files) / total_size
+            progress[task_id] = min(aggregate, 99.9)  # 100 is set once the results are merged
+
+        for future, file in futures.items():
+            try:
+                results[file], record = future.result()
+                merge(task_id, record)
+            except CancelledError:
+                results[file] = False
+                incr(task_id, 'canceled')
+            except Exception as e:
+                print('error:', file, e)
+                results[file] = False
+            if not results[file]:
+                incr(task_id, 'files_failed')
+        return results
+    finally:
+        progress[task_id] = 100
+        finish_task(task_id)
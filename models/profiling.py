@@ -0,0 +1,119 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from models.tasks import tasks_dir, task_dir
+
+# Profiling modes offered for background jobs
+PROFILERS = ("sample", "cprofile")
+
+# Artefacts a profiled task may have, in the order they are listed for download
+PROFILE_FILES = ("stacks.collapsed", "profile.prof", "profile.txt")
+
+SAMPLE_INTERVAL = 0.01  # Seconds between stack samples
+
+
+class StackSampler:
+    """
+    Low-overhead sampling profiler for a single thread.
+
+    A daemon thread snapshots the target thread's stack every `interval` seconds
+    and counts identical stacks, which is all a flame graph needs.
+
+    Args:
+        thread_id (int): `threading.get_ident()` of the thread to sample.
+        interval (float): Seconds between samples.
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if frames:
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def write_collapsed(self, path):
+        """Writes the samples in the collapsed-stack format read by flamegraph.pl and speedscope."""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def run_profiled(mode, task_id, target, *args):
+    """
+    Runs `target(*args)` in the current thread under a profiler and saves the results.
+
+    Every mode samples the thread's stacks into `stacks.collapsed`. The `cprofile` mode
+    also records deterministic call statistics into `profile.prof` (loadable with
+    `pstats` or snakeviz) and a text summary sorted by cumulative time in `profile.txt`.
+    Files are written to the task's directory even when the target raises.
+
+    Args:
+        mode (str): One of `PROFILERS`.
+        task_id (str): Unique identifier for the task being profiled.
+        target (callable): The job function, e.g. `splitter` or `send_emails`.
+        *args: Arguments for `target`.
+
+    Returns:
+        The return value of `target`.
+    """
+    out_dir = task_dir(task_id)
+    sampler = StackSampler(threading.get_ident()).start()
+    profiler = cProfile.Profile() if mode == "cprofile" else None
+    started = time.perf_counter()
+    try:
+        if profiler:
+            return profiler.runcall(target, *args)
+        return target(*args)
+    finally:
+        sampler.stop()
+        sampler.write_collapsed(os.path.join(out_dir, "stacks.collapsed"))
+        if profiler:
+            profiler.dump_stats(os.path.join(out_dir, "profile.prof"))
+            summary = io.StringIO()
+            summary.write(f"Wall time: {time.perf_counter() - started:.3f}s\n\n")
+            pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(60)
+            with open(os.path.join(out_dir, "profile.txt"), "w") as f:
+                f.write(summary.getvalue())
+
+
+def list_profiles():
+    """
+    Lists tasks that have saved profiling output, newest first.
+
+    Returns:
+        list: Dictionaries with the task ID, modification time and available file names.
+    """
+    profiles = []
+    if not os.path.isdir(tasks_dir):
+        return profiles
+    for task_id in os.listdir(tasks_dir):
+        path = os.path.join(tasks_dir, task_id)
+        files = [name for name in PROFILE_FILES if os.path.isfile(os.path.join(path, name))]
+        if files:
+            profiles.append({"task_id": task_id, "modified": os.path.getmtime(path), "files": files})
+    return sorted(profiles, key=lambda profile: profile["modified"], reverse=True)
@@ -0,0 +1,172 @@
+import heapq
+import threading
+import time
+from collections import Counter, deque
+
+# Jobs of each queue allowed to run at once; the rest wait their turn
+JOB_LIMITS = {"split": 1, "mail": 2, "purge": 1}
+
+# Queue of each task kind (as passed to `metrics.start_task`); unknown kinds get a queue of their own
+QUEUES = {"split": "split", "split_batch": "split", "mail": "mail", "purge": "purge"}
+
+# Run times kept per queue for the ETA estimate
+HISTORY_SIZE = 20
+
+_lock = threading.Lock()
+_queued = dict()  # Queue -> jobs waiting, in submission order
+_running = dict()  # Queue -> {task ID: job}
+_durations = dict()  # Queue -> run times (seconds) of recently finished jobs
+_jobs = dict()  # Task ID -> job, while queued or running
+_served = dict()  # Queue -> {owner: sequence number of the owner's last started job}
+_sequence = 0
+
+
+def queue_of(kind):
+    return QUEUES.get(kind, kind)
+
+
+def submit(task_id, kind, owner, target, *args):
+    """
+    Queues a background job and starts it as soon as its queue has a free slot.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        kind (str): Task type, e.g. "split" or "mail"; selects the queue (see `QUEUES`).
+        owner (str): Admin who started the job, for fair sharing (see `_order`).
+        target (callable): The job function.
+        *args: Arguments for `target`.
+    """
+    queue = queue_of(kind)
+    job = {"task_id": task_id, "queue": queue, "owner": owner, "target": target, "args": args,
+           "submitted": time.time(), "started": None}
+    with _lock:
+        _jobs[task_id] = job
+        _queued.setdefault(queue, []).append(job)
+        _dispatch(queue)
+
+
+def _order(queue):
+    """
+    Returns the waiting jobs of a queue in the order they will start.
+
+    The next job belongs to the owner with the fewest jobs of this queue running or
+    already ordered, ties going to the owner served least recently, then to the longest
+    waiting job, so one admin queueing many jobs does not hold back another admin's
+    single job. Callers must hold `_lock`.
+    """
+    load = Counter(job["owner"] for job in _running.get(queue, {}).values())
+    served = dict(_served.get(queue, {}))
+    waiting = dict()
+    for job in _queued.get(queue, []):
+        waiting.setdefault(job["owner"], deque()).append(job)
+    order = []
+    turn = _sequence
+    while waiting:
+        owner = min(waiting, key=lambda name: (load[name], served.get(name, 0), waiting[name][0]["submitted"]))
+        order.append(waiting[owner].popleft())
+        load[owner] += 1
+        turn += 1
+        served[owner] = turn
+        if not waiting[owner]:
+            del waiting[owner]
+    return order
+
+
+def _dispatch(queue):
+    """Starts waiting jobs while the queue has free slots. Callers must hold `_lock`."""
+    global _sequence
+    running = _running.setdefault(queue, {})
+    while _queued.get(queue) and len(running) < JOB_LIMITS.get(queue, 1):
+        job = _order(queue)[0]
+        _queued[queue].remove(job)
+        job["started"] = time.time()
+        _sequence += 1
+        _served.setdefault(queue, {})[job["owner"]] = _sequence
+        running[job["task_id"]] = job
+        threading.Thread(target=_run, args=(job,)).start()
+
+
+def _run(job):
+    try:
+        job["target"](*job["args"])
+    finally:
+        with _lock:
+            _running[job["queue"]].pop(job["task_id"], None)
+            _jobs.pop(job["task_id"], None)
+            _durations.setdefault(job["queue"], deque(maxlen=HISTORY_SIZE)).append(time.time() - job["started"])
+            _dispatch(job["queue"])
+
+
+def cancel(task_id):
+    """
+    Removes a job that has not started from its queue.
+
+    Returns:
+        bool: Whether the job was waiting; a running job has to stop by itself.
+    """
+    with _lock:
+        job = _jobs.get(task_id)
+        if job is None or job["started"] is not None:
+            return False
+        _queued[job["queue"]].remove(job)
+        del _jobs[task_id]
+        return True
+
+
+def _average(queue):
+    durations = _durations.get(queue)
+    return sum(durations) / len(durations) if durations else None
+
+
+def job_status(task_id):
+    """
+    Describes where a job stands.
+
+    The ETA assumes every job takes the average run time of the queue's recent jobs:
+    each free or freed slot takes the next job in `_order`.
+
+    Returns:
+        dict: "state" ("queued" or "running"), "queue", "position" (1 for the next job to
+            start, None once running) and "eta" (seconds until it starts, None without
+            history), or None for an unknown or finished job.
+    """
+    with _lock:
+        job = _jobs.get(task_id)
+        if job is None:
+            return None
+        queue = job["queue"]
+        if job["started"] is not None:
+            return {"state": "running", "queue": queue, "position": None, "eta": 0}
+        order = _order(queue)
+        position = order.index(job)
+        average = _average(queue)
+        eta = None
+        if average is not None:
+            now = time.time()
+            slots = [max(0.0, average - (now - other["started"])) for other in _running[queue].values()]
+            slots += [0.0] * max(0, JOB_LIMITS.get(queue, 1) - len(slots))
+            heapq.heapify(slots)
+            for _ in range(position):
+                heapq.heappush(slots, heapq.heappop(slots) + average)
+            eta = slots[0]
+        return {"state": "queued", "queue": queue, "position": position + 1, "eta": eta}
+
+
+def _describe(job):
+    return {"task_id": job["task_id"], "owner": job["owner"], "submitted": job["submitted"]}
+
+
+def snapshot():
+    """
+    Lists the running and waiting jobs of every queue.
+
+    Returns:
+        dict: Maps each queue to its "limit", "running" jobs and "queued" jobs (in start
+            order); each job is given by its task ID, owner and the time it was queued.
+    """
+    with _lock:
+        queues = set(_queued) | set(_running) | set(JOB_LIMITS)
+        return {queue: {"limit": JOB_LIMITS.get(queue, 1),
+                        "running": [_describe(job) for job in _running.get(queue, {}).values()],
+                        "queued": [_describe(job) for job in _order(queue)]}
+                for queue in sorted(queues)}
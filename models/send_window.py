@@ -0,0 +1,103 @@
+import datetime
+import re
+
+_WINDOW = re.compile(r'^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$')
+
+
+def parse_windows(text):
+    """
+    Parses allowed sending times such as "22:00-06:00, 12:30-13:30".
+
+    A window may run past midnight ("22:00-06:00"); "00:00-24:00" is the whole day.
+
+    Args:
+        text (str): Comma-separated "HH:MM-HH:MM" windows in local time.
+
+    Returns:
+        list: (start, end) pairs in minutes after midnight; an empty list for blank text.
+
+    Raises:
+        ValueError: If a window is malformed.
+    """
+    windows = []
+    for part in filter(str.strip, (text or '').split(',')):
+        match = _WINDOW.match(part)
+        if not match:
+            raise ValueError(f"Invalid time window {part.strip()!r}; expected HH:MM-HH:MM.")
+        start_hour, start_minute, end_hour, end_minute = map(int, match.groups())
+        start, end = start_hour * 60 + start_minute, end_hour * 60 + end_minute
+        if start >= 24 * 60 or end > 24 * 60 or start_minute > 59 or end_minute > 59 or start == end:
+            raise ValueError(f"Invalid time window {part.strip()!r}.")
+        windows.append((start, end))
+    return windows
+
+
+def make_schedule(windows=None, finish_by=None):
+    """
+    Builds the schedule of a mail job from form or command line values.
+
+    Args:
+        windows (str, optional): Allowed sending times, see `parse_windows`.
+        finish_by (str, optional): Target finish time, "YYYY-MM-DD HH:MM" or "YYYY-MM-DDTHH:MM".
+
+    Returns:
+        dict: `windows` (the whole day when none are given) and `finish_by` (datetime or
+            None), or None when neither is set.
+
+    Raises:
+        ValueError: If a value is malformed.
+    """
+    windows = parse_windows(windows)
+    finish_by = datetime.datetime.fromisoformat(finish_by.strip()) if finish_by and finish_by.strip() else None
+    if not windows and finish_by is None:
+        return None
+    return {"windows": windows or [(0, 24 * 60)], "finish_by": finish_by}
+
+
+def _spans(windows, since, until):
+    """Yields the (start, end) datetimes of the windows overlapping [since, until), clipped to it."""
+    day = since.date() - datetime.timedelta(days=1)
+    while day <= until.date():
+        midnight = datetime.datetime.combine(day, datetime.time())
+        for start, end in windows:
+            span_start = midnight + datetime.timedelta(minutes=start)
+            span_end = midnight + datetime.timedelta(minutes=end if end > start else end + 24 * 60)
+            if span_end > since and span_start < until:
+                yield max(span_start, since), min(span_end, until)
+        day += datetime.timedelta(days=1)
+
+
+def next_opening(schedule, now):
+    """
+    Returns when the schedule next allows sending: `now` inside a window, else the start of the next one.
+    """
+    return min(start for start, _ in _spans(schedule["windows"], now, now + datetime.timedelta(days=2)))
+
+
+def allowed_seconds(schedule, now):
+    """Seconds of sending time the windows leave between `now` and the schedule's `finish_by`."""
+    return sum((end - start).total_seconds() for start, end in _spans(schedule["windows"], now, schedule["finish_by"]))
+
+
+def paced_rate(schedule, remaining, now, rate=None):
+    """
+    Works out the messages per second that spread the remaining messages evenly over
+    the sending time left before the target finish time.
+
+    Args:
+        schedule (dict): From `make_schedule`.
+        remaining (int): Messages still to send.
+        now (datetime.datetime): The current local time.
+        rate (float, optional): A fixed cap on messages per second, which always applies.
+
+    Returns:
+        float: Messages per second, or None to send without pacing (no target finish time,
+            or no sending time left before it).
+    """
+    if schedule["finish_by"] is None:
+        return rate
+    seconds = allowed_seconds(schedule, now)
+    if seconds <= 0:
+        return rate
+    paced = remaining / seconds
+    return min(paced, rate) if rate else paced
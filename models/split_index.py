@@ -0,0 +1,244 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process are kept apart
+    fcntl = None
+
+# Index of a split folder and the journal of moves applied since it was written;
+# the leading dot hides both from the explorer
+INDEX_FILE = '.index.json'
+JOURNAL_FILE = '.index.log'
+
+# Where an indexed file can be: the split folder itself or one of its mail result folders
+LOCATIONS = ('', 'success_mail', 'failed_mail')
+
+# Journal lines after which the index is rewritten with the moves folded in
+COMPACT_AFTER = 1000
+
+# Hex digits of the IPPIS hash naming a sharded file's subfolder; 2 gives 256 subfolders per location
+SHARD_WIDTH = 2
+
+_lock = threading.Lock()
+
+
+@contextmanager
+def _locked(folder, shared=False):
+    """
+    Holds a split folder's index lock.
+
+    Besides the threads of this process, the spawned split workers and `flask payroll worker`
+    processes read and write the same folders, so the folder itself is locked with `flock`:
+    shared for readers, exclusive for writers. Nothing is created to hold the lock, so reading
+    a folder never changes it.
+    """
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(folder, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # Releases the flock
+
+
+def ippis_of(filename):
+    """Returns the IPPIS number a split file is named after ("<ippis>_<surname>_<month>-<year>.pdf")."""
+    return filename.split('_')[0]
+
+
+def shard_of(ippis):
+    """Returns the subfolder a sharded split puts a person's file in: the start of the IPPIS number's MD5."""
+    return hashlib.md5(ippis.encode()).hexdigest()[:SHARD_WIDTH]
+
+
+def path_of(folder, name, entry, location=None):
+    """
+    Returns the path of an indexed file.
+
+    Args:
+        folder (str): The split folder.
+        name (str): The file name.
+        entry (dict): The file's index entry.
+        location (str, optional): One of `LOCATIONS`; the file's indexed location by default.
+
+    Returns:
+        str: The path, inside the entry's `shard` subfolder for sharded folders.
+    """
+    if location is None:
+        location = entry['location']
+    return os.path.join(folder, location, entry.get('shard', ''), name)
+
+
+def move_file(folder, name, entry, location, source=None):
+    """
+    Moves an indexed file to another location of its split folder, keeping its shard.
+
+    Moving a file that is already there does nothing, so a move can be repeated, e.g. by a
+    worker taking over the batch of one that died after moving some of its files.
+
+    Args:
+        folder (str): The split folder.
+        name (str): The file name.
+        entry (dict): The file's index entry.
+        location (str): One of `LOCATIONS`.
+        source (str, optional): Where the file is; its indexed path by default.
+
+    Returns:
+        str: `location`, to be journalled with `record_moves`.
+    """
+    target = path_of(folder, name, entry, location)
+    source = source or path_of(folder, name, entry)
+    if not os.path.exists(source) and os.path.exists(target):
+        return location
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.move(source, target)
+    return location
+
+
+def _write(folder, entries):
+    """Replaces the index atomically and drops the journal. Callers must hold the exclusive `_locked`."""
+    temp = os.path.join(folder, INDEX_FILE + '.tmp')
+    with open(temp, 'w') as f:
+        json.dump({'files': entries}, f)
+    os.replace(temp, os.path.join(folder, INDEX_FILE))
+    journal = os.path.join(folder, JOURNAL_FILE)
+    if os.path.exists(journal):
+        os.remove(journal)
+
+
+def write_index(folder, entries):
+    """
+    Writes the index of a split folder.
+
+    Args:
+        folder (str): The split folder.
+        entries (dict): Maps each file name to its `ippis`, `pages` (0-based pages of the source
+            PDF it holds), `page` (the first of them), `size`, `sha256`, `location` (one of
+            `LOCATIONS`) and `shard` (its subfolder in a sharded folder, see `shard_of`, or '').
+    """
+    with _locked(folder):
+        _write(folder, entries)
+
+
+def build_index(folder):
+    """
+    Indexes a folder by listing it, for folders split before indexes were written.
+
+    The PDFs of each location and of its shard subfolders are listed. Page numbers and
+    checksums are unknown for such folders and are left as None.
+
+    Returns:
+        dict: Entries as described in `write_index`.
+    """
+    entries = {}
+    for location in LOCATIONS:
+        path = os.path.join(folder, location)
+        if not os.path.isdir(path):
+            continue
+        for shard in [''] + [name for name in os.listdir(path)
+                             if name not in LOCATIONS and os.path.isdir(os.path.join(path, name))]:
+            for name in os.listdir(os.path.join(path, shard)):
+                if name.endswith('.pdf'):
+                    entries[name] = {'ippis': ippis_of(name), 'page': None, 'pages': None, 'sha256': None,
+                                     'location': location, 'shard': shard,
+                                     'size': os.path.getsize(os.path.join(path, shard, name))}
+    return entries
+
+
+def _load(folder):
+    """Reads the index, or lists an unindexed folder, and replays the journal. Callers must hold `_locked`."""
+    try:
+        with open(os.path.join(folder, INDEX_FILE)) as f:
+            entries = json.load(f)['files']
+    except (FileNotFoundError, ValueError, KeyError):
+        entries = build_index(folder)
+
+    try:
+        with open(os.path.join(folder, JOURNAL_FILE)) as f:
+            for line in f:
+                try:
+                    name, location = json.loads(line)
+                except ValueError:
+                    continue  # A line cut short by a crash
+                if location is None:
+                    entries.pop(name, None)
+                elif name in entries:
+                    entries[name]['location'] = location
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def load_index(folder):
+    """
+    Reads a split folder's index with the journalled moves applied.
+
+    A folder without an index is listed with `build_index`; the index is only saved by the
+    first move recorded in it (see `record_moves`), so reading a folder never writes to it.
+
+    Args:
+        folder (str): The split folder.
+
+    Returns:
+        dict: Entries as described in `write_index`.
+    """
+    with _locked(folder, shared=True):
+        return _load(folder)
+
+
+def files_in(folder, location='', ippis=None, entries=None):
+    """
+    Lists the indexed files at one location of a split folder.
+
+    Args:
+        folder (str): The split folder.
+        location (str): One of `LOCATIONS`.
+        ippis (set, optional): Only list files named after these IPPIS numbers.
+        entries (dict, optional): An index already read with `load_index`.
+
+    Returns:
+        list: File names, sorted.
+    """
+    if entries is None:
+        entries = load_index(folder)
+    return sorted(name for name, entry in entries.items()
+                  if entry['location'] == location and (ippis is None or entry['ippis'] in ippis))
+
+
+def record_moves(folder, moves):
+    """
+    Journals files moved between locations (or deleted) in one append.
+
+    Args:
+        folder (str): The split folder.
+        moves (dict): Maps file names to their new location, or None for deleted files.
+    """
+    if not moves:
+        return
+    with _locked(folder):
+        with open(os.path.join(folder, JOURNAL_FILE), 'a') as f:
+            f.writelines(json.dumps([name, location]) + '\n' for name, location in moves.items())
+            journal_size = f.tell()
+        # Fold the journal into the index once it holds roughly COMPACT_AFTER moves, or right
+        # away in a folder split before indexes were written, so it is not listed again
+        if journal_size > COMPACT_AFTER * 60 or not os.path.exists(os.path.join(folder, INDEX_FILE)):
+            _write(folder, _load(folder))
+
+
+def forget(path):
+    """Removes a deleted file from the index of the split folder it was in, if that folder is indexed."""
+    # The split folder is the file's folder, or up to two levels higher (location, then shard)
+    folder = os.path.dirname(path)
+    for _ in range(3):
+        if os.path.exists(os.path.join(folder, INDEX_FILE)):
+            record_moves(folder, {os.path.basename(path): None})
+            return
+        folder = os.path.dirname(folder)
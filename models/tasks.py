@@ -0,0 +1,21 @@
+import os
+
+from models.pdf_rel import base_dir
+
+# Per-task artefacts (profiles, logs) live here; the leading dot hides it from the explorer
+tasks_dir = os.path.join(base_dir, '.tasks')
+
+
+def task_dir(task_id):
+    """
+    Returns the artefact directory for a task, creating it if needed.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+
+    Returns:
+        str: Absolute path of the task's directory.
+    """
+    path = os.path.join(tasks_dir, os.path.basename(task_id))
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,105 @@
+import os
+import shutil
+import threading
+import time
+from secrets import token_hex
+
+from models import control
+from models.metrics import metrics_data, finish_task, incr
+from models.pdf_rel import base_dir, progress
+
+# Directories waiting to be purged; the leading dot hides it from the explorer
+trash_dir = os.path.join(base_dir, '.trash')
+
+# Entries removed between pauses of a purge
+PURGE_BATCH = 500
+
+# Seconds a purge pauses after each batch; longer while other tasks are running so their
+# reads and writes come first
+PURGE_PAUSE = 0.01
+PURGE_PAUSE_BUSY = 0.2
+
+_lock = threading.Lock()
+_purging = set()  # Trash entries a purge job has claimed
+
+
+def move_to_trash(path):
+    """
+    Moves a directory into `trash_dir` with a single rename, so it disappears at once.
+
+    Args:
+        path (str): The directory to delete.
+
+    Returns:
+        str: Its path in the trash, for `purge`.
+
+    Raises:
+        OSError: If the directory cannot be renamed, e.g. because it is on another file system.
+    """
+    os.makedirs(trash_dir, exist_ok=True)
+    trashed = os.path.join(trash_dir, f'{int(time.time())}-{token_hex(4)}-{os.path.basename(path)}')
+    os.rename(path, trashed)
+    return trashed
+
+
+def claim_leftovers():
+    """Claims trash entries no purge is working on, e.g. those left by a purge cut short by a restart."""
+    if not os.path.isdir(trash_dir):
+        return []
+    with _lock:
+        leftovers = [os.path.join(trash_dir, name) for name in os.listdir(trash_dir)
+                     if os.path.join(trash_dir, name) not in _purging]
+        _purging.update(leftovers)
+    return leftovers
+
+
+def _other_tasks_running(task_id):
+    return any(record["finished"] is None for other, record in list(metrics_data.items()) if other != task_id)
+
+
+def purge(task_id, paths):
+    """
+    Deletes trashed directories in the background.
+
+    Entries are counted first, then removed deepest first in batches of `PURGE_BATCH`
+    with a pause after each batch (`PURGE_PAUSE`, or `PURGE_PAUSE_BUSY` while another task
+    is running), so a large purge does not starve split and mail jobs of disk I/O.
+    Progress is published in `progress[task_id]`, and removed entries are counted as
+    `entries_deleted` in the task's metrics. The purge can be paused between batches and
+    canceled (see `models.control`); what it leaves is purged by the next one.
+
+    Args:
+        task_id (str): Unique identifier for the task.
+        paths (list): Directories in `trash_dir`, from `move_to_trash` or `claim_leftovers`.
+    """
+    with _lock:
+        _purging.update(paths)
+    try:
+        total = sum(len(dirs) + len(files) for path in paths for _, dirs, files in os.walk(path)) + len(paths)
+        removed = 0
+        for path in paths:
+            for root, dirs, files in os.walk(path, topdown=False):
+                entries = [(os.remove, os.path.join(root, name)) for name in files]
+                entries += [(os.rmdir, os.path.join(root, name)) for name in dirs]
+                for remove, entry in entries:
+                    try:
+                        remove(entry)
+                    except FileNotFoundError:
+                        pass
+                    removed += 1
+                    if removed % PURGE_BATCH == 0:
+                        incr(task_id, "entries_deleted", PURGE_BATCH)
+                        progress[task_id] = removed / total * 100
+                        if (control.sleep(task_id, PURGE_PAUSE_BUSY if _other_tasks_running(task_id) else PURGE_PAUSE)
+                                or control.checkpoint(task_id)):
+                            incr(task_id, "canceled")
+                            return
+            # Whatever the walk could not remove (e.g. entries created meanwhile) goes in one go
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        incr(task_id, "entries_deleted", removed % PURGE_BATCH)
+    finally:
+        with _lock:
+            _purging.difference_update(paths)
+        progress[task_id] = 100
+        finish_task(task_id)
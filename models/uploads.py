@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import threading
+from secrets import token_hex
+
+from models.pdf_rel import base_dir
+
+# Partial uploads and the content hash index; the leading dot hides it from the explorer
+uploads_dir = os.path.join(base_dir, '.uploads')
+
+CHUNK_SIZE = 8 * 1024 * 1024  # Part size the browser is asked to send
+READ_SIZE = 1024 * 1024  # Bytes read from the request stream at a time
+
+# In-memory state of uploads in progress, keyed by upload ID
+upload_state = dict()
+
+_lock = threading.Lock()
+
+
+class UploadError(Exception):
+    """Raised when a part cannot be accepted, e.g. because it does not start at the current offset."""
+
+
+def upload_id_for(key):
+    """Derives a stable upload ID from a client key (name, size and modification time) so retries resume."""
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def _part_path(upload_id):
+    return os.path.join(uploads_dir, f'{upload_id}.part')
+
+
+def _hash_index_path():
+    return os.path.join(uploads_dir, 'hashes.json')
+
+
+def _load_hash_index():
+    try:
+        with open(_hash_index_path()) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def _save_hash_index(index):
+    temp_index = _hash_index_path() + '.tmp'
+    with open(temp_index, 'w') as f:
+        json.dump(index, f)
+    os.replace(temp_index, _hash_index_path())
+
+
+def _file_record(name):
+    """Returns the size and modification time recorded for a file in the hash index."""
+    stat = os.stat(os.path.join(base_dir, name))
+    return {'name': name, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _verify_copy(record, digest):
+    """
+    Checks that the file a hash index entry names still holds the content it was indexed with.
+
+    The file may have been replaced since, e.g. by an upload under the same name. An entry
+    whose size and modification time are unchanged is trusted; otherwise the file is hashed
+    again. Runs without `_lock`, so hashing a large file never holds up other uploads; the
+    caller re-checks the returned record under the lock before relying on it.
+
+    Returns:
+        dict: The file's current record (see `_file_record`) if it matches `digest`, else None.
+    """
+    if isinstance(record, str):  # Entries written before sizes and times were recorded
+        record = {'name': record}
+    try:
+        current = _file_record(record['name'])
+    except FileNotFoundError:
+        return None
+    if current['size'] == record.get('size') and current['mtime'] == record.get('mtime'):
+        return current
+    if _file_digest(os.path.join(base_dir, record['name'])) != digest:
+        return None
+    return current
+
+
+def _index_file(index, name, digest):
+    """Points `digest` at `name`, dropping any entry that still names the replaced file. Callers must hold `_lock`."""
+    index = {key: record for key, record in index.items()
+             if (record if isinstance(record, str) else record['name']) != name}
+    index[digest] = _file_record(name)
+    _save_hash_index(index)
+
+
+def save_upload(stream, filename):
+    """
+    Stores a file sent in one request (the `/upload/` route), hashing it as it is written.
+
+    The file is written next to the partial uploads and renamed into the base directory, so
+    readers never see a partial file, and it is recorded in the hash index, so a later upload
+    of other content is never mistaken for a duplicate of what the name used to hold.
+
+    Args:
+        stream (file-like): The uploaded file.
+        filename (str): Name to store the file under in the base directory.
+
+    Returns:
+        str: Path of the stored file.
+    """
+    os.makedirs(uploads_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    temp = os.path.join(uploads_dir, f'{token_hex(8)}.part')
+    with open(temp, 'wb') as f:
+        for block in iter(lambda: stream.read(READ_SIZE), b''):
+            f.write(block)
+            digest.update(block)
+    target = os.path.join(base_dir, os.path.basename(filename))
+    with _lock:
+        os.replace(temp, target)
+        _index_file(_load_hash_index(), os.path.basename(target), digest.hexdigest())
+    return target
+
+
+def start_upload(upload_id, filename, size):
+    """
+    Starts or resumes a chunked upload.
+
+    Args:
+        upload_id (str): ID from `upload_id_for`.
+        filename (str): Name to store the file under in the base directory.
+        size (int): Total size of the file in bytes.
+
+    Returns:
+        dict: The upload's state; `offset` is where the next part must start.
+    """
+    os.makedirs(uploads_dir, exist_ok=True)
+    with _lock:
+        state = upload_state.get(upload_id)
+        if state is None or state['size'] != size or state['filename'] != filename:
+            state = upload_state[upload_id] = {'filename': filename, 'size': size, 'offset': 0, 'sha256': None,
+                                               'lock': threading.Lock()}
+    with state['lock']:
+        path = _part_path(upload_id)
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        if offset > size:
+            os.remove(path)
+            offset = 0
+        if state['sha256'] is None or state['offset'] != offset:
+            # Rebuild the running hash from whatever survived a restart or a dropped connection
+            state['sha256'] = hashlib.sha256()
+            if offset:
+                with open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(READ_SIZE), b''):
+                        state['sha256'].update(block)
+            state['offset'] = offset
+    return state
+
+
+def write_part(upload_id, offset, stream):
+    """
+    Appends one part to an upload, hashing it as it is written to disk.
+
+    The part is read from `stream` in `READ_SIZE` blocks, so request workers never hold
+    more than one block in memory. When the last byte arrives the upload is finished
+    with `finish_upload`.
+
+    Args:
+        upload_id (str): ID of an upload created by `start_upload`.
+        offset (int): Byte offset of this part within the file.
+        stream (file-like): The request body.
+
+    Returns:
+        dict: `offset` after the part and, once complete, `complete`, `sha256`, `path`
+              and `duplicate_of` (name of an identical existing file, or None).
+
+    Raises:
+        UploadError: If the upload is unknown, the offset does not match, or the part
+            overruns the declared size.
+    """
+    state = upload_state.get(upload_id)
+    if state is None:
+        raise UploadError('Unknown upload, start it again.')
+
+    with state['lock']:
+        if offset != state['offset']:
+            raise UploadError(f"Expected a part at offset {state['offset']}, got {offset}.")
+
+        with open(_part_path(upload_id), 'ab') as part:
+            for block in iter(lambda: stream.read(READ_SIZE), b''):
+                if state['offset'] + len(block) > state['size']:
+                    part.truncate(state['offset'])
+                    raise UploadError('Part overruns the declared file size.')
+                part.write(block)
+                state['sha256'].update(block)
+                state['offset'] += len(block)
+
+        result = {'offset': state['offset'], 'complete': False}
+        if state['offset'] == state['size']:
+            result.update(finish_upload(upload_id, state))
+        return result
+
+
+def finish_upload(upload_id, state):
+    """
+    Moves a completed upload into the base directory.
+
+    If a file with the same SHA-256 already exists, the part is discarded instead of
+    storing a second copy. The existing file is checked first (see `_verify_copy`), since it
+    may have been replaced after it was indexed, and checked again under the lock in case it
+    changed meanwhile. Otherwise the part is renamed over the target with `os.replace`, so
+    readers see either the old file or the complete new one, never a partial file.
+
+    Returns:
+        dict: `complete`, `sha256`, `path` of the stored file and `duplicate_of`.
+    """
+    digest = state['sha256'].hexdigest()
+    target = os.path.join(base_dir, os.path.basename(state['filename']))
+    part = _part_path(upload_id)
+
+    with _lock:
+        existing = _load_hash_index().get(digest)
+    verified = _verify_copy(existing, digest) if existing else None
+
+    with _lock:
+        index = _load_hash_index()
+        duplicate_of = None
+        if verified and index.get(digest) == existing:
+            try:
+                if _file_record(verified['name']) == verified:
+                    duplicate_of = verified['name']
+            except FileNotFoundError:
+                pass
+        if duplicate_of:
+            os.remove(part)
+            target = os.path.join(base_dir, duplicate_of)
+            if existing != verified:
+                # Rehashed: record the current size and time so the next check is cheap
+                index[digest] = verified
+                _save_hash_index(index)
+        else:
+            os.replace(part, target)
+            _index_file(index, os.path.basename(target), digest)
+        upload_state.pop(upload_id, None)
+
+    return {'complete': True, 'sha256': digest, 'path': target, 'duplicate_of': duplicate_of}
@@ -0,0 +1,71 @@
+// Uploads the selected file in fixed-size parts so large PDFs survive dropped connections.
+// Falls back to the plain form post when the browser cannot slice files.
+document.addEventListener("DOMContentLoaded", () => {
+    const form = document.getElementById("upload-form");
+    if (!form || !window.Blob || !Blob.prototype.slice) {
+        return;
+    }
+    const input = form.querySelector("input[type=file]");
+    const status = document.getElementById("upload-status");
+    const maxRetries = 5;
+
+    const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+    async function startUpload(file) {
+        const data = new FormData();
+        data.append("filename", file.name);
+        data.append("size", file.size);
+        data.append("key", `${file.name}:${file.size}:${file.lastModified}`);
+        const response = await fetch(form.dataset.chunkedAction, { method: "POST", body: data });
+        if (!response.ok) {
+            throw new Error(`Could not start upload (${response.status})`);
+        }
+        return response.json();
+    }
+
+    async function sendPart(uploadId, file, offset, chunkSize) {
+        const part = file.slice(offset, offset + chunkSize);
+        const response = await fetch(`${form.dataset.chunkedAction}${uploadId}/?offset=${offset}`, {
+            method: "PUT",
+            body: part,
+        });
+        if (!response.ok) {
+            throw new Error(`Upload failed at byte ${offset} (${response.status})`);
+        }
+        return response.json();
+    }
+
+    form.addEventListener("submit", async (event) => {
+        event.preventDefault();
+        const file = input.files[0];
+        if (!file) {
+            return;
+        }
+
+        let upload = await startUpload(file);
+        let offset = upload.offset;
+        let retries = 0;
+        let result = null;
+
+        do {
+            try {
+                result = await sendPart(upload.upload_id, file, offset, upload.chunk_size);
+                offset = result.offset;
+                retries = 0;
+                status.textContent = `${Math.floor((offset / Math.max(file.size, 1)) * 100)}% uploaded`;
+            } catch (error) {
+                if (++retries > maxRetries) {
+                    status.textContent = `${error.message}, select the file again to resume.`;
+                    return;
+                }
+                status.textContent = `${error.message}, retrying...`;
+                await sleep(1000 * retries);
+                // Ask the server where to continue from, the last part may have partly arrived
+                upload = await startUpload(file).catch(() => upload);
+                offset = upload.offset;
+            }
+        } while (!(result && result.complete));
+
+        window.location.href = result.redirect;
+    });
+});
@@ -0,0 +1,63 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The models resolve `data/` against the working directory when imported, so the tests run in
+# a scratch directory instead of writing into the checkout
+os.chdir(tempfile.mkdtemp(prefix="payroll-tests-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def sink():
+    from bench.smtp_sink import SinkServer
+
+    server = SinkServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def mail_server(sink, monkeypatch):
+    """Points the default sender account at the sink, with its counters reset."""
+    from models import mail_mod
+
+    if not os.path.exists("config.ini"):
+        with open("config.ini", "w") as f:
+            f.write("[Email]\nsmtp_server = 127.0.0.1\nsmtp_port = 25\nsmtp_security = none\n"
+                    "sender_email = payroll@example.test\nsender_password = test\nbatch_size = 20\n")
+    monkeypatch.setattr(mail_mod, "smtp_server", "127.0.0.1")
+    monkeypatch.setattr(mail_mod, "smtp_port", sink.port)
+    monkeypatch.setattr(mail_mod, "smtp_security", "none")
+    sink.reset_counters()
+    return sink
+
+
+@pytest.fixture
+def workspace(mail_server, tmp_path):
+    """A split folder of five payslips for active users in a fresh database, mailed through the sink."""
+    import app as web
+    from models.split_index import write_index
+
+    folder = str(tmp_path / "payroll")
+    os.makedirs(folder)
+    entries = {}
+    for number in range(5):
+        ippis = str(300000 + number)
+        name = f"{ippis}_TEST_JAN-2024.pdf"
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(b"%PDF-1.4\n")
+        entries[name] = {"ippis": ippis, "page": number, "pages": [number], "size": 9, "sha256": None,
+                         "location": "", "shard": ""}
+    write_index(folder, entries)
+
+    with web.app.app_context():
+        web.db.drop_all()
+        web.db.create_all()
+        web.db.session.add_all([web.User(f"user{entry['ippis']}@example.test", entry["ippis"], "Test", "TEST", None,
+                                         True) for entry in entries.values()])
+        web.db.session.add_all([web.ActiveUser(ippis=entry["ippis"]) for entry in entries.values()])
+        web.db.session.commit()
+        yield folder, sorted(entries)
@@ -0,0 +1,29 @@
+import os
+
+from models.metrics import metrics_data, start_task
+from models.pdf_rel import batch_splitter, batch_progress, colliding_outputs, output_folder
+
+
+def test_colliding_outputs_finds_same_stem_inputs():
+    files = [os.path.join("a", "March.pdf"), os.path.join("b", "March.pdf"),
+             "March.v1.pdf", "March.v2.pdf", "April.pdf"]
+    assert colliding_outputs(files) == {output_folder("March.pdf"): files[:4]}
+    assert colliding_outputs(["April.pdf", "May.pdf"]) == {}
+
+
+def test_batch_refuses_files_sharing_an_output_folder(tmp_path):
+    files = []
+    for sub in ("a", "b"):
+        os.makedirs(tmp_path / sub)
+        files.append(str(tmp_path / sub / "March.pdf"))
+        (tmp_path / sub / "March.pdf").write_bytes(b"%PDF-1.4\n")
+
+    start_task("collide", "split_batch")
+    results = batch_splitter(files, "collide", workers=1)
+
+    # Neither file was split, so neither could overwrite the other's payslips
+    assert results == {file: False for file in files}
+    assert not os.path.exists(output_folder(files[0]))
+    assert batch_progress["collide"] == {file: 100 for file in files}
+    counters = metrics_data["collide"]["counters"]
+    assert counters["output_conflicts"] == 2 and counters["files_failed"] == 2
@@ -0,0 +1,96 @@
+import smtplib
+from collections import deque
+from email.mime.text import MIMEText
+
+import pytest
+
+from bench.smtp_sink import SinkServer
+from models import mail_mod
+
+
+@pytest.mark.parametrize("code, text, expected", [
+    (550, "5.1.1 <someone@example.test>: Recipient address rejected: User unknown", "bounce"),
+    (550, b"5.1.1 Mailbox unavailable", "bounce"),
+    (556, "5.1.10 Recipient address has null MX", "bounce"),
+    (550, "5.2.1 Mailbox disabled, not accepting messages", "bounce"),
+    (553, "5.1.3 Bad recipient address syntax", "invalid"),
+    (550, "5.7.1 Message rejected as spam", None),
+    (550, "5.7.26 Unauthenticated email is not accepted", None),
+    (553, "5.7.1 Sender address rejected: not owned by user", None),
+    (550, "Mailbox unavailable", None),
+    (553, "Requested action not taken", None),
+    (501, "Syntax error in parameters", None),
+    (450, "4.1.1 Mailbox temporarily unavailable", None),
+    (554, "Transaction failed, see 5.1.1 in our policy", None),
+])
+def test_hard_bounce(code, text, expected):
+    assert mail_mod.hard_bounce(code, text) == expected
+
+
+class ScriptedServer:
+    """Stands in for a PIPELINING server, answering with the given replies in order."""
+
+    def __init__(self, replies):
+        self.replies = deque(replies)
+
+    def has_extn(self, name):
+        return name == "pipelining"
+
+    def send(self, data):
+        pass
+
+    def getreply(self):
+        return self.replies.popleft()
+
+    def rset(self):
+        self.replies.popleft()
+
+
+def test_only_rcpt_replies_count_as_refused():
+    envelopes = [(f"user{number}@example.test", MIMEText("payslip")) for number in range(3)]
+    server = ScriptedServer([
+        (550, b"5.1.1 Sender mailbox unknown"), (503, b"5.5.1 Need MAIL"), (503, b"5.5.1 Need RCPT"),
+        (250, b"OK"), (550, b"5.1.1 User unknown"), (554, b"5.5.1 No valid recipients"), (250, b"Reset"),
+        (250, b"OK"), (250, b"OK"), (354, b"Go ahead"), (554, b"5.1.1 Content rejected"),
+    ])
+    refused = set()
+    results = mail_mod.pipeline_messages(server, envelopes, "payroll@example.test", refused)
+
+    assert [code for code, _ in results] == [550, 550, 554]
+    assert refused == {1}
+
+
+def test_refused_recipients_are_recorded(mail_server, monkeypatch, tmp_path):
+    bouncing = SinkServer(rate_5xx=1.0).start()
+    try:
+        monkeypatch.setattr(mail_mod, "smtp_port", bouncing.port)
+        attachment = tmp_path / "100001_DOE_JAN-2024.pdf"
+        attachment.write_bytes(b"%PDF-1.4\n")
+        jobs = [(f"user{number}@example.test", "100001", attachment.name, str(attachment)) for number in range(2)]
+
+        outcomes = mail_mod.send_batch_with_attachments(jobs, "bounces")
+    finally:
+        bouncing.stop()
+
+    assert [sent for sent, _ in outcomes] == [False, False]
+    assert [(email, reason) for email, reason, _ in mail_mod.take_bounces("bounces")] == \
+        [("user0@example.test", "bounce"), ("user1@example.test", "bounce")]
+
+
+def test_sender_refusal_is_not_a_bounce(mail_server, monkeypatch):
+    class RefusingServer:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def sendmail(self, sender, recipient, message):
+            raise smtplib.SMTPSenderRefused(550, b"5.1.1 Sender mailbox unknown", sender)
+
+    monkeypatch.setattr(mail_mod, "smtp_connect", lambda task_id=None, account="default": RefusingServer())
+    sent, message = mail_mod.send_email_with_attachment("someone@example.test", "100001", "100001_DOE_JAN-2024.pdf",
+                                                        None, task_id="sender-refused")
+
+    assert not sent and message.startswith("Error sending email notification:\n550")
+    assert mail_mod.take_bounces("sender-refused") == []
@@ -0,0 +1,22 @@
+import json
+import os
+
+import app as web
+from models import log_store
+
+
+def test_dry_run_keeps_only_a_count_of_invalid_recipients(workspace, monkeypatch):
+    folder, files = workspace
+    web.create_mail_task("dry-invalid")
+    monkeypatch.setattr(web, "simulate_batch", lambda jobs, task_id: [(False, "550 5.1.1 No such user")] * len(jobs))
+
+    web.send_emails(folder, "dry-invalid", dry_run=True)
+
+    progress = web.mail_progress("dry-invalid")
+    assert progress["invalid"] == len(files) and progress["failed"] == len(files)
+    json.dumps(progress)  # Small and serialisable for every poll and event push
+    # The failures themselves are paged from the log store
+    page = web.log_page("dry-invalid", "errors", 1)
+    assert page["total"] == len(files)
+    assert {entry["file"] for entry in log_store.iter_entries("dry-invalid", "errors")} == set(files)
+    assert sorted(name for name in os.listdir(folder) if name.endswith(".pdf")) == files
@@ -0,0 +1,94 @@
+import os
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from models import page_cache
+from models.metrics import metrics_data, start_task
+from models.pdf_rel import splitter
+
+PAYSLIPS = [("100001", "DOE"), ("100002", "ROE"), ("100003", "POE")]
+
+
+def _stream(writer, data, **entries):
+    stream = DecodedStreamObject()
+    stream.set_data(data.encode())
+    stream.update({NameObject(key): value for key, value in entries.items()})
+    return writer._add_object(stream)
+
+
+def _payslip_text(ippis, surname):
+    lines = ["FEDERAL GOVERNMENT", "PAYSLIP", "", "JAN - 2024", f"Name: {surname}, JOHN", f"IPPIS Number: {ippis}"]
+    commands = " ".join(f"0 -14 Td ({line}) Tj" for line in lines)
+    return f"BT /F1 10 Tf 50 750 Td {commands} ET"
+
+
+def _xobject_pdf(path):
+    """Writes payslips whose pages share one content stream, `q /X1 Do Q`, each drawing its own form XObject."""
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({NameObject("/Type"): NameObject("/Font"),
+                                                NameObject("/Subtype"): NameObject("/Type1"),
+                                                NameObject("/BaseFont"): NameObject("/Helvetica")}))
+    for ippis, surname in PAYSLIPS:
+        writer.add_blank_page(612, 792)
+        page = writer.pages[-1]
+        form = _stream(writer, _payslip_text(ippis, surname), **{
+            "/Type": NameObject("/XObject"), "/Subtype": NameObject("/Form"),
+            "/BBox": page.mediabox,
+            "/Resources": DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})})
+        page[NameObject("/Contents")] = _stream(writer, "q /X1 Do Q")
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/XObject"): DictionaryObject({NameObject("/X1"): form})})
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+def _split(source, folder, task_id):
+    start_task(task_id, "split")
+    assert splitter(source, folder, task_id)
+    return metrics_data[task_id]["counters"]
+
+
+def test_digest_covers_form_xobjects(tmp_path):
+    source = str(tmp_path / "payroll.pdf")
+    _xobject_pdf(source)
+    pages = PdfReader(source).pages
+    assert len({page_cache.page_digest(page) for page in pages}) == len(PAYSLIPS)
+
+    # The same document read again hashes the same way
+    assert [page_cache.page_digest(page) for page in PdfReader(source).pages] == \
+        [page_cache.page_digest(page) for page in pages]
+
+
+def test_resplit_keeps_xobject_payslips_apart(tmp_path):
+    page_cache.clear()
+    source = str(tmp_path / "payroll.pdf")
+    _xobject_pdf(source)
+    folder = str(tmp_path / "payroll")
+
+    for run in ("first", "second"):
+        counters = _split(source, folder, f"xobject-{run}")
+        assert counters.get("pages_merged", 0) == 0
+        files = sorted(name for name in os.listdir(folder) if name.endswith(".pdf"))
+        assert files == [f"{ippis}_{surname}_JAN-2024.pdf" for ippis, surname in PAYSLIPS]
+    assert counters["cache_hits"] == len(PAYSLIPS)
+
+    for ippis, surname in PAYSLIPS:
+        reader = PdfReader(os.path.join(folder, f"{ippis}_{surname}_JAN-2024.pdf"))
+        reader.decrypt(f"{surname[:2]}{ippis[-2:]}")
+        assert len(reader.pages) == 1
+        assert surname in reader.pages[0].extract_text()
+
+
+def test_conflicting_digest_is_not_cached(tmp_path, monkeypatch):
+    page_cache.clear()
+    source = str(tmp_path / "payroll.pdf")
+    _xobject_pdf(source)
+    # A digest that cannot tell the pages apart, as the content-stream-only digest could not
+    monkeypatch.setattr("models.pdf_rel.page_digest", lambda page, seen=None: "same")
+    folder = str(tmp_path / "payroll")
+
+    counters = _split(source, folder, "xobject-conflict")
+    assert counters["cache_conflicts"] == 1
+    assert len([name for name in os.listdir(folder) if name.endswith(".pdf")]) == len(PAYSLIPS)
+    assert page_cache.get_many(["same"]) == {}
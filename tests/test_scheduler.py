@@ -0,0 +1,98 @@
+import threading
+import time
+
+import pytest
+
+from models import scheduler
+
+
+@pytest.fixture
+def queue(monkeypatch, request):
+    """A queue of its own for each test, allowing two jobs at once."""
+    name = request.node.name
+    monkeypatch.setitem(scheduler.JOB_LIMITS, name, 2)
+    return name
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+class Jobs:
+    """Submits jobs that run until released, recording how many run at once."""
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.release = {}
+        self.started = []
+        self.running = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def submit(self, task_id, owner="admin"):
+        self.release[task_id] = threading.Event()
+        scheduler.submit(task_id, self.queue, owner, self.run, task_id)
+
+    def run(self, task_id):
+        with self.lock:
+            self.started.append(task_id)
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+        self.release[task_id].wait(5)
+        with self.lock:
+            self.running -= 1
+
+    def finish(self, task_id):
+        self.release[task_id].set()
+        _wait_until(lambda: scheduler.job_status(task_id) is None)
+
+
+def test_limit_holds_back_jobs(queue):
+    jobs = Jobs(queue)
+    for index in range(5):
+        jobs.submit(f"{queue}-{index}")
+    _wait_until(lambda: len(jobs.started) == 2)
+    assert scheduler.job_status(f"{queue}-2")["position"] == 1
+    assert scheduler.job_status(f"{queue}-4")["position"] == 3
+
+    for index in range(5):
+        jobs.finish(f"{queue}-{index}")
+    assert jobs.started == [f"{queue}-{index}" for index in range(5)]
+    assert jobs.peak == 2
+
+
+def test_owners_take_turns(queue):
+    jobs = Jobs(queue)
+    for index in range(4):
+        jobs.submit(f"{queue}-busy-{index}", owner="busy")
+    jobs.submit(f"{queue}-other", owner="other")
+    _wait_until(lambda: len(jobs.started) == 2)
+
+    # The other admin's single job goes ahead of the busy admin's backlog
+    assert scheduler.job_status(f"{queue}-other")["position"] == 1
+    jobs.finish(f"{queue}-busy-0")
+    _wait_until(lambda: len(jobs.started) == 3)
+    assert jobs.started[2] == f"{queue}-other"
+
+    for task_id in list(jobs.release):
+        jobs.release[task_id].set()
+    _wait_until(lambda: len(jobs.started) == 5 and jobs.running == 0)
+
+
+def test_cancel_drops_waiting_job(queue):
+    jobs = Jobs(queue)
+    for index in range(3):
+        jobs.submit(f"{queue}-{index}")
+    _wait_until(lambda: len(jobs.started) == 2)
+
+    assert scheduler.cancel(f"{queue}-2")
+    assert not scheduler.cancel(f"{queue}-0")  # Running jobs stop by themselves
+    assert scheduler.job_status(f"{queue}-2") is None
+
+    jobs.finish(f"{queue}-0")
+    jobs.finish(f"{queue}-1")
+    assert f"{queue}-2" not in jobs.started
+    assert scheduler.snapshot()[queue] == {"limit": 2, "running": [], "queued": []}
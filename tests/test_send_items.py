@@ -0,0 +1,134 @@
+import datetime
+import os
+import threading
+import time
+
+import app as web
+from models.send_window import make_schedule
+from models.split_index import load_index, path_of
+
+
+def _lapse(task_id):
+    web.SendItem.query.filter_by(task_id=task_id).update({"lease_expires": time.time() - 1})
+    web.db.session.commit()
+
+
+def test_live_lease_is_not_claimed_twice(workspace):
+    folder, files = workspace
+    web.enqueue_send("lease-held", folder, files)
+    token, items = web.claim_batch("first", "lease-held")
+    assert len(items) == len(files)
+    assert web.claim_batch("second", "lease-held") == (None, [])
+
+    _lapse("lease-held")
+    token, items = web.claim_batch("second", "lease-held")
+    assert token.startswith("second:") and {item.attempts for item in items} == {2}
+
+
+def test_takeover_after_worker_died_mid_batch(workspace, sink):
+    folder, files = workspace
+    web.enqueue_send("takeover", folder, files)
+    web.claim_batch("dead", "takeover")
+    # The dead worker sent the first two files and moved them before committing their results
+    index = load_index(folder)
+    for name in files[:2]:
+        os.makedirs(os.path.join(folder, "success_mail"), exist_ok=True)
+        os.rename(path_of(folder, name, index[name]), path_of(folder, name, index[name], "success_mail"))
+    _lapse("takeover")
+
+    assert web.work_batch("live", "takeover") == len(files)
+
+    items = {item.file: item for item in web.SendItem.query.filter_by(task_id="takeover")}
+    assert {item.state for item in items.values()} == {"sent"}
+    assert {item.location for item in items.values()} == {"success_mail"}
+    # Only the files still in place were sent again
+    assert sink.messages == len(files) - 2
+    assert not any(sink.attempts[f"to:<user{items[name].ippis}@example.test>"] for name in files[:2])
+    assert all(sink.attempts[f"to:<user{items[name].ippis}@example.test>"] == 1 for name in files[2:])
+    assert sorted(os.listdir(os.path.join(folder, "success_mail"))) == files
+
+
+def test_bad_item_fails_alone(workspace, sink):
+    folder, files = workspace
+    web.enqueue_send("bad-item", folder, files)
+    os.remove(os.path.join(folder, files[0]))  # Neither in place nor moved: the send fails, the move cannot happen
+
+    assert web.work_batch("live", "bad-item") == len(files)
+
+    items = {item.file: item for item in web.SendItem.query.filter_by(task_id="bad-item")}
+    assert items[files[0]].state == "failed" and items[files[0]].location is None
+    assert all(items[name].state == "sent" for name in files[1:])
+    assert sink.messages == len(files) - 1
+
+
+def test_lapsing_leases_are_abandoned(workspace):
+    folder, files = workspace
+    web.enqueue_send("abandoned", folder, files)
+    for attempt in range(web.MAX_LEASES):
+        assert web.claim_batch(f"worker{attempt}", "abandoned")[1]
+        _lapse("abandoned")
+    assert web.claim_batch("last", "abandoned") == (None, [])
+
+    items = web.SendItem.query.filter_by(task_id="abandoned").all()
+    assert {item.state for item in items} == {"failed"} and {item.location for item in items} == {"failed_mail"}
+    assert all(item.email == f"user{item.ippis}@example.test" for item in items)
+    assert sorted(os.listdir(os.path.join(folder, "failed_mail"))) == files
+
+    web.create_mail_task("abandoned")
+    web.report_items("abandoned")
+    assert load_index(folder)[files[0]]["location"] == "failed_mail"
+    assert "None" not in web.progress_data["abandoned"]["logs"][0]["message"]
+
+
+def _coordinate(task_id, folder, files, schedule=None):
+    web.create_mail_task(task_id)
+
+    def run():
+        with web.app.app_context():
+            web.send_distributed(task_id, folder, files, schedule)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return web.progress_data[task_id], thread
+
+
+def _wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.05)
+
+
+def test_workers_do_not_claim_batches_of_a_paused_send(workspace, sink, monkeypatch):
+    folder, files = workspace
+    monkeypatch.setattr(web, "WORKER_POLL", 0.05)
+    web.control.register("held-paused")
+    web.control.pause("held-paused")
+    task, thread = _coordinate("held-paused", folder, files)
+
+    _wait_until(lambda: web.SendItem.query.filter_by(task_id="held-paused").count() == len(files))
+    assert web.claim_batch("other", "held-paused") == (None, [])
+    assert sink.messages == 0
+
+    web.control.resume("held-paused")
+    thread.join(5)
+    assert not thread.is_alive() and task["sent"] == len(files) and sink.messages == len(files)
+
+
+def test_workers_wait_for_the_sending_window(workspace, sink, monkeypatch):
+    folder, files = workspace
+    monkeypatch.setattr(web, "WORKER_POLL", 0.05)
+    start = datetime.datetime.now() + datetime.timedelta(hours=2)
+    schedule = make_schedule(f"{start:%H:%M}-{start + datetime.timedelta(hours=1):%H:%M}")
+    task, thread = _coordinate("held-window", folder, files, schedule)
+
+    _wait_until(lambda: task["resume_at"] is not None)
+    assert task["status"] == "paused"
+    assert web.claim_batch("other", "held-window") == (None, [])
+
+    # Canceled while held: the held items are canceled too, so the task ends
+    task["status"] = "canceled"
+    web.control.cancel("held-window")
+    thread.join(5)
+    assert not thread.is_alive() and task["completed"]
+    assert sink.messages == 0
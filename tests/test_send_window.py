@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+
+import app as web
+from models import control
+from models.send_window import make_schedule
+
+SCHEDULE = make_schedule("00:00-24:00")
+
+
+def _start(task_id):
+    web.create_mail_task(task_id)
+    return web.progress_data[task_id]
+
+
+def test_cancel_while_waiting_for_window(workspace, sink, monkeypatch):
+    folder, files = workspace
+    task = _start("window-cancel")
+
+    def wait_for_window(task_id, schedule):
+        # Canceled while the window is closed
+        task["status"] = "canceled"
+        control.cancel(task_id)
+        return True
+
+    monkeypatch.setattr(web, "wait_for_window", wait_for_window)
+    web.send_emails(folder, "window-cancel", schedule=SCHEDULE)
+
+    assert sink.messages == 0
+    assert sorted(name for name in os.listdir(folder) if name.endswith(".pdf")) == files
+    assert task["completed"]
+
+
+def test_pause_while_waiting_for_window(workspace, sink, monkeypatch):
+    folder, files = workspace
+    task = _start("window-pause")
+    resumed = []
+    waits = iter([True, False])
+
+    def resume():
+        resumed.append(time.monotonic())
+        control.resume("window-pause")
+
+    def wait_for_window(task_id, schedule):
+        if not resumed:
+            # Paused while the window is closed, resumed after it opened
+            control.pause(task_id)
+            threading.Timer(0.3, resume).start()
+        return next(waits)
+
+    sends = []
+    send = web.send_batch_with_attachments
+
+    def record(jobs, task_id):
+        sends.append(time.monotonic())
+        return send(jobs, task_id)
+
+    monkeypatch.setattr(web, "wait_for_window", wait_for_window)
+    monkeypatch.setattr(web, "send_batch_with_attachments", record)
+    web.send_emails(folder, "window-pause", schedule=SCHEDULE)
+
+    assert resumed and sends and sends[0] >= resumed[0]
+    assert sink.messages == len(files) and task["sent"] == len(files)
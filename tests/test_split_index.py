@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from models import split_index
+from models.split_index import INDEX_FILE, load_index, record_moves
+
+HOLD_LOCK = """
+import fcntl, os, sys, time
+fd = os.open(sys.argv[1], os.O_RDONLY)
+fcntl.flock(fd, fcntl.LOCK_EX)
+print('locked', flush=True)
+time.sleep(float(sys.argv[2]))
+"""
+
+
+def _unindexed_folder(tmp_path):
+    folder = tmp_path / "March"
+    os.makedirs(folder / "failed_mail")
+    for name in ("300001_DOE_JAN-2024.pdf", "300002_ROE_JAN-2024.pdf"):
+        (folder / name).write_bytes(b"%PDF-1.4\n")
+    return str(folder)
+
+
+def test_reading_an_unindexed_folder_leaves_it_unchanged(tmp_path):
+    folder = _unindexed_folder(tmp_path)
+    before = sorted(os.listdir(folder))
+
+    entries = load_index(folder)
+
+    assert sorted(entries) == ["300001_DOE_JAN-2024.pdf", "300002_ROE_JAN-2024.pdf"]
+    assert sorted(os.listdir(folder)) == before
+
+
+def test_first_move_saves_the_index(tmp_path):
+    folder = _unindexed_folder(tmp_path)
+    os.rename(os.path.join(folder, "300001_DOE_JAN-2024.pdf"),
+              os.path.join(folder, "failed_mail", "300001_DOE_JAN-2024.pdf"))
+
+    record_moves(folder, {"300001_DOE_JAN-2024.pdf": "failed_mail"})
+
+    assert os.path.exists(os.path.join(folder, INDEX_FILE))
+    assert load_index(folder)["300001_DOE_JAN-2024.pdf"]["location"] == "failed_mail"
+
+
+@pytest.mark.skipif(split_index.fcntl is None, reason="folders are only locked with flock")
+def test_index_lock_is_held_across_processes(tmp_path):
+    folder = _unindexed_folder(tmp_path)
+    holder = subprocess.Popen([sys.executable, "-c", HOLD_LOCK, folder, "0.5"], stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        started = time.monotonic()
+        load_index(folder)
+        # The read waited for the other process to finish writing
+        assert time.monotonic() - started > 0.3
+    finally:
+        holder.wait()
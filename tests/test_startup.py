@@ -0,0 +1,30 @@
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Loaded by the routes and commands that use them, never by importing the app
+HEAVY = ("PyPDF2", "smtplib", "email.mime", "flask_migrate", "alembic")
+
+
+def test_importing_the_app_loads_no_heavy_modules(tmp_path):
+    result = subprocess.run([sys.executable, "-c", "import json, sys, app; print(json.dumps(sorted(sys.modules)))"],
+                            cwd=tmp_path, env=dict(os.environ, PYTHONPATH=ROOT),
+                            capture_output=True, text=True, check=True)
+    loaded = json.loads(result.stdout.splitlines()[-1])
+
+    assert [name for name in loaded if name.startswith(HEAVY)] == []
+    # Nor does it create data/, config or the stores; create_app() does that
+    assert os.listdir(tmp_path) == []
+
+
+def test_payroll_help_and_usage_errors_create_nothing(tmp_path):
+    env = dict(os.environ, PYTHONPATH=ROOT, FLASK_APP="app")
+    for args, status in ((["--help"], 0), (["split", "--help"], 0), (["send", "--help"], 0),
+                         (["split"], 2), (["send", "--workers", "many"], 2)):
+        result = subprocess.run([sys.executable, "-m", "flask", "payroll", *args], cwd=tmp_path, env=env,
+                                capture_output=True, text=True)
+        assert result.returncode == status, (args, result.stderr)
+        assert os.listdir(tmp_path) == [], args
@@ -0,0 +1,13 @@
+import app as web
+from models import control
+
+
+def test_cancel_needs_a_login(workspace):
+    web.create_mail_task("cancel-anonymous")
+
+    response = web.app.test_client().post("/cancel_task/", data={"task_id": "cancel-anonymous", "folder": "",
+                                                                 "filename": ""})
+
+    assert response.status_code == 302 and "/login/" in response.location
+    assert not control.is_canceled("cancel-anonymous")
+    assert web.progress_data["cancel-anonymous"]["status"] == "running"
@@ -0,0 +1,45 @@
+import io
+import os
+
+from models import uploads
+from models.pdf_rel import base_dir
+
+
+def _upload(name, data):
+    upload_id = uploads.upload_id_for(f"{name}:{len(data)}:{data!r}")
+    uploads.start_upload(upload_id, name, len(data))
+    return uploads.write_part(upload_id, 0, io.BytesIO(data))
+
+
+def test_identical_upload_is_not_stored_twice():
+    assert _upload("first.pdf", b"same content")["duplicate_of"] is None
+    result = _upload("second.pdf", b"same content")
+    assert result["duplicate_of"] == "first.pdf"
+    assert not os.path.exists(os.path.join(base_dir, "second.pdf"))
+
+
+def test_replaced_file_is_not_a_duplicate():
+    _upload("report.pdf", b"old content")
+    uploads.save_upload(io.BytesIO(b"new content"), "report.pdf")
+
+    result = _upload("copy.pdf", b"old content")
+    assert result["duplicate_of"] is None
+    with open(os.path.join(base_dir, "copy.pdf"), "rb") as f:
+        assert f.read() == b"old content"
+    assert _upload("again.pdf", b"new content")["duplicate_of"] == "report.pdf"
+
+
+def test_changed_file_is_rehashed_outside_the_lock(monkeypatch):
+    _upload("ledger.pdf", b"ledger v1")
+    # Rewritten without going through the upload routes, same size
+    with open(os.path.join(base_dir, "ledger.pdf"), "wb") as f:
+        f.write(b"ledger v2")
+
+    digest = uploads._file_digest
+
+    def unlocked_digest(path):
+        assert not uploads._lock.locked()
+        return digest(path)
+
+    monkeypatch.setattr(uploads, "_file_digest", unlocked_digest)
+    assert _upload("ledger-copy.pdf", b"ledger v1")["duplicate_of"] is None